@@ -0,0 +1,83 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+
+class Agenda: #{{{
+   """
+   the candidate actions of the easy-first loop, kept in a heap.
+
+   the candidates of a pair of neighbouring tokens are pushed as a group,
+   under the id of the left token of the pair.  pushing a group again (or
+   dropping it) makes the previous entries of the group stale; stale
+   entries are thrown away when they reach the top of the heap.
+
+   key maps a candidate to its sort key, smallest first.
+   """
+   def __init__(self, key):
+      self.key = key
+      self.heap = []
+      self.version = {}
+
+   def clear(self):
+      self.heap = []
+      self.version = {}
+
+   def push(self, tid, cands):
+      v = self.version.get(tid,0) + 1
+      self.version[tid] = v
+      key = self.key
+      heap = self.heap
+      for cand in cands:
+         heapq.heappush(heap, (key(cand), tid, v, cand))
+
+   def drop(self, tid):
+      self.version[tid] = self.version.get(tid,0) + 1
+
+   def best(self, valid=None):
+      """
+      the best live candidate, or None.
+      candidates rejected by valid are removed for good.
+      """
+      heap = self.heap
+      version = self.version
+      while heap:
+         key, tid, v, cand = heap[0]
+         if v == version[tid] and (valid is None or valid(cand)):
+            return cand
+         heapq.heappop(heap)
+      return None
+
+   def ranked(self, valid=None):
+      """
+      the live candidates, best first.  lazy: only what is consumed is sorted.
+      """
+      heap = self.heap[:]
+      version = self.version
+      while heap:
+         key, tid, v, cand = heapq.heappop(heap)
+         if v == version[tid] and (valid is None or valid(cand)):
+            yield cand
+#}}}
+
+class Reversed(tuple): #{{{
+   """
+   a tuple that sorts the other way round: an Agenda keyed with it
+   pops the maximum first.
+   """
+   __slots__ = ()
+   def __lt__(self, other):
+      return tuple.__gt__(self, other)
+#}}}
@@ -13,13 +13,64 @@
 ##    You should have received a copy of the GNU General Public License
 ##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
 
-PAD={'lem':'_','dform':'__PAD__','ctag':'__PAD__','form':"__PAD__",'tag':'__PAD__','id':-1,'parent':-1,'pprel':'_'} # unify this location
-PADEND={'lem':'_','dform':'__PADE__','ctag':'__PADE__','form':"__PADE__",'tag':'__PADE__','id':-1,'parent':-1, 'pprel':'_'} # unify this location
-PADSTART={'lem':'_','dform':'__PADS__','ctag':'__PADS__','form':"__PADS__",'tag':'__PADS__','id':-1,'parent':-1, 'pprel':'_'} # unify this location
-PADMID={'lem':'_','dform':'__PADM__','ctag':'__PADM__','form':"__PADM__",'tag':'__PADM__','id':-1,'parent':-1,'pprel':'_'} # unify this location
-NOPARENT={'lem':'_','parent':-1,'id':-1,'tag':'NOPARENT','ctag':'NOPARENT','form':'_NOPARENT_','dform':'NOPARENT'}     # unify this location
+### Tokens #{{{
 
-ROOT={'lem':'_','parent':-1,'prel':'--','id':0,'tag':'ROOT','ctag':'ROOT','form':'_ROOT_','dform':'ROOT'}     # unify this location
+class Token(object):
+   """
+   a token of a sentence, with its fields as attributes (tok.form).
+   dict-style access (tok['form'], tok.get('extra'), 'pparent' in tok)
+   still works, for the old code.  a field that was never set is missing,
+   as a key of a dict would be.  tokens are compared by identity.
+   """
+   __slots__ = ('id','form','lem','tag','ctag','morph','parent','prel','extra',
+                'pparent','pprel','dform','s','span_id','partok','cand_parents')
+
+   def __init__(self, **fields):
+      for k,v in fields.iteritems():
+         setattr(self, k, v)
+
+   def __getitem__(self, k):
+      try:
+         return getattr(self, k)
+      except AttributeError:
+         raise KeyError(k)
+
+   def __setitem__(self, k, v):
+      setattr(self, k, v)
+
+   def __contains__(self, k):
+      return hasattr(self, k)
+
+   def get(self, k, default=None):
+      return getattr(self, k, default)
+
+   def keys(self):
+      return [k for k in self.__slots__ if hasattr(self, k)]
+
+   def items(self):
+      return [(k, getattr(self, k)) for k in self.keys()]
+
+   def copy(self):
+      return Token(**dict(self.items()))
+
+   def __getstate__(self):
+      return dict(self.items())
+
+   def __setstate__(self, state):
+      for k,v in state.iteritems():
+         setattr(self, k, v)
+
+   def __repr__(self):
+      return "Token(%s)" % ", ".join("%s=%r" % kv for kv in self.items())
+
+PAD=Token(lem='_',dform='__PAD__',ctag='__PAD__',form="__PAD__",tag='__PAD__',id=-1,parent=-1,pprel='_') # unify this location
+PADEND=Token(lem='_',dform='__PADE__',ctag='__PADE__',form="__PADE__",tag='__PADE__',id=-1,parent=-1, pprel='_') # unify this location
+PADSTART=Token(lem='_',dform='__PADS__',ctag='__PADS__',form="__PADS__",tag='__PADS__',id=-1,parent=-1, pprel='_') # unify this location
+PADMID=Token(lem='_',dform='__PADM__',ctag='__PADM__',form="__PADM__",tag='__PADM__',id=-1,parent=-1,pprel='_') # unify this location
+NOPARENT=Token(lem='_',parent=-1,id=-1,tag='NOPARENT',ctag='NOPARENT',form='_NOPARENT_',dform='NOPARENT')     # unify this location
+
+ROOT=Token(lem='_',parent=-1,prel='--',id=0,tag='ROOT',ctag='ROOT',form='_ROOT_',dform='ROOT')     # unify this location
+#}}}
 
 ### Data / structures #{{{
 
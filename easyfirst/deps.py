@@ -14,12 +14,15 @@
 ##    You should have received a copy of the GNU General Public License
 ##    along with This code.  If not, see <http://www.gnu.org/licenses/>.
 import sys
-import kskutil
 
 from collections import defaultdict
 
 class DependenciesCollection: #{{{
-   def __init__(self):
+   def __init__(self, order=None):
+      # order: a kskutil.TokenOrder, for sentences that get edited while
+      # parsing.  without it the token ids are their positions.
+      self.order = order
+      self._okey = order.key if order else (lambda tid: tid)
       self.deps = set()
       #self.all_childs = set()
       self._left_child = {}
@@ -32,184 +35,45 @@ class DependenciesCollection: #{{{
       self._labels = {}
       self._childs = defaultdict(list)
 
-   def decrement(self, idx_bound):
-       new_dep = set()
-       #print self.deps
-       for curr_p, curr_c in self.deps:
-           new_p = int(curr_p)
-           new_c = int(curr_c)
-           if curr_p == idx_bound or curr_c == idx_bound:
-               pass
-           else:
-               if curr_p > idx_bound:
-                   new_p -= 1
-               if curr_c > idx_bound:
-                   new_c -= 1
-               new_dep.add((new_p, new_c))
-       self.deps = new_dep
-       #print self.deps
-
-       for k, v in self._left_child.items():
-           new_k = int(k)
-           if k > idx_bound:
-               new_k -= 1
-           new_v = kskutil.decrementToken(v, idx_bound)
-           self._left_child[new_k] = new_v
-       for k, v in self._right_child.items():
-           new_k = int(k)
-           if k > idx_bound:
-               new_k -= 1
-           new_v = kskutil.decrementToken(v, idx_bound)
-           self._right_child[new_k] = new_v
-              
-       for k, v in self._left_child2.items():
-           if k > idx_bound:
-               self._left_child2[k-1] = v
-
-       for k, v in self._right_child2.items():
-           if k > idx_bound:
-               self._right_child2[k-1] = v
-
-      
-       for k, v in self._num_left_c.items():
-           if k > idx_bound:
-               self._num_left_c[k-1] = v
-
-       for k, v in self._num_right_c.items():
-           if k > idx_bound:
-               self._num_right_c[k-1] = v
-
-       for k, v in self._parents.items():
-           new_k = int(k)
-           if k == idx_bound: 
-               del self._parents[k]
-           if k > idx_bound:
-               new_k -= 1
-           new_v = kskutil.decrementToken(v, idx_bound)
-           self._parents[new_k] = new_v
-
-       for k, v in self._labels.items():
-           if k > idx_bound:
-               self._labels[k-1] = v
-
-       for k, v in self._childs.items():
-           new_k = int(k)
-           if k > idx_bound:
-               new_k -= 1
-           if k == idx_bound:
-               del self._childs[k]
-           
-           new_childs = []
-           for j, d_j in enumerate(v):
-               new_d_j = kskutil.decrementToken(d_j, idx_bound)
-               new_childs.append(new_d_j)
-           self._childs[new_k] = new_childs
-
-   def increment(self, idx_bound):
-       #print self.deps
-       new_dep = set()
-       for curr_p, curr_c in self.deps:
-           new_p = int(curr_p)
-           new_c = int(curr_c)
-           if curr_p >= idx_bound:
-               new_p += 1
-           if curr_c >= idx_bound:
-               new_c += 1
-           new_dep.add((new_p, new_c))
-       self.deps = new_dep
-       #print self.deps
-
-       for k in sorted(self._left_child.keys(), reverse=True):
-           v = self._left_child[k]
-           new_k = int(k)
-           if k >= idx_bound:
-               new_k += 1
-           new_v = kskutil.incrementToken(v, idx_bound)
-           self._left_child[new_k] = new_v
-
-       for k in sorted(self._right_child.keys(), reverse=True):
-           v = self._right_child[k]
-           new_k = int(k)
-           if k >= idx_bound:
-               new_k += 1
-           new_v = kskutil.incrementToken(v, idx_bound)
-           self._right_child[new_k] = new_v
-              
-       for k in sorted(self._left_child2.keys(), reverse=True):
-           v = self._left_child2[k]
-           if k >= idx_bound:
-               self._left_child2[k+1] = v
-
-       for k in sorted(self._right_child2.keys(), reverse=True):
-           v = self._right_child2[k]
-           if k >= idx_bound:
-               self._right_child2[k+1] = v
-
-       for k in sorted(self._num_left_c.keys(), reverse=True):
-           v = self._num_left_c[k]
-           if k >= idx_bound:
-               self._num_left_c[k+1] = v
-
-       for k in sorted(self._num_right_c.keys(), reverse=True):
-           v = self._num_right_c[k]
-           if k >= idx_bound:
-               self._num_right_c[k+1] = v
-
-       for k in sorted(self._parents.keys(), reverse=True):
-           v = self._parents[k]
-           new_k = int(k)
-           if k >= idx_bound:
-               new_k += 1
-           new_v = kskutil.incrementToken(v, idx_bound)
-           self._parents[new_k] = new_v
-
-       for k in sorted(self._labels.keys(), reverse=True):
-           v = self._labels[k]
-           if k >= idx_bound:
-               self._labels[k+1] = v
-
-       for k in sorted(self._childs.keys(), reverse=True):
-           v = self._childs[k]
-           new_k = int(k)
-           if k >= idx_bound:
-               new_k += 1
-           
-           new_childs = []
-           for j, d_j in enumerate(v):
-               new_d_j = kskutil.incrementToken(d_j, idx_bound)
-               new_childs.append(new_d_j)
-           self._childs[new_k] = new_childs
+   def before(self, tok1, tok2):
+      # is tok1 to the left of tok2 in the sentence?
+      return self._okey(tok1.id) < self._okey(tok2.id)
 
+   def position(self, tok):
+      # index of tok in the current sentence (its CoNLL id)
+      if self.order is None: return tok.id
+      return self.order.position(tok.id)
 
    def has_parent(self, child):
-      return child['id'] in self._parents
+      return child.id in self._parents
 
    def add(self, parent, child, label="_"):
-      self.deps.add((parent['id'], child['id']))
-      self._parents[child['id']]=parent
-      self._labels[child['id']] = label
-      self._childs[parent['id']].append(child)
-      child['pprel'] = label
-
-      pid = parent['id']
-      if child['id'] < parent['id']:
+      self.deps.add((parent.id, child.id))
+      self._parents[child.id]=parent
+      self._labels[child.id] = label
+      self._childs[parent.id].append(child)
+      child.pprel = label
+
+      pid = parent.id
+      before = self.before
+      if before(child, parent):
          lc = self.left_child(parent)
-         if (not lc) or child['id'] < lc['id']:
+         if (not lc) or before(child, lc):
             if lc: self._left_child2[pid]=lc
             self._left_child[pid]=child
             self._num_left_c[pid] = self._num_left_c.get(pid,0) + 1
 
-      if child['id'] > parent['id']:
+      if before(parent, child):
          rc = self.right_child(parent)
-         if (not rc) or child['id'] > rc['id']:
-            if rc: self._right_child2[parent['id']]=rc
-            self._right_child[parent['id']]=child
+         if (not rc) or before(rc, child):
+            if rc: self._right_child2[parent.id]=rc
+            self._right_child[parent.id]=child
             self._num_right_c[pid] = self._num_right_c.get(pid,0) + 1
 
    #{{{ remove
    def remove(self, parent, child):
-      pid = parent['id']
-      cid = child['id']
+      pid = parent.id
+      cid = child.id
       children = self.children(parent)
       children.remove(child)
       self.deps.remove((pid,cid))
@@ -218,22 +82,20 @@ class DependenciesCollection: #{{{
       if child == self.left_child(parent):
          del self._left_child[pid]
          if children:
-            if children[0]['id']<pid: self._left_child[pid]=children[0]
+            if self.before(children[0], parent): self._left_child[pid]=children[0]
       elif child == self.right_child(parent):
          del self._right_child[pid]
          if children:
-            if children[-1]['id']>pid: self._right_child[pid]=children[-1]
+            if self.before(parent, children[-1]): self._right_child[pid]=children[-1]
 
    def remove_left_children(self, parent):
-      pid = parent['id']
       for c in self.children(parent):
-         if c['id']>pid: break
+         if self.before(parent, c): break
          self.remove(parent,c)
 
    def remove_right_children(self,parent):
-      pid = parent['id']
       for c in self.children(parent):
-         if c['id']<pid: continue
+         if self.before(c, parent): continue
          self.remove(parent,c)
 
    def remove_parent(self,child):
@@ -241,52 +103,78 @@ class DependenciesCollection: #{{{
    #}}}
 
    def annotate(self, sent):
+      """
+      set the predicted parent (pparent) and label of the tokens.
+      sent is the sentence without the root, in order.  when the parse had
+      an order, the ids, parents and pparents are then renumbered to the
+      positions of the tokens (CoNLL ids).
+      """
+      if self.order is not None:
+         pos = self._positions(sent)
       for tok in sent:
          try:
-            tok['pparent'] = self._parents[tok['id']]['id']
-            tok['pprel'] = self._labels[tok['id']]
+            tok.pparent = self._parents[tok.id].id
+            tok.pprel = self._labels[tok.id]
          except KeyError: 
             sys.stderr.write("defaulting to root-parent")
             print self.deps
             raise
-            tok['pparent'] = 0
+            tok.pparent = 0
+      if self.order is not None:
+         self._renumber(sent, pos)
       return sent
 
    def annotate_allow_none(self, sent):
+      if self.order is not None:
+         pos = self._positions(sent)
       for tok in sent:
          try:
-            tok['pparent'] = self._parents[tok['id']]['id']
+            tok.pparent = self._parents[tok.id].id
          except KeyError: 
-            tok['pparent'] = -1
+            tok.pparent = -1
+      if self.order is not None:
+         self._renumber(sent, pos)
       return sent
 
+   def _positions(self, sent):
+      pos = dict((tok.id,k+1) for k,tok in enumerate(sent))
+      pos[0] = 0 # root
+      return pos
+
+   def _renumber(self, sent, pos):
+      # a gold parent that was deleted while parsing has no position any more
+      for tok in sent:
+         tok.id = pos[tok.id]
+         tok.parent = pos.get(tok.parent,-1)
+         if tok.pparent != -1: tok.pparent = pos[tok.pparent]
+
    def left_child(self, tok):
       if not tok: return None
-      return self._left_child.get(tok['id'],None)
+      return self._left_child.get(tok.id,None)
 
    def right_child(self, tok):
       if not tok: return None
-      return self._right_child.get(tok['id'],None)
+      return self._right_child.get(tok.id,None)
 
    def left_child2(self, tok):
       if not tok: return None
-      return self._left_child2.get(tok['id'],None)
+      return self._left_child2.get(tok.id,None)
 
    def right_child2(self, tok):
       if not tok: return None
-      return self._right_child2.get(tok['id'],None)
+      return self._right_child2.get(tok.id,None)
 
    def num_left_children(self, tok):
       if not tok: return 0
-      return self._num_left_c.get(tok['id'],0)
+      return self._num_left_c.get(tok.id,0)
 
    def num_right_children(self, tok):
       if not tok: return 0
-      return self._num_right_c.get(tok['id'],0)
+      return self._num_right_c.get(tok.id,0)
 
    def children(self, tok):
       if not tok: return []
-      return self._childs[tok['id']]
+      return self._childs[tok.id]
 
    def get_depth(self, tok):
       children = self.children(tok)
@@ -297,20 +185,21 @@ class DependenciesCollection: #{{{
    def left_labels(self, tok):
       if not tok: return None
       children = self.children(tok)
-      return "-".join([self.label_for(c) for c in children if c['id'] < tok['id']])
+      return "-".join([self.label_for(c) for c in children if self.before(c, tok)])
    def right_labels(self, tok):
       if not tok: return None
       children = self.children(tok)
-      return "-".join([self.label_for(c) for c in children if c['id'] > tok['id']])
+      return "-".join([self.label_for(c) for c in children if self.before(tok, c)])
 
    def label_for(self, tok):
-      return self._labels.get(tok['id'],None)
+      return self._labels.get(tok.id,None)
 
    def sibling(self, tok, i=1):
       if tok==None: return None
-      parent = self._parents.get(tok['id'],None)
-      if parent: parent = parent['id']
-      self._childs[parent].sort(key=lambda x:x['id'])
+      parent = self._parents.get(tok.id,None)
+      if parent: parent = parent.id
+      okey = self._okey
+      self._childs[parent].sort(key=lambda x:okey(x.id))
       siblings = self._childs[parent]
       index = siblings.index(tok)
       if 0 < (index+i) < len(siblings):
@@ -321,16 +210,16 @@ class DependenciesCollection: #{{{
       return self.right_border(tok) - self.left_border(tok)
 
    def parent(self, tok):
-      return self._parents[tok['id']] if tok['id'] in self._parents else None
+      return self._parents[tok.id] if tok.id in self._parents else None
 
    def right_border(self,tok):
       r = self.right_child(tok)
-      if not r: return int(tok['id'])
+      if not r: return int(self.position(tok))
       else: return self.right_border(r)
 
    def left_border(self,tok):
       l = self.left_child(tok)
-      if not l: return int(tok['id'])
+      if not l: return int(self.position(tok))
       else: return self.left_border(l)
 #}}}
 
@@ -18,25 +18,26 @@
 
 import math
 import random
+import hashlib
 import sys
 import os.path
 import cPickle as pickle
-from collections import defaultdict
+from collections import defaultdict, deque
 from itertools import izip,islice
 from tqdm import tqdm
 from deps import DependenciesCollection
 from ml.ml import MulticlassModel, MultitronParameters 
-from pio import io
+from pio import io, stream
 import isprojective 
 from common import PAD,ROOT
 from moduleloader import load_module
 import kskutil
+import lm
+from agenda import Agenda
+from ml.core import score_pairs, evict, easy_first, EditMasks
 from pattern.en import singularize, pluralize, lemma, conjugate
-import kenlm
 
-### specify your kenlm model
-#lmmodel = kenlm.Model("path_to_kenlm_model")
-lmmodel = kenlm.Model("../data/gigaword.kenlm")
+### the kenlm model is loaded when first needed: see lm.configure (--lm)
 
 TARGET_PREP = ["on", "about", "from", "for", "of", "to", "at", "in", "with", "by"]
 TARGET_VFORM = ["VB", "VBP", "VBZ", "VBG", "VBD", "VBN"]
@@ -47,6 +48,13 @@ DETS = ['a', 'an', 'the']
 DEBUG = False
 DEBUG_TRAIN = False
 
+def _train_key(order):
+   # best first, ties broken by position then class (stable sort order)
+   def key(cand):
+      score, cls, c, p, tid = cand
+      return (-score, order.key(tid), cls)
+   return key
+
 class Oracle: #{{{
    def __init__(self):
       self.sent = None
@@ -57,191 +65,240 @@ class Oracle: #{{{
          self.sent = sent
          self.childs = defaultdict(set)
          for tok in sent:
-            self.childs[tok['parent']].add((tok['parent'],tok['id']))
+            self.childs[tok.parent].add((tok.parent,tok.id))
 
-      if child['parent'] != parent['id']: 
+      if child.parent != parent.id: 
          return False
       # if child didn't collect all it's childs, it can't connect.
-      if len(self.childs[child['id']] - deps.deps) > 0:
+      if len(self.childs[child.id] - deps.deps) > 0:
          return False
-      if label and child['prel'] != label: return False
+      if label and child.prel != label: return False
       return True
    #}}}
 
+class RootCounts: #{{{
+   """
+   the gold structure of the tokens still to be attached (the roots, i.e.
+   parsed in train): how many of them have each token as gold parent, and
+   which ids they have.  kept up to date with add() and remove() as the
+   roots change, it gives the cost of an attachment in constant time.
+   """
+   def __init__(self, roots):
+      self.pending = defaultdict(int) # id: number of roots it heads in gold
+      self.ids = set()
+      for tok in roots:
+         self.add(tok)
+
+   def add(self, tok):
+      self.pending[tok.parent] += 1
+      self.ids.add(tok.id)
+
+   def remove(self, tok):
+      self.pending[tok.parent] -= 1
+      self.ids.discard(tok.id)
+
+   def attach_cost(self, parent, child):
+      # the gold children of child left among the roots (they lose their
+      # head), and its gold head if it is a root other than parent
+      cost = self.pending.get(child.id, 0)
+      if child.parent in self.ids and child.parent != parent.id:
+         cost += 1
+      return cost
+   #}}}
+
 class CostOracle: #{{{
    def __init__(self):
       self.sent = None
       self.childs = defaultdict(set)
 
-   def action_cost(self, roots, parent, child, action_type, orig_tokens, gold_tokens, label=None): # roots = parsed in train
+   def action_cost(self, roots, parent, child, action_type, orig_tokens, gold_tokens, label=None, pos=None, lmctx=None, align=None, counts=None): # roots = parsed in train
+      # pos: the position of parent in orig_tokens (token ids are not positions once the sentence was edited)
+      # lmctx: the lm.Context of orig_tokens, when the caller keeps one
+      # align: the kskutil.EditAlignment of orig_tokens and gold_tokens, likewise
+      # counts: the RootCounts of roots, likewise
+      if pos is None: pos = parent.id
+      if lmctx is None: lmctx = lm.Context(lm.model(), orig_tokens)
+      if align is None and action_type != "attach": align = kskutil.EditAlignment(orig_tokens, gold_tokens)
       #  after connecting child to parent:
       #  children of child on the roots list will not be able to get their correct head.
       #  child will not be able to acquire a new head on the roots list.
       cost = 0.0
-      edited_tokens = orig_tokens[:]
       if action_type == "attach":
-          for tok in roots: # id = token index, parent = parent index (both are int!)
-             if tok['parent'] == child['id']: 
-                cost += 1 # the child never becomes a parent of other tokens
-             if child['parent'] == tok['id'] and tok['id'] != parent['id']:
-                cost += 1 # the child has only one parent and if it is different, add cost
+          if counts is not None:
+             cost += counts.attach_cost(parent, child)
+          else:
+             for tok in roots: # id = token index, parent = parent index (both are int!)
+                if tok.parent == child.id: 
+                   cost += 1 # the child never becomes a parent of other tokens
+                if child.parent == tok.id and tok.id != parent.id:
+                   cost += 1 # the child has only one parent and if it is different, add cost
 
           if len(roots) > 2:
-              if parent['form'] == "_ROOT_" or child['form'] == "_ROOT_":
+              if parent.form == "_ROOT_" or child.form == "_ROOT_":
                   cost += 1
 
           return cost
 
       elif action_type == "substituteDet":
-          ed_before = kskutil.getEditDist(orig_tokens, gold_tokens)[0]
-          assert parent['form'] in DETS
-          assert parent['morph'] != 1
-          assert parent['tag'] == "DT"
+          ed_before = align.distance(pos)
+          assert parent.form in DETS
+          assert parent.morph != 1
+          assert parent.tag == "DT"
           candidates = ['a', 'the','an']
-          w_insert = candidates[0]
-          best_score = float('-inf')
-          for cand in candidates:
-              edited_tokens = orig_tokens[:]
-              edited_tokens[parent['id']] = cand
-              tmp_sent = " ".join(edited_tokens)
-              tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-              if best_score < tmp_score:
-                  best_score = tmp_score
-                  w_insert = cand
-          edited_tokens = orig_tokens[:]
-          edited_tokens[parent['id']] = w_insert
-          ed_after = kskutil.getEditDist(edited_tokens, gold_tokens)[0]
+          w_insert = candidates[lmctx.argmax(pos, candidates)[0]]
+          ed_after = align.substituted(pos, w_insert)
           if ed_before <= ed_after:
               cost += 1
           return cost
 
       elif action_type == "substituteNN":
-          ed_before = kskutil.getEditDist(orig_tokens, gold_tokens)[0]
+          ed_before = align.distance(pos)
           # NOTE parent is tok2, child is tok1
           # change parent(tok2) depending on part of speech
-          assert parent['tag'] in ('NN', 'NNS')
-          assert parent['morph'] != 1
+          assert parent.tag in ('NN', 'NNS')
+          assert parent.morph != 1
 
-          if parent['tag'] == "NN":
-              edited_tokens[parent['id']] = pluralize(parent['form'])
-          elif parent['tag'] == "NNS":
-              edited_tokens[parent['id']] = singularize(parent['form'])
+          if parent.tag == "NN":
+              w_insert = pluralize(parent.form)
+          elif parent.tag == "NNS":
+              w_insert = singularize(parent.form)
           else: 
               raise
 
-          ed_after = kskutil.getEditDist(edited_tokens, gold_tokens)[0]
+          ed_after = align.substituted(pos, w_insert)
           if ed_before < ed_after:
               cost += 1
           return cost
 
       # delete action
       elif action_type.startswith("delete"):
-          assert parent['morph'] != 1
-          ed_before = kskutil.getEditDist(orig_tokens, gold_tokens)[0]
-          edited_tokens.pop(parent['id'])
-          ed_after = kskutil.getEditDist(edited_tokens, gold_tokens)[0]
+          assert parent.morph != 1
+          ed_before = align.distance(pos)
+          ed_after = align.deleted(pos)
           if ed_before <= ed_after:
               cost += 1
           return cost
 
       elif action_type.startswith("insert"):
-          ed_before = kskutil.getEditDist(orig_tokens, gold_tokens)[0]
+          ed_before = align.distance(pos)
           w_insert = ""
 
-          if parent['lem'] != "I-NP":
+          if parent.lem != "I-NP":
               cost += 1
               return cost
 
           if action_type.startswith("insertDet"):
               candidates = DETS
-              w_insert = candidates[0]
-              best_score = float('-inf')
-              for cand in candidates:
-                  edited_tokens = orig_tokens[:]
-                  edited_tokens.insert(parent['id'], cand)
-                  tmp_sent = " ".join(edited_tokens)
-                  tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                  if best_score < tmp_score:
-                      best_score = tmp_score
-                      w_insert = cand
+              w_insert = candidates[lmctx.argmax(pos, candidates, insert=True)[0]]
 
           elif action_type.startswith("insertPrep"):
               candidates = TARGET_PREP
-              w_insert = candidates[0]
-              best_score = float('-inf')
-              for cand in candidates:
-                  edited_tokens = orig_tokens[:]
-                  edited_tokens.insert(parent['id'], cand)
-                  tmp_sent = " ".join(edited_tokens)
-                  tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                  if best_score < tmp_score:
-                      best_score = tmp_score
-                      w_insert = cand
+              w_insert = candidates[lmctx.argmax(pos, candidates, insert=True)[0]]
 
           assert w_insert != ""
 
-          edited_tokens = orig_tokens[:]
-          edited_tokens.insert(parent['id'], w_insert)
-
-          ed_after = kskutil.getEditDist(edited_tokens, gold_tokens)[0]
+          ed_after = align.inserted(pos, w_insert)
           if ed_before <= ed_after:
               cost += 1
           return cost
 
 
       elif action_type.startswith("substituteVform"):
-          ed_before = kskutil.getEditDist(orig_tokens, gold_tokens)[0]
+          ed_before = align.distance(pos)
 
-          assert parent['tag'].startswith("VB")
-          assert parent['morph'] != 1
+          assert parent.tag.startswith("VB")
+          assert parent.morph != 1
     
           candidates = []
           for ta in TENSE_ASPECTS:
-              candidates.append(str(conjugate(lemma(parent['form']), ta)))
-
-          w_insert = candidates[0]
-          best_score = float('-inf')
-          for cand in candidates:
-              edited_tokens = orig_tokens[:]
-              edited_tokens[parent['id']] = cand
-              tmp_sent = " ".join(edited_tokens)
-              tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-              if best_score < tmp_score:
-                  best_score = tmp_score
-                  w_insert = cand
-
-          edited_tokens = orig_tokens[:]
-          edited_tokens[parent['id']] = w_insert
-          ed_after = kskutil.getEditDist(edited_tokens, gold_tokens)[0]
+              candidates.append(str(conjugate(lemma(parent.form), ta)))
+
+          w_insert = candidates[lmctx.argmax(pos, candidates)[0]]
+
+          ed_after = align.substituted(pos, w_insert)
           if ed_before < ed_after:
               cost += 1
           return cost
 
       elif action_type.startswith("substitutePrep"):
-          assert parent['tag'].startswith("IN")
-          assert parent['morph'] != 1
+          assert parent.tag.startswith("IN")
+          assert parent.morph != 1
 
-          ed_before = kskutil.getEditDist(orig_tokens, gold_tokens)[0]
+          ed_before = align.distance(pos)
           candidates = TARGET_PREP
-          w_insert = candidates[0]
-          best_score = float('-inf')
-          for cand in candidates:
-              edited_tokens = orig_tokens[:]
-              edited_tokens[parent['id']] = cand
-              tmp_sent = " ".join(edited_tokens)
-              tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-              if best_score < tmp_score:
-                  best_score = tmp_score
-                  w_insert = cand
-          edited_tokens = orig_tokens[:]
-          edited_tokens[parent['id']] = w_insert
-          ed_after = kskutil.getEditDist(edited_tokens, gold_tokens)[0]
+          w_insert = candidates[lmctx.argmax(pos, candidates)[0]]
+          ed_after = align.substituted(pos, w_insert)
           if ed_before < ed_after:
               cost += 1
           return cost
       
       else:
           raise
+
+   def zero_cost(self, candidates, roots, orig_tokens, gold_tokens, position, lmctx=None, align=None, counts=None):
+      """
+      the first edit (class >= 2) and the first attachment with a zero cost
+      among candidates (agenda entries, best first), as (edit, attach),
+      None where there is none.  the cost of each candidate is computed
+      once at most: the attachments are not looked at past the first good
+      one, and nothing past the first good edit (which is preferred).
+      position(tid) is the position of a token in orig_tokens.
+      """
+      edit = attach = None
+      for cand in candidates:
+         s, cls, c, p, tid = cand
+         if cls < 2 and attach is not None: continue
+         if self.action_cost(roots, p, c, getActiontype(cls), orig_tokens, gold_tokens, pos=position(p.id), lmctx=lmctx, align=align, counts=counts) == 0:
+            if cls >= 2:
+               edit = cand
+               break
+            attach = cand
+      return edit, attach
+   #}}}
+
+class OracleCache: #{{{
+   """
+   what the oracle needs of a (training, gold) sentence pair before any
+   action, the same at every epoch: the alignment of their forms, packed
+   (kskutil.packAlignment), by pair.  a missing pair is computed when it
+   is first seen, for the later epochs, or ahead of time (in several
+   processes) by precompute_oracle.py.  with a path, the pairs are read
+   from that file, and save() writes them back.
+   """
+   def __init__(self, path=None):
+      self.path = path
+      self.pairs = {}
+      self.added = 0 # pairs not in the file yet
+      if path and os.path.exists(path):
+         self.pairs = pickle.load(open(path, "rb"))
+
+   @staticmethod
+   def forms(sent, gold_sent):
+      # the forms Parser.train aligns, _ROOT_ first
+      return [ROOT.form] + [tok.form for tok in sent], [ROOT.form] + [tok.form for tok in gold_sent]
+
+   @staticmethod
+   def key(orig_tokens, gold_tokens):
+      return hashlib.md5("%s\n%s" % ("\t".join(orig_tokens), "\t".join(gold_tokens))).digest()
+
+   def get(self, orig_tokens, gold_tokens):
+      key = self.key(orig_tokens, gold_tokens)
+      packed = self.pairs.get(key)
+      if packed is None:
+         packed = kskutil.packAlignment(orig_tokens, gold_tokens)
+         self.put(key, packed)
+      return packed
+
+   def put(self, key, packed):
+      self.pairs[key] = packed
+      self.added += 1
+
+   def save(self):
+      if self.path and self.added:
+         tmp = "%s.tmp" % self.path
+         pickle.dump(self.pairs, open(tmp, "wb"), pickle.HIGHEST_PROTOCOL)
+         os.rename(tmp, self.path)
+         self.added = 0
    #}}}
 
 class Parser: #{{{
@@ -250,6 +307,26 @@ class Parser: #{{{
       self.featExt=featExt
       self.oracle=oracle
       self.attachonly=attachonly
+      # a pair (parsed[m],parsed[m+1]) is scored from parsed[m-w..m+1+w]
+      self.window=getattr(featExt,'WINDOW',2)
+      # check every cached score against a fresh extraction (slow, for debugging)
+      self.verify_cache=False
+      # an lm.ScoreCache for the scores of the edit candidates, or None
+      self.lmcache=None
+      # an lm.DecisionCache for the choice among them, or None
+      self.lmdecisions=None
+      # an OracleCache for the alignments of the training pairs, or None
+      self.oraclecache=None
+
+   def _evict(self, parsed, x, *caches): #{{{
+      """
+      drop the cached entries of all the pairs that can see parsed[x],
+      or the gap right before it (after a removal), and return the
+      positions of these pairs.
+      the caches are keyed by the id of the left token of the pair.
+      """
+      return evict(parsed, x, self.window, caches)
+   #}}}
 
    def vis_parse(self, sent): #{{{
       deps = DependenciesCollection()
@@ -258,7 +335,7 @@ class Parser: #{{{
       sent = [ROOT]+sent
       connections = 0
       mistake=False
-      for tok in parsed: tok['s']=tok['form']
+      for tok in parsed: tok.s=tok.form
       fcache={}
       scache={}
       while len(parsed)>1:
@@ -267,7 +344,7 @@ class Parser: #{{{
          best_pair = None 
          scores = {}
          for i,(tok1,tok2) in enumerate(zip(parsed,parsed[1:])):
-            tid=tok1['id']
+            tid=tok1.id
             if tid in fcache:
                feats = fcache[tid]
             else:
@@ -298,8 +375,8 @@ class Parser: #{{{
          if to>=len(parsed):to=len(parsed)-1
          for tok in parsed[frm:to]:
             try:
-               del fcache[tok['id']]
-               del scache[tok['id']]
+               del fcache[tok.id]
+               del scache[tok.id]
             except: pass
          yield (self.oracle,sent, parsed, deps, scores)
          deps.add(p,c)
@@ -308,96 +385,35 @@ class Parser: #{{{
       yield (self.oracle,sent, parsed, deps, scores)
    #}}}
 
-   def parse(self, sent): #{{{
+   def parse(self, sent, edits=None): #{{{
+      """
+      parse sent (a list of tokens, which get edited), and return the
+      dependencies and the final sentence.
+      when edits is a list, the edits are appended to it as they are made:
+      (action type, position, old form, new form), position being the
+      CoNLL id of the token at the time of the edit.  old is None for an
+      insertion, new is None for a deletion.
+      """
       oracle=CostOracle()
-      deps = DependenciesCollection()
-
       sent = [ROOT]+sent
+      order = kskutil.TokenOrder(sent)
+      deps = DependenciesCollection(order)
       parsed = sent[:]
-      scache={}
-      fe=self.featExt.extract
-      gscore=self.scorer.get_scores
-      MAXEDITS = len(parsed)
-      num_edits = 0
-      while len(parsed)>1:
-         # find best action
-         _pairs=[]
-         for i,(tok1,tok2) in enumerate(izip(parsed,islice(parsed,1,None))): 
-            tid=tok1['id']
-            scache_list = []
-
-            if tid in scache:
-               scache_list = scache[tid]
-            else:
-               feats = fe(parsed,deps,i,sent)
-               scr = gscore(feats)
-                
-               for j, score_j in enumerate(scr):
-                   scache_list.append(scr[j])
-               scache[tid] = scache_list
-
-            # add attach actions (when allowed)
-            if len(parsed)>2 and tok1['form'] == "_ROOT_":
-                pass
-            elif len(parsed)==2 and tok1['form'] == "_ROOT_":
-                _pairs.append((scache_list[1],1,tok2,tok1,i))
-            else:
-                _pairs.append((scache_list[0],0,tok1,tok2,i+1))
-                _pairs.append((scache_list[1],1,tok2,tok1,i))
+      lmctx = lm.Context(lm.model(), [tok.form for tok in sent], self.lmcache, self.lmdecisions)
 
-            # new actions
-            if num_edits<=MAXEDITS and len(parsed) > 2:
-                # add NN substitution hypothesis
-                if tok2['tag'] in ('NN', 'NNS') and tok2['morph'] != 1:
-                    _pairs.append((scache_list[2],2,tok1,tok2,i+1))
-
-                # DT deletion hypothesis 
-                if tok2['form'] in DETS and tok2['morph'] != 1 and len(deps._childs[tok2['id']])==0:
-                        _pairs.append((scache_list[3],3,tok1,tok2,i+1))
-
-                # insert DT hypothesis
-                if tok2['tag'] in ('NN', 'NNS', 'JJ', 'JJR', 'JJS') and (not tok2['form'][0].isupper() and (tok1['tag']!='DT')):
-                    _pairs.append((scache_list[4],4,tok1,tok2,i+1))
-
-                # Vform substitution hypothesis:
-                if tok2['tag'].startswith("VB") and tok2['morph'] != 1:
-                    _pairs.append((scache_list[5],5,tok1,tok2,i+1)) # substitute to VB
-
-                # Prep substitution and deletion hypothesis:
-                if tok2['tag'] == "IN" and tok2['form'] in TARGET_PREP and tok2['morph'] != 1:
-                    _pairs.append((scache_list[6],6,tok1,tok2,i+1))
-                    if len(deps._childs[tok2['id']])==0: # we don't want to delete prep which already has a child.
-                        _pairs.append((scache_list[7],7,tok1,tok2,i+1))
-
-                # Prep insertion hypothesis:
-                if tok2['tag'] in PREV_PREP_TAGS and tok1['tag'] != "IN":
-                    _pairs.append((scache_list[8],8,tok1,tok2,i+1))
-
-                if tok2['form'] in DETS and tok2['tag'] == "DT" and tok2['id'] < len(sent) and tok2['morph'] != 1 and len(deps._childs[tok2['id']])==0:
-                    _pairs.append((scache_list[9],9,tok1,tok2,i+1))
-
-
-         assert len(_pairs) > 0
-         best,cls,c,p,locidx = max(_pairs)
+      def edit(cls, p):
+         # the edit cls of p, in sent and the LM context (the loop of
+         # ml.core keeps parsed): the token inserted before p, or None
          action_type = getActiontype(cls)
+         i = parsed.index(p) # index in parsed (not token id)
+         j = order.position(p.id) # index in sent
+         old_form = p.form
+         token_i = None
 
-         cost = 0
-         i = locidx # index in parsed (not token id)
-         j = ""
-         for j_tmp, t_id in enumerate(sent):
-             if t_id['id'] == p['id']:
-                 j = j_tmp
-
-         scache = {}
-         
-         if action_type == "attach":
-             deps.add(p,c)
-             parsed.remove(c)
-
-         elif action_type == "substituteDet":
-             assert parsed[i]['tag'] == "DT"
-             assert parsed[i]['form'] == sent[j]['form']
-             assert parsed[i]['form'] in ('a', 'an', 'the')
+         if action_type == "substituteDet":
+             assert parsed[i].tag == "DT"
+             assert parsed[i] is sent[j] # one token, edited once
+             assert parsed[i].form in ('a', 'an', 'the')
 
              if DEBUG:
                  print "substituteDet"
@@ -405,178 +421,68 @@ class Parser: #{{{
                  print "target is ", parsed[i]
  
              candidates = ['a', 'the', 'an']
-             best_score = float('-inf')
-             best_cand = candidates[0]
-             for cand in candidates:
-                 tmp_token = sent[:]
-                 tmp_token[j]['form'] = cand
-                 tmp_sent = " ".join([tt['form'] for tt in tmp_token])
-                 tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                 if best_score < tmp_score:
-                     best_score = tmp_score
-                     best_cand = cand
-             sent[j]['form'] = cand
-             parsed[i]['form'] = cand
-             sent[j]['morph'] = 1
-             parsed[i]['morph'] = 1
-
-             num_edits += 1
+             best_cand = candidates[lmctx.argmax(j, candidates)[0]]
+             parsed[i].form = best_cand
+             parsed[i].morph = 1
 
              if DEBUG:
                  print "substituted parse"
                  print parsed
 
          elif action_type == "substituteNN":
-             assert parsed[i]['tag'] in ("NN", "NNS")
-             assert parsed[i]['form'] == sent[j]['form']
+             assert parsed[i].tag in ("NN", "NNS")
+             assert parsed[i] is sent[j] # one token, edited once
              if DEBUG:
                  print "substituteNN"
                  print parsed
                  print "target is ", parsed[i]
-             if parsed[i]['tag'] == "NN":
-                 parsed[i]['form'] = pluralize(parsed[i]['form'])
-                 parsed[i]['tag'] = "NNS"
-                 sent[j]['form'] = pluralize(sent[j]['form'])
-                 sent[j]['tag'] = "NNS"
+             if parsed[i].tag == "NN":
+                 parsed[i].form = pluralize(parsed[i].form)
+                 parsed[i].tag = "NNS"
 
-
-             elif parsed[i]['tag'] == "NNS":
-                 parsed[i]['form'] = singularize(parsed[i]['form'])
-                 parsed[i]['tag'] = "NN"
-                 sent[j]['form'] = singularize(sent[j]['form'])
-                 sent[j]['tag'] = "NN"
+             elif parsed[i].tag == "NNS":
+                 parsed[i].form = singularize(parsed[i].form)
+                 parsed[i].tag = "NN"
 
              else:
-                 print parsed[i]['tag'] + ": something wrong"
+                 print parsed[i].tag + ": something wrong"
                  raise
              if DEBUG:
                  print "substituted parse"
                  print parsed
 
-             parsed[i]['morph'] = 1
-             sent[j]['morph'] = 1
-             num_edits += 1
+             parsed[i].morph = 1
 
          elif action_type.startswith("delete"):
-             assert p['id'] == parsed[i]['id']
-             delidx = parsed[i]['id']
-
-             if DEBUG:
-                 print "+++++ decrement dep +++++" , str(delidx)
-                 print deps.deps
-
-             deps.decrement(delidx)
-
-             if DEBUG:
-                print deps.deps
+             assert p.id == parsed[i].id
+             # the loop drops it from parsed
 
              if DEBUG:
-                 print "##### delete parsed token #####" , str(delidx)
+                 print "##### delete token #####" , str(p.id)
                  print parsed
-
-             del parsed[i]
-             if DEBUG:
-                 print parsed
-
-             if DEBUG:
-                 print "##### delete sent token #####" , str(delidx)
                  print sent
 
-             sent = [s_token for s_token in sent if s_token['id'] != delidx]
+             del sent[order.remove(p.id)]
              if DEBUG:
                  print sent
-
-             num_edits += 1
-
-             new_parsed = []
-             for p_token in parsed:
-                 p_token = kskutil.decrementToken(p_token, delidx)
-                 new_parsed.append(p_token)
-             parsed = new_parsed
-
-             new_sent = []
-             for s_token in sent:
-                 s_token = kskutil.decrementToken(s_token, delidx)
-                 new_sent.append(s_token)
-             sent = new_sent
                  
          elif action_type.startswith("insert"):
              if DEBUG:
                  print "insert"
              
-             assert p['id'] == parsed[i]['id']
-             insidx = p['id']
-
-             left_most_id = insidx
-             left_most_char = p['form'][0]
-             for child_i in deps._childs[i]:
-                 if left_most_id > child_i['id']:
-                     left_most_id = child_i['id']
-                     left_most_char = child_i['form'][0]
-
-             # 1. increment deps
-             if DEBUG:
-                 print "+++++ increment dep +++++" , str(insidx)
-                 print deps.deps
-             deps.increment(insidx)
-             if DEBUG:
-                 print deps.deps
-
-             # 2. increment parsed  (N.B. reversed order)
-             if DEBUG:
-                 print "##### increment parsed #####"
-                 print parsed
-             new_parsed = []
-             for p_token in parsed:
-                 p_token = kskutil.incrementToken(p_token, insidx)
-                 new_parsed.append(p_token)
-             parsed = new_parsed
-             if DEBUG:
-                 print parsed
+             assert p.id == parsed[i].id
 
-             if DEBUG:
-                 print "##### increment sent #####"
-                 print sent
-             new_sent = []
-             for s_token in sent:
-                 s_token = kskutil.incrementToken(s_token, insidx)
-                 new_sent.append(s_token)
-             sent = new_sent
-             if DEBUG:
-                 print sent
-
-             # 3. create token for insertion (with morph=1!)
-             token_i = ""
+             # 1. create token for insertion (with morph=1!), right before p
              if action_type.startswith("insertDet"):
                  candidates = DETS
-                 best_cand = candidates[0]
-                 best_score = float('-inf')
-                 for cand in candidates:
-                     tmp_sent_tokens = sent[:]
-                     tmp_tokens = [tt['form'] for tt in tmp_sent_tokens]
-                     tmp_tokens.insert(j, cand)
-                     tmp_sent = " ".join(tmp_tokens)
-                     tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                     if best_score < tmp_score:
-                         best_score = tmp_score
-                         best_cand = cand
-
-                 token_i = kskutil.tokenTemplate(insidx, best_cand, 'DT')
+                 best_cand = candidates[lmctx.argmax(j, candidates, insert=True)[0]]
+
+                 token_i = kskutil.tokenTemplate(order.new_id(), best_cand, 'DT', p.id)
 
              elif action_type.startswith("insertPrep"):
                  candidates = TARGET_PREP
-                 best_cand = candidates[0]
-                 best_score = float('-inf')
-                 for cand in candidates:
-                     tmp_sent_tokens = sent[:]
-                     tmp_tokens = [tt['form'] for tt in tmp_sent_tokens]
-                     tmp_tokens.insert(j, cand)
-                     tmp_sent = " ".join(tmp_tokens)
-                     tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                     if best_score < tmp_score:
-                         best_score = tmp_score
-                         best_cand = cand
-                 token_i = kskutil.tokenTemplate(insidx, best_cand, 'IN')
+                 best_cand = candidates[lmctx.argmax(j, candidates, insert=True)[0]]
+                 token_i = kskutil.tokenTemplate(order.new_id(), best_cand, 'IN', p.id)
 
              else:
                  raise
@@ -584,101 +490,85 @@ class Parser: #{{{
                  print "----- new token -----"
                  print token_i
 
-             # 4. insert the token to parsed
+             # 2. insert the token to sent (the loop inserts it to parsed)
              if DEBUG:
                  print "***** insert check *****"
-                 print "parsed: ", parsed
                  print "sent: ", sent
-             parsed.insert(i, token_i)
-             sent.insert(j, token_i)
+             sent.insert(order.insert_before(token_i.id, p.id), token_i)
              if DEBUG:
                  print "***** insert check *****"
-                 print "parsed: ", parsed
                  print "sent: ", sent
 
-             # 5. numedits++
-             num_edits += 1
-
          elif action_type.startswith("substituteVform"):
              
-             assert parsed[i]['tag'].startswith("VB")
-             assert parsed[i]['form'] == sent[j]['form']
+             assert parsed[i].tag.startswith("VB")
+             assert parsed[i] is sent[j] # one token, edited once
 
              if DEBUG:
-                 print "+++++ substitute Vform +++++" , parsed[i]['id']
+                 print "+++++ substitute Vform +++++" , parsed[i].id
                  print parsed
                  print sent
 
              # TARGET_VFORM, and TENSE_ASPECTS are the candidates
-             best_score = float('-inf')
-             best_cand = str(parsed[i]['form'])
-             best_tag = str(parsed[i]['tag'])
-             for t_vtag, t_tense in zip(TARGET_VFORM, TENSE_ASPECTS):
-                 tmp_tokens = sent[:]
-                 cand = str(conjugate(lemma(parsed[i]['form']), t_tense))
-                 tmp_tokens[j]['form'] = cand
-                 tmp_sent = " ".join([tt['form'] for tt in tmp_tokens])
-                 tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                 if best_score < tmp_score:
-                     best_score = tmp_score
-                     best_cand = cand
-                     best_tag = t_vtag
+             lem = lemma(parsed[i].form)
+             candidates = [str(conjugate(lem, t_tense)) for t_tense in TENSE_ASPECTS]
+             kbest = lmctx.argmax(j, candidates)[0]
+             best_cand = candidates[kbest]
+             best_tag = TARGET_VFORM[kbest]
              
-             sent[j]['form'] = best_cand
-             parsed[i]['form'] = best_cand
-             sent[j]['tag'] = best_tag
-             parsed[i]['tag'] = best_tag
-             sent[j]['morph'] = 1
-             parsed[i]['morph'] = 1
-
-             # 5. numedits++
-             num_edits += 1
+             parsed[i].form = best_cand
+             parsed[i].tag = best_tag
+             parsed[i].morph = 1
 
          elif action_type.startswith("substitutePrep"):
              if DEBUG:
                  print "substitutePrep"
 
-             assert parsed[i]['tag'].startswith("IN")
-             assert parsed[i]['form'] == sent[j]['form']
+             assert parsed[i].tag.startswith("IN")
+             assert parsed[i] is sent[j] # one token, edited once
 
              if DEBUG:
-                 print "+++++ substitute Prep +++++" , parsed[i]['id']
+                 print "+++++ substitute Prep +++++" , parsed[i].id
                  print parsed
                  print sentj
 
              candidates = TARGET_PREP
-             best_cand = candidates[0]
-             best_score = float('-inf')
-             for cand in candidates:
-                 tmp_sent_tokens = sent[:]
-                 tmp_sent_tokens[j]['form'] = cand
-                 tmp_sent = " ".join([tt['form'] for tt in tmp_sent_tokens])
-                 tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                 if best_score < tmp_score:
-                     best_score = tmp_score
-                     best_cand = cand
-             sent[j]['form'] = cand
-             parsed[i]['form'] = cand
-             parsed[i]['morph'] = 1
-             sent[j]['morph'] = 1
+             best_cand = candidates[lmctx.argmax(j, candidates)[0]]
+             parsed[i].form = best_cand
+             parsed[i].morph = 1
 
              if DEBUG:
                  print "***** substitute substitutePrep check *****"
                  print "parsed: ", parsed
                  print "sent: ", sent
  
-             num_edits += 1
-
 
          else: # sanity check of action type
              print 
              print action_type
              raise
 
+         if action_type.startswith("insert"):
+             lmctx.insert(j, token_i.form)
+         elif action_type.startswith("delete"):
+             lmctx.delete(j)
+         else:
+             lmctx.substitute(j, p.form)
+         if edits is not None:
+             if action_type.startswith("insert"):
+                 edits.append((action_type, j, None, token_i.form))
+             elif action_type.startswith("delete"):
+                 edits.append((action_type, j, old_form, None))
+             else:
+                 edits.append((action_type, j, old_form, p.form))
+         return token_i
+
+      easy_first(parsed, deps, sent, order, self.featExt.extract, self.scorer, self.window, edit, self.verify_cache)
+
       if DEBUG:
           print "===final deps (dev)==="
           print sorted([t[1] for t in deps.deps])
-      assert sorted([t[1] for t in deps.deps])[-1] == len(deps.deps)
+      assert len(deps.deps) == len(sent)-1 # every token but the root got a parent
 
       return deps, sent[1:]
 
@@ -753,7 +643,7 @@ class Parser: #{{{
          if e >= len(sent): continue
          remaining_toks_in_span[sid] = (e-s)
          for tok in sent[s:e+1]:
-            tok['span_id'] = sid
+            tok.span_id = sid
       scache={}
       fe=self.featExt.extract
       gscore=self.scorer.get_scores
@@ -772,7 +662,7 @@ class Parser: #{{{
             if sid1 != sid2:
                if remaining_toks_in_span[sid1] > 0 or remaining_toks_in_span[sid2] > 0:
                   continue
-            tid=tok1['id']
+            tid=tok1.id
             if tid in scache:
                s1,s2 = scache[tid]
             else:
@@ -794,7 +684,7 @@ class Parser: #{{{
          if to>=lp:to=lp-1
          for tok in parsed[frm:to]: 
             try:
-               del scache[tok['id']]
+               del scache[tok.id]
             except: pass
          # apply action
          deps.add(p,c)
@@ -821,7 +711,7 @@ class Parser: #{{{
          # find best action
          _pairs=[]
          for i,(tok1,tok2) in enumerate(izip(parsed,islice(parsed,1,None))): 
-            tid=tok1['id']
+            tid=tok1.id
             if tid in scache:
                s1,s2 = scache[tid]
             else:
@@ -843,11 +733,11 @@ class Parser: #{{{
          if to>=lp:to=lp-1
          for tok in parsed[frm:to]: 
             try:
-               del scache[tok['id']]
+               del scache[tok.id]
             except: pass
          # apply action
          deps.add(p,c)
-         order.append((p['id'],c['id'],anum))
+         order.append((p.id,c.id,anum))
          parsed.remove(c)
          lp-=1
       return deps, order
@@ -857,183 +747,105 @@ class Parser: #{{{
    def train(self, sent, gold_sent, iter_number, explore_policy=None): #{{{
       updates=0
 
-      sent = [ROOT]+sent
+      # the tokens are edited in place: keep the training sentence intact
+      sent = [ROOT]+[tok.copy() for tok in sent]
       gold_sent = [ROOT]+gold_sent
-      orig_tokens = [tok['form'] for tok in sent]
-      gold_tokens = [tok['form'] for tok in gold_sent]
+      orig_tokens = [tok.form for tok in sent]
+      gold_tokens = [tok.form for tok in gold_sent]
 
       self.scorer.tick()
-      deps = DependenciesCollection()
+      order = kskutil.TokenOrder(sent)
+      deps = DependenciesCollection(order)
       parsed = sent[:] # copying the sent list (avoid call by reference)
       fcache = {} # feature cache
       scache = {} # score cache
 
       num_edits = 0
       num_tokens = len(parsed)
+      masks = EditMasks(sent, deps)
+      lmctx = lm.Context(lm.model(), orig_tokens, self.lmcache, self.lmdecisions)
+      packed = self.oraclecache.get(orig_tokens, gold_tokens) if self.oraclecache is not None else None
+      align = kskutil.EditAlignment(orig_tokens, gold_tokens, packed) # for the oracle
+      counts = RootCounts(parsed) # likewise
+      agenda = Agenda(_train_key(order))
+      todo = None # positions of the pairs to (re)score, None for all of them
       while len(parsed)>1: #{{{
-         curr_tokens = [tok['form'] for tok in sent]
-         scored = []
-         for i,(tok1,tok2) in enumerate(zip(parsed,parsed[1:])):
-            scache_list = []
-            tid = tok1['id']
-            if tid in fcache: # if in cache, reuse it.
-               feats = fcache[tid]
-            else:
-               feats = self.featExt.extract(parsed,deps,i,sent)
-               fcache[tid]=feats
-
-            if tid in scache: # if in score cache, reuse it.
-               scache_list = scache[tid]
-            else:
-               scores = self.scorer.get_scores(feats)
-               for i, score_i in enumerate(scores):
-                   scache_list.append(scores[i])
-               scache[tid] = scache_list
-        
-            # additional huristics1 that prevent attach the root until the end
-            if len(parsed) > 2 and tok1['form'] == "_ROOT_": 
-                pass
-            # additional huristics2 that force to do right attach to ROOT at the end 
-            elif len(parsed) == 2 and tok1['form'] == "_ROOT_":
-                scored.append((scache_list[1],1,feats,tok2,tok1)) #tok2 is child of tok1 (parent) = right attach
-            else:
-                scored.append((scache_list[0],0,feats,tok1,tok2)) #tok1 is child of tok2 (parent) = left attach
-                scored.append((scache_list[1],1,feats,tok2,tok1)) #tok2 is child of tok1 (parent) = right attach
-
-            # new actions
-            if num_edits <= num_tokens and len(parsed) > 2:
-                # NN substitution hypothesis
-                if tok2['tag'] in ('NN', 'NNS') and tok2['morph'] != 1:
-                    scored.append((scache_list[2],2,feats,tok1,tok2)) 
-
-                # DT deletion hypothesis
-                if tok2['form'] in DETS and tok2['morph'] != 1 and len(deps._childs[tok2['id']])==0:
-                    scored.append((scache_list[3],3,feats,tok1,tok2))
-
-                # DT insertion hypothesis
-                if tok2['tag'] in ("NN", "NNS", "JJ", "JJR", "JJS") and (not tok2['form'][0].isupper() and (tok1['tag'] != 'DT')):
-                    #scored.append((s5,4,feats,tok1,tok2)) #insert definite article 
-                    scored.append((scache_list[4],4,feats,tok1,tok2)) #insert definite article 
-
-                # Vform substitution hypothesis:
-                if tok2['tag'].startswith("VB") and tok2['morph'] != 1:
-                    scored.append((scache_list[5],5,feats,tok1,tok2)) # substitute to VB
-
-                # Prep substitution and deletion hypothesis:
-                if tok2['tag'] == "IN" and tok2['form'] in TARGET_PREP and tok2['morph'] != 1:
-                    scored.append((scache_list[6],6,feats,tok1,tok2))
-
-                    # Prep deletion hypothesis 
-                    if len(deps._childs[tok2['id']])==0: # we don't want to delete prep which already has a child.
-                        scored.append((scache_list[7],7,feats,tok1,tok2))
-                    
-                # Prep insertion hypothesis
-                if tok2['tag'] in PREV_PREP_TAGS and tok1['tag']!="IN":
-                    scored.append((scache_list[8],8,feats,tok1,tok2))
-
-                # substitute DT
-                if tok2['form'] in DETS and tok2['tag'] =="DT" and tok2['id'] < len(sent) and tok2['morph'] != 1 and len(deps._childs[tok2['id']])==0:
-                    scored.append((scache_list[9],9,feats,tok1,tok2))
-                 
-         assert len(scored) > 0
-         scored=sorted(scored,key=lambda (s,cls,f,t1,t2):-s)
-         s,cls,f,c,p = scored[0]
+         curr_tokens = lmctx.words # the forms of sent
+         can_edit = num_edits <= num_tokens and len(parsed) > 2
+         if todo is None:
+            agenda.clear()
+            todo = xrange(len(parsed)-1)
+         score_pairs(todo, parsed, deps, sent, self.featExt.extract, self.scorer, scache, fcache, agenda, masks, can_edit)
+
+         valid = lambda cand: cand[1] < 2 or can_edit
+         best = agenda.best(valid)
+         assert best is not None
+         s,cls,c,p,tid = best
+         f = fcache[tid]
+         todo = []
 
          # debug
          if DEBUG_TRAIN:
              print "+++++ parsed detail +++++"
-             print cls, [z[1] for z in scored]
+             print cls, [z[1] for z in agenda.ranked(valid)]
              print "parent ", p
              print "child  ", c
-             print [z['form'] for z in parsed]
-             print [z['id'] for z in parsed]
-             print [z['parent'] for z in parsed]
+             print [z.form for z in parsed]
+             print [z.id for z in parsed]
+             print [z.parent for z in parsed]
 
          action_type = getActiontype(cls)
-         cost = self.oracle.action_cost(parsed,p,c,action_type,curr_tokens, gold_tokens)
+         cost = self.oracle.action_cost(parsed,p,c,action_type,curr_tokens, gold_tokens, pos=order.position(p.id), lmctx=lmctx, align=align, counts=counts)
          self.cumcost += cost
          if cost == 0:
             correct = True
          else:
             correct = False
             scache = {} # clear the cache -- numbers changed.
-            # find best allowable pair
-            best_action = []
-
-            # learn non-attach actions with priority
-            nonattach = False
-            for s,gcls,gf,gc,gp in scored[1:]:
-                g_action_type = getActiontype(gcls)
-                if gcls >= 2 and self.oracle.action_cost(parsed,gp,gc, g_action_type, curr_tokens, gold_tokens) == 0:
-                    nonattach = True
-                    break
-
-            if nonattach:
-                for s,gcls,gf,gc,gp in scored[1:]:
-                    g_action_type = getActiontype(gcls)
-                    if gcls >= 2 and self.oracle.action_cost(parsed,gp,gc, g_action_type, curr_tokens, gold_tokens) == 0:
-                        self.scorer.add(gf,gcls,1)
-                        break
-            else:
-                for s,gcls,gf,gc,gp in scored[1:]:
-                    g_action_type = getActiontype(gcls)
-                    if self.oracle.action_cost(parsed,gp,gc, g_action_type, curr_tokens, gold_tokens) == 0:
-                        self.scorer.add(gf,gcls,1)
-                        break
+            todo = None
+            # find best allowable pair, learning non-attach actions with priority
+            edit, attach = self.oracle.zero_cost(islice(agenda.ranked(valid),1,None), parsed, curr_tokens, gold_tokens, order.position, lmctx, align, counts)
+            good = edit or attach
+            if good is not None:
+                s,gcls,gc,gp,gtid = good
+                self.scorer.add(fcache[gtid],gcls,1)
 
             self.scorer.add(f,cls,-1)
             updates+=1
 
             if updates>200:
                print "STUCK, probably because of incomplete feature set"
-               print " ".join([x['form'] for x in sent])
-               print " ".join([x['form'] for x in parsed])
+               print " ".join([x.form for x in sent])
+               print " ".join([x.form for x in parsed])
                return
 
          if correct or (explore_policy and explore_policy.should_explore(iter_number)):
             # remove the neighbours of parent from the cache
             i = parsed.index(p)
 
-            j = ""
-            for j_tmp, t_id in enumerate(sent):
-                if t_id['id'] == p['id']:
-                    j = j_tmp
-
-            fcache = {}
-            scache = {}
+            j = order.position(p.id) # index in sent
 
             ### take actual action 
             if action_type == "attach":
                 deps.add(p,c)
                 parsed = [x for x in parsed if x!=c]
+                counts.remove(c)
 
             elif action_type == "substituteDet":
-                assert parsed[i]['tag'] == "DT"
-                assert parsed[i]['form'] == sent[j]['form']
-                assert parsed[i]['form'] in ('a', 'an', 'the')
+                assert parsed[i].tag == "DT"
+                assert parsed[i] is sent[j] # one token, edited once
+                assert parsed[i].form in ('a', 'an', 'the')
 
                 if DEBUG:
-                    print "+++++ substitute Det +++++" , parsed[i]['id']
+                    print "+++++ substitute Det +++++" , parsed[i].id
                     print parsed
                     print sent
 
                 candidates=['a','the','an']
-                best_score = float('-inf')
-                best_cand = candidates[0]
-                for cand in candidates:
-                    tmp_tokens = sent[:]
-                    tmp_tokens[j]['form'] = cand
-                    tmp_sent = " ".join([tt['form'] for tt in tmp_tokens])
-                    tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-
-                    if best_score < tmp_score:
-                        best_score = tmp_score
-                        best_cand = cand
+                best_cand = candidates[lmctx.argmax(j, candidates)[0]]
                 
-                sent[j]['form'] = cand
-                parsed[i]['form'] = cand
-                parsed[i]['morph'] = 1
-                sent[j]['morph'] = 1
+                parsed[i].form = best_cand
+                parsed[i].morph = 1
                
                 if DEBUG:
                     print "***** substitute check *****"
@@ -1043,35 +855,26 @@ class Parser: #{{{
                 num_edits += 1
 
             elif action_type == "substituteNN":
-                assert parsed[i]['tag'] in ("NN", "NNS")
-                assert parsed[i]['form'] == sent[j]['form']
+                assert parsed[i].tag in ("NN", "NNS")
+                assert parsed[i] is sent[j] # one token, edited once
 
                 if DEBUG:
-                    print "+++++ substitute NN +++++" , parsed[i]['id']
+                    print "+++++ substitute NN +++++" , parsed[i].id
                     print parsed
                     print sent
 
-                if parsed[i]['tag'] == "NN":
-                    parsed[i]['form'] = pluralize(parsed[i]['form'])
-                    parsed[i]['tag'] = "NNS"
-                    parsed[i]['morph'] = 1
+                if parsed[i].tag == "NN":
+                    parsed[i].form = pluralize(parsed[i].form)
+                    parsed[i].tag = "NNS"
+                    parsed[i].morph = 1
 
-                    sent[j]['form'] = pluralize(sent[j]['form'])
-                    sent[j]['tag'] = "NNS"
-                    sent[j]['morph'] = 1
+                elif parsed[i].tag == "NNS":
+                    parsed[i].form = singularize(parsed[i].form)
+                    parsed[i].tag = "NN"
+                    parsed[i].morph = 1
 
-
-                elif parsed[i]['tag'] == "NNS":
-                    parsed[i]['form'] = singularize(parsed[i]['form'])
-                    parsed[i]['tag'] = "NN"
-                    parsed[i]['morph'] = 1
-
-                    sent[j]['form'] = singularize(sent[j]['form'])
-                    sent[j]['tag'] = "NN"
-                    sent[j]['morph'] = 1
- 
                 else:
-                    print parsed[i]['tag'] + ": something wrong"
+                    print parsed[i].tag + ": something wrong"
                     raise
 
                 if DEBUG:
@@ -1085,35 +888,11 @@ class Parser: #{{{
                 if DEBUG:
                     print "delete"
 
-                assert p['id'] == parsed[i]['id']
-                delidx = p['id']
-
-                # 1. decrement deps (i is an index boundary)
-                if DEBUG:
-                    print "+++++ decrement dep +++++" , str(delidx)
-                    print deps.deps
-                deps.decrement(delidx)
-                if DEBUG:
-                    print deps.deps
-
-                # 2. delete the token
-                delidx = p['id']
+                assert p.id == parsed[i].id
+                # the token has no children: nothing in deps refers to it
                 del parsed[i]
-
-                sent = [s_token for s_token in sent if s_token['id'] != delidx]
-
-                # 3. decrement parsed
-                new_parsed = []
-                for p_token in parsed:
-                    p_token = kskutil.decrementToken(p_token, delidx)
-                    new_parsed.append(p_token)
-                parsed = new_parsed
-
-                new_sent = []
-                for s_token in sent:
-                    s_token = kskutil.decrementToken(s_token, delidx)
-                    new_sent.append(s_token)
-                sent = new_sent
+                del sent[order.remove(p.id)]
+                counts.remove(p)
 
                 num_edits += 1
 
@@ -1121,78 +900,19 @@ class Parser: #{{{
                 if DEBUG:
                     print "insert" 
 
-                assert p['id'] == parsed[i]['id']
-                insidx = p['id']
-                left_most_id = insidx
-                left_most_char = p['form'][0]
-                for child_i in deps._childs[insidx]:
-                    if left_most_id > child_i['id']:
-                        left_most_id = child_i['id']
-                        left_most_char = child_i['form'][0]
-                insidx = left_most_id
-
-                # 1. increment deps
-                if DEBUG:
-                    print "+++++ increment dep +++++" , str(insidx)
-                    print deps.deps
-                deps.increment(insidx)
-                if DEBUG:
-                    print deps.deps
-
-                # 2. increment parsed  (N.B. reversed order)
-                if DEBUG:
-                    print "##### increment parsed #####"
-                    print parsed
-                new_parsed = []
-                for p_token in parsed:
-                    p_token = kskutil.incrementToken(p_token, insidx)
-                    new_parsed.append(p_token)
-                parsed = new_parsed
-                if DEBUG:
-                    print parsed
-
-                if DEBUG:
-                    print "##### increment sent #####"
-                    print sent
-                new_sent = []
-                for s_token in sent:
-                    s_token = kskutil.incrementToken(s_token, insidx)
-                    new_sent.append(s_token)
-                sent = new_sent
-                if DEBUG:
-                    print sent
+                assert p.id == parsed[i].id
 
-                # 3. create token for insertion (with morph=1!)
+                # 1. create token for insertion (with morph=1!), right before p
                 token_i = ""
                 if action_type.startswith("insertDet"):
                     candidates = DETS
-                    best_cand = candidates[0]
-                    best_score = float('-inf')
-                    for cand in candidates:
-                        tmp_sent_tokens = sent[:]
-                        tmp_tokens = [tt['form'] for tt in tmp_sent_tokens]
-                        tmp_tokens.insert(j, cand)
-                        tmp_sent = " ".join(tmp_tokens)
-                        tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                        if best_score < tmp_score:
-                            best_score = tmp_score
-                            best_cand = cand
-                    token_i = kskutil.tokenTemplate(insidx, best_cand, 'DT')
+                    best_cand = candidates[lmctx.argmax(j, candidates, insert=True)[0]]
+                    token_i = kskutil.tokenTemplate(order.new_id(), best_cand, 'DT', p.id)
 
                 elif action_type.startswith("insertPrep"):
                     candidates = TARGET_PREP
-                    best_cand = candidates[0]
-                    best_score = float('-inf')
-                    for cand in candidates:
-                        tmp_sent_tokens = sent[:]
-                        tmp_tokens = [tt['form'] for tt in tmp_sent_tokens]
-                        tmp_tokens.insert(j, cand)
-                        tmp_sent = " ".join(tmp_tokens)
-                        tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                        if best_score < tmp_score:
-                            best_score = tmp_score
-                            best_cand = cand
-                    token_i = kskutil.tokenTemplate(insidx, best_cand, 'IN')
+                    best_cand = candidates[lmctx.argmax(j, candidates, insert=True)[0]]
+                    token_i = kskutil.tokenTemplate(order.new_id(), best_cand, 'IN', p.id)
 
                 else:
                     raise
@@ -1200,52 +920,42 @@ class Parser: #{{{
                     print "----- new token -----"
                     print token_i
 
-                # 4. insert the token to parsed
+                # 2. insert the token to parsed and sent
                 if DEBUG:
                     print "***** insert check *****"
                     print "parsed: ", parsed
                     print "sent: ", sent
                 parsed.insert(i, token_i)
-                sent.insert(j, token_i)
+                sent.insert(order.insert_before(token_i.id, p.id), token_i)
+                counts.add(token_i)
                 if DEBUG:
                     print "***** insert check *****"
                     print "parsed: ", parsed
                     print "sent: ", sent
 
-                # 5. numedits++
+                # 3. numedits++
                 num_edits += 1
 
             elif action_type.startswith("substituteVform"):
 
-                assert parsed[i]['tag'].startswith("VB")
-                assert parsed[i]['form'] == sent[j]['form']
+                assert parsed[i].tag.startswith("VB")
+                assert parsed[i] is sent[j] # one token, edited once
 
                 if DEBUG:
-                    print "+++++ substitute Vform +++++" , parsed[i]['id']
+                    print "+++++ substitute Vform +++++" , parsed[i].id
                     print parsed
                     print sent
 
                 # TARGET_VFORM, and TENSE_ASPECTS are the candidates
-                best_score = float('-inf')
-                best_cand = str(parsed[i]['form'])
-                best_tag = str(parsed[i]['tag'])
-                for t_vtag, t_tense in zip(TARGET_VFORM, TENSE_ASPECTS):
-                    tmp_tokens = sent[:]
-                    cand = str(conjugate(lemma(parsed[i]['form']), t_tense))
-                    tmp_tokens[j]['form'] = cand
-                    tmp_sent = " ".join([tt['form'] for tt in tmp_tokens])
-                    tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                    if best_score < tmp_score:
-                        best_score = tmp_score
-                        best_cand = cand
-                        best_tag = t_vtag
+                lem = lemma(parsed[i].form)
+                candidates = [str(conjugate(lem, t_tense)) for t_tense in TENSE_ASPECTS]
+                kbest = lmctx.argmax(j, candidates)[0]
+                best_cand = candidates[kbest]
+                best_tag = TARGET_VFORM[kbest]
                
-                sent[j]['form'] = best_cand
-                parsed[i]['form'] = best_cand
-                sent[j]['tag'] = best_tag
-                parsed[i]['tag'] = best_tag
-                sent[j]['morph'] = 1
-                parsed[i]['morph'] = 1
+                parsed[i].form = best_cand
+                parsed[i].tag = best_tag
+                parsed[i].morph = 1
 
                 # numedits++
                 num_edits += 1
@@ -1254,29 +964,18 @@ class Parser: #{{{
                 if DEBUG:
                     print "substitutePrep"
 
-                assert parsed[i]['tag'].startswith("IN")
-                assert parsed[i]['form'] == sent[j]['form']
+                assert parsed[i].tag.startswith("IN")
+                assert parsed[i] is sent[j] # one token, edited once
 
                 if DEBUG:
-                    print "+++++ substitute Prep +++++" , parsed[i]['id']
+                    print "+++++ substitute Prep +++++" , parsed[i].id
                     print parsed
                     print sent
 
                 candidates = TARGET_PREP
-                best_cand = candidates[0]
-                best_score = float('-inf')
-                for cand in candidates:
-                    tmp_sent_tokens = sent[:]
-                    tmp_sent_tokens[j]['form'] = cand
-                    tmp_sent = " ".join([tt['form'] for tt in tmp_sent_tokens])
-                    tmp_score = lmmodel.score(tmp_sent, bos=True, eos=True)
-                    if best_score < tmp_score:
-                        best_score = tmp_score
-                        best_cand = cand
-                sent[j]['form'] = cand
-                parsed[i]['form'] = cand
-                parsed[i]['morph'] = 1
-                sent[j]['morph'] = 1
+                best_cand = candidates[lmctx.argmax(j, candidates)[0]]
+                parsed[i].form = best_cand
+                parsed[i].morph = 1
 
                 if DEBUG:
                     print "***** substitute substitutePrep check *****"
@@ -1290,12 +989,41 @@ class Parser: #{{{
                 print action_type
                 raise
 
+            if action_type.startswith("insert"):
+                masks.update(token_i, deps)
+                lmctx.insert(j, token_i.form)
+                align.insert(j, token_i.form)
+            elif action_type.startswith("delete"):
+                lmctx.delete(j)
+                align.delete(j)
+            else:
+                masks.update(p, deps) # p was edited, or got a child
+                if action_type != "attach":
+                    lmctx.substitute(j, p.form)
+                    align.substitute(j, p.form)
+
+            # forget the features and scores of the pairs around the change
+            rescore_all = todo is None # the weights were updated
+            if action_type == "attach":
+                agenda.drop(c.id)
+                agenda.drop(parsed[-1].id) # the last token starts no pair
+                todo = self._evict(parsed, parsed.index(p), fcache, scache)
+            else:
+                if action_type.startswith("delete"):
+                    agenda.drop(p.id)
+                    agenda.drop(parsed[-1].id)
+                    fcache.pop(p.id,None)
+                    scache.pop(p.id,None)
+                todo = self._evict(parsed, i, fcache, scache)
+            if rescore_all or len(parsed) == 2:
+                todo = None
+
       #}}} end while
 
       if DEBUG:
           print "===final deps (train) ==="
           print sorted([t[1] for t in deps.deps])
-      assert sorted([t[1] for t in deps.deps])[-1] == len(deps.deps)
+      assert len(deps.deps) == len(sent)-1 # every token but the root got a parent
 
    #}}}
 
@@ -1377,10 +1105,11 @@ class Parser: #{{{
 
 
 class Model: #{{{
-   def __init__(self, featuresFile, weightFile, iter=None):
+   def __init__(self, featuresFile, weightFile, iter=None, lmFile=None):
       self._featuresFile = featuresFile
       self._weightFile = weightFile
       self._iter=iter
+      self.lmFile = lmFile # the LM it was trained with, when not the default
 
       featuresModule = load_module(featuresFile)
       self.fext = featuresModule.FeaturesExtractor()
@@ -1388,6 +1117,7 @@ class Model: #{{{
    def save(self, filename):
       fh = file(filename,"w")
       fh.write("%s\n%s\n" % (self._featuresFile, self._weightFile))
+      if self.lmFile: fh.write("%s\n" % self.lmFile)
       fh.close()
 
    @classmethod
@@ -1396,7 +1126,12 @@ class Model: #{{{
       dirname = os.path.dirname(filename)
       featuresFile = os.path.join(dirname,lines[0].strip())
       weightFile   = os.path.join(dirname,lines[1].strip())
-      return cls(featuresFile, weightFile, iter)
+      lmFile = None
+      if len(lines) > 2 and lines[2].strip():
+         lmFile = lines[2].strip()
+         if not lmFile.startswith("unix:"): # else an lm_server.py socket
+            lmFile = os.path.join(dirname,lmFile)
+      return cls(featuresFile, weightFile, iter, lmFile)
 
    def weightsFile(self, iter):
       if iter is None: iter = self._iter
@@ -1406,13 +1141,85 @@ class Model: #{{{
       return self.fext
 #}}}
 
-def train(attachonly, sents, gold_sents, model, dev=None, ITERS=20, save_every=None, explore_policy=None, shuffle_sents=True):
+def _train_shard(job):
+   # runs in a worker of train(): sentences lo..hi of the epoch, from the
+   # weights of the parent (flushed at step start).  a worker takes one
+   # shard only (its copy of the weights is then spent).
+   lo, hi, seed, ITER, start = job
+   parser = _shared['parser']
+   random.seed(seed)
+   if parser.lmcache is not None: parser.lmcache.detach()
+   parser.cumcost = 0
+   for sent, gold_sent in _shared['pairs'][lo:hi]:
+      parser.train(sent, gold_sent, ITER, _shared['explore'])
+   cache = parser.lmcache
+   scores = (cache.new, (cache.hits, cache.disk_hits, cache.misses)) if cache is not None else None
+   # the features it didn't update are those of the parent
+   return parser.scorer.changes(start), parser.cumcost, scores
+
+def _train_mixed(parser, sents, gold_sents, ITER, explore_policy, workers):
+   """
+   an epoch of iterative parameter mixing: the sentences are split into
+   one shard per worker, each trained in a process forked from the
+   current weights, and the weights they end with are mixed (see
+   ml.MultitronMixer) in shard order, each as it comes back.  the seed of
+   each shard is drawn here, so the result depends on the seed and
+   workers only.
+   """
+   import multiprocessing
+   from ml.ml import MultitronMixer
+   n = len(sents)
+   mixer = MultitronMixer(parser.scorer, workers)
+   jobs = [(k*n//workers, (k+1)*n//workers, random.randint(0, sys.maxint), ITER, mixer.start) for k in xrange(workers)]
+   if parser.lmcache is not None: parser.lmcache.flush()
+   _shared['parser'] = parser
+   _shared['pairs'] = zip(sents, gold_sents)
+   _shared['explore'] = explore_policy
+   parser.cumcost = 0
+   cache = parser.lmcache
+   pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+   try:
+      for k, (changes, cost, scores) in enumerate(pool.imap(_train_shard, jobs, 1)):
+         mixer.add(*changes)
+         del changes # freed before the next shard comes back
+         print "%d:%d-%d (%s)" % (k, jobs[k][0], jobs[k][1], cost),
+         sys.stdout.flush()
+         parser.cumcost += cost
+         if cache is not None:
+            new, (hits, disk_hits, misses) = scores
+            for key, v in new.iteritems():
+               cache.put(key, v)
+            cache.hits += hits
+            cache.disk_hits += disk_hits
+            cache.misses += misses
+      pool.close()
+   except:
+      pool.terminate()
+      raise
+   finally:
+      pool.join()
+      _shared.clear()
+   mixer.done()
+
+def train(attachonly, sents, gold_sents, model, dev=None, ITERS=20, save_every=None, explore_policy=None, shuffle_sents=True, lm_cache=None, oracle_cache=None, workers=1):
+   # lm_cache: an lm.ScoreCache (closed at the end), or None
+   # oracle_cache: an OracleCache (saved after the first epoch), or None for one in memory
+   # workers: processes for iterative parameter mixing (see _train_mixed), 1 to train serially
 
    fext = model.featureExtractor()
    oracle=CostOracle()
    scorer=MultitronParameters(10)
 
    parser=Parser(attachonly, scorer, fext, oracle)
+   parser.lmcache=lm_cache
+   parser.oraclecache=oracle_cache if oracle_cache is not None else OracleCache()
+   if workers > 1:
+      # the workers would each compute them, and lose them
+      for sent, gold_sent in izip(sents, gold_sents):
+         parser.oraclecache.get(*OracleCache.forms(sent, gold_sent))
+      # loaded once, before the fork (not when deferred: the scores then
+      # come from the lm_cache file, and a worker loads it for a missing one)
+      lm.model()
    for ITER in xrange(1,ITERS+1):
       parser.cumcost = 0
       print "Iteration",ITER,"[",
@@ -1422,12 +1229,21 @@ def train(attachonly, sents, gold_sents, model, dev=None, ITERS=20, save_every=N
           tmp = zip(*tmp)
           sents = list(tmp[0])
           gold_sents = list(tmp[1])
-      for i,sent in enumerate(sents):
-         if i%100==0: 
-            print i,"(%s)" % parser.cumcost,
-            sys.stdout.flush()
-         parser.train(sent, gold_sents[i], ITER, explore_policy)
+      if workers > 1:
+         _train_mixed(parser, sents, gold_sents, ITER, explore_policy, workers)
+      else:
+         for i,sent in enumerate(sents):
+            if i%100==0: 
+               print i,"(%s)" % parser.cumcost,
+               sys.stdout.flush()
+            parser.train(sent, gold_sents[i], ITER, explore_policy)
       print "]"
+      if lm_cache is not None:
+         print lm_cache.report()
+         lm_cache.reset_stats()
+         lm_cache.flush()
+      if ITER == 1:
+         parser.oraclecache.save() # all the pairs are in it
       if save_every and (ITER % save_every==0):
          print "saving weights at iter",ITER
          parser.scorer.dump_fin(file(model.weightsFile(ITER),"w"))
@@ -1436,16 +1252,17 @@ def train(attachonly, sents, gold_sents, model, dev=None, ITERS=20, save_every=N
             #print "testing dev"
             #print "\nscore: %s" % (test(attachonly,dev,model,ITER,quiet=True,labeled=False),)
    parser.scorer.dump_fin(file(model.weightsFile("FINAL"),"w"))
+   if lm_cache is not None: lm_cache.close()
 
 def label_sets_from_sents(sents):
    left_labels = set()
    right_labels = set()
    for sent in sents:
       for tok in sent:
-         if tok['id'] > tok['parent']:
-            left_labels.add(tok['prel'])
+         if tok.id > tok.parent:
+            left_labels.add(tok.prel)
          else:
-            right_labels.add(tok['prel'])
+            right_labels.add(tok.prel)
    return left_labels,right_labels
 
 #def train_labeled(sents, model, dev=None,ITERS=20,save_every=None,explore_policy=None,shuffle_sents=True):
@@ -1517,11 +1334,11 @@ def test(attachonly, sents,model,iter="FINAL",quiet=False,ignore_punc=False,labe
       for tok in sent:
          if not quiet:
             if labeled:
-               print tok['id'], tok['form'], "_",tok['tag'],tok['tag'],"_",tok['pparent'],tok['pprel'],"_ _"
+               print tok.id, tok.form, "_",tok.tag,tok.tag,"_",tok.pparent,tok.pprel,"_ _"
             else:
-               print tok['id'], tok['form'], "_",tok['tag'],tok['tag'],"_",tok['pparent'],"_ _ _"
-         if ignore_punc and tok['form'][0] in "'`,.-;:!?{}": continue
-         if tok['parent']==tok['pparent']:
+               print tok.id, tok.form, "_",tok.tag,tok.tag,"_",tok.pparent,"_ _ _"
+         if ignore_punc and tok.form[0] in "'`,.-;:!?{}": continue
+         if tok.parent==tok.pparent:
             good+=1
             sent_good+=1
          else:
@@ -1540,17 +1357,93 @@ def test(attachonly, sents,model,iter="FINAL",quiet=False,ignore_punc=False,labe
       print "micro:",good/(good+bad)
    return good/(good+bad), complete/len(sents)
 
-def parse(attachonly, sents, model, iter="FINAL"):
+def format_parse(sent):
+   # one parsed sentence in CoNLL format, blank line included
+   lines = ['\t'.join([str(tok.id), tok.form, "_", tok.tag, tok.tag, "_" , str(tok.pparent), "_", "_", "_"]) for tok in sent]
+   return "\n".join(lines) + "\n\n"
+
+def parse_sent(parser, sent):
+   deps, sent_new = parser.parse(sent)
+   return format_parse(deps.annotate(sent_new))
+
+# the parser of a multi-process parse.  set before the pool is forked, so
+# that the workers share it (copy-on-write) instead of getting it pickled.
+_shared = {}
+
+def _map_chunk(fn, sents):
+   parser = _shared['parser']
+   return [fn(parser, sent) for sent in sents]
+
+def _chunks(sents, chunksize):
+   chunk = []
+   for sent in sents:
+      chunk.append(sent)
+      if len(chunk) == chunksize:
+         yield chunk
+         chunk = []
+   if chunk: yield chunk
+
+def _parse_ordered(parser, sents, fn, pool=None, workers=1, chunksize=20):
+   """
+   fn(parser, sent) for each of sents, in order, yielded as lists (one
+   per chunk).  with a pool (whose workers see parser as
+   _shared['parser']), at most 2*workers chunks are in flight.
+   """
+   if pool is None:
+      for sent in sents:
+         yield [fn(parser, sent)]
+      return
+   pending = deque()
+   for chunk in _chunks(sents, chunksize):
+      pending.append(pool.apply_async(_map_chunk, (fn, chunk)))
+      while len(pending) > 2*workers or (pending and pending[0].ready()):
+         yield pending.popleft().get()
+   while pending:
+      yield pending.popleft().get()
+
+def parse(attachonly, sents, model, iter="FINAL", verify_cache=False, workers=1, chunksize=20, out=sys.stdout, lm_decisions=0):
+   """
+   parse sents (any iterable, read lazily) and write them to out in CoNLL
+   format, in order.  reading and writing run in background threads; with
+   workers > 1 the parsing is spread over a pool of processes, with at most
+   2*workers chunks of chunksize sentences in flight.  lm_decisions is the
+   size of the lm.DecisionCache shared by the sentences (of a process).
+   """
    fext = model.featureExtractor()
    m=MulticlassModel(model.weightsFile(iter))
    parser=Parser(attachonly,m,fext,Oracle())
-   #for sent in sents:
-   for sent in tqdm(sents, mininterval=1, ncols=80):
-      deps, sent_new = parser.parse(sent)
-      sent = deps.annotate(sent_new)
-      for tok in sent:
-         print '\t'.join([str(tok['id']), tok['form'], "_", tok['tag'], tok['tag'], "_" , str(tok['pparent']), "_", "_", "_"])
-      print 
+   parser.verify_cache=verify_cache
+   if lm_decisions > 0: parser.lmdecisions = lm.DecisionCache(lm_decisions)
+
+   pool = None
+   if workers > 1:
+      import multiprocessing
+      _shared['parser'] = parser
+      # loaded once, before the fork (not when deferred: the scores then
+      # come from the lm_cache file, and a worker loads it for a missing one)
+      lm.model()
+      # fork before any thread is started
+      pool = multiprocessing.Pool(workers)
+
+   writer = stream.BatchWriter(out)
+   progress = tqdm(mininterval=1, ncols=80)
+   try:
+      for texts in _parse_ordered(parser, stream.prefetch(sents), parse_sent, pool, workers, chunksize):
+         for text in texts:
+            writer.write(text)
+         progress.update(len(texts))
+      if pool is not None: pool.close()
+   except:
+      if pool is not None: pool.terminate()
+      raise
+   finally:
+      progress.close()
+      if pool is not None:
+         pool.join()
+         _shared.clear()
+   writer.close()
+   if pool is None and parser.lmdecisions is not None:
+      sys.stderr.write("%s\n" % parser.lmdecisions.report())
 
 #def parse_labeled(sents,model,iter="FINAL"):
 #   from ml.sml import SparseMulticlassModel
@@ -1567,12 +1460,11 @@ def parse(attachonly, sents, model, iter="FINAL"):
 #      print 
 
 def make_parser(modelfile,iter):
-   weightsFile = "%s.weights" % (modelfile)
-   modelfile = "%s.model" % (modelfile)
-   model = Model.load(modelfile,iter)
+   # modelfile without its .model extension (see also session.Session)
+   model = Model.load("%s.model" % modelfile,iter)
    fext = model.featureExtractor()
    m=MulticlassModel(model.weightsFile(iter))
-   parser=Parser(m,fext,Oracle())
+   parser=Parser("E00" in modelfile,m,fext,Oracle())
    return parser
 
 def load_sentences(filename,ONLY_PROJECTIVE=False):
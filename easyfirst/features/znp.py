@@ -20,6 +20,7 @@ from common import PAD,ROOT
 
 class BaselineFeatureExtractor: # {{{
    LANG='ENG'
+   WINDOW=2 # tokens looked at on each side of the focus pair (p2,p1 / n1,n2)
    def __init__(self):
       self.versions = None
       self.vocab = set()
@@ -81,7 +82,7 @@ class BaselineFeatureExtractor: # {{{
          n0l2 = PAD
 
       if n0 != PAD and s0 != PAD:
-         d = str(n0['id'] - s0['id'])
+         d = str(deps.position(n0) - deps.position(s0))
          if len(d) == 2: d = "10+" #TODO: cutoff needed?
       else: d = "NA"
 
@@ -89,31 +90,31 @@ class BaselineFeatureExtractor: # {{{
       s0vl = deps.num_left_children(s0)
       n0vl = deps.num_left_children(n0)
 
-      s0w = s0['form']
-      n0w = n0['form']
+      s0w = s0.form
+      n0w = n0.form
 
       # Edit flag
-      n0e = n0['morph'] # actually it is an edited flag
-
-      n1w = n1['form']
-      n2w = n2['form']
-      s0lw = s0l['form']
-      s0rw = s0r['form']
-      n0lw = n0l['form']
-      s0l2w = s0l2['form']
-      s0r2w = s0r2['form']
-      n0l2w = n0l2['form']
-
-      s0p = s0['tag']
-      n0p = n0['tag']
-      n1p = n1['tag']
-      n2p = n2['tag']
-      s0lp = s0l['tag']
-      s0rp = s0r['tag']
-      n0lp = n0l['tag']
-      s0l2p = s0l2['tag']
-      s0r2p = s0r2['tag']
-      n0l2p = n0l2['tag']
+      n0e = n0.morph # actually it is an edited flag
+
+      n1w = n1.form
+      n2w = n2.form
+      s0lw = s0l.form
+      s0rw = s0r.form
+      n0lw = n0l.form
+      s0l2w = s0l2.form
+      s0r2w = s0r2.form
+      n0l2w = n0l2.form
+
+      s0p = s0.tag
+      n0p = n0.tag
+      n1p = n1.tag
+      n2p = n2.tag
+      s0lp = s0l.tag
+      s0rp = s0r.tag
+      n0lp = n0l.tag
+      s0l2p = s0l2.tag
+      s0r2p = s0r2.tag
+      n0l2p = n0l2.tag
 
       #assert(s0l == PAD or s0l2 == PAD or s0l['id'] < s0l2['id'])
       #assert(n0lc == PAD or n0lc2 == PAD or n0lc['id'] < n0lc2['id'])
@@ -231,18 +232,18 @@ class BaselineFeatureExtractor: # {{{
       #from stnfeaturesplus
       # bigram+left/right child
       append = f
-      f1_tag = f1['tag'] 
-      f2_tag = f2['tag'] 
-      p1_tag = p1['tag'] 
-      n1_tag = n1['tag'] 
-      n2_tag = n2['tag'] 
-      p2_tag = p2['tag'] 
-      f1_ctag = f1['tag'] 
-      f2_ctag = f2['tag'] 
-      p1_ctag = p1['tag'] 
-      n1_ctag = n1['tag'] 
-      n2_ctag = n2['tag'] 
-      p2_ctag = p2['tag'] 
+      f1_tag = f1.tag 
+      f2_tag = f2.tag 
+      p1_tag = p1.tag 
+      n1_tag = n1.tag 
+      n2_tag = n2.tag 
+      p2_tag = p2.tag 
+      f1_ctag = f1.tag 
+      f2_ctag = f2.tag 
+      p1_ctag = p1.tag 
+      n1_ctag = n1.tag 
+      n2_ctag = n2.tag 
+      p2_ctag = p2.tag 
       #if f1_tag in IN: f1_tag = "%s_%s" % (f1_tag,f1_form)
       #if f2_tag in IN: f2_tag = "%s_%s" % (f2_tag,f2_form)
       #if p1_tag in IN: p1_tag = "%s_%s" % (p1_tag,p1_form)
@@ -258,17 +259,17 @@ class BaselineFeatureExtractor: # {{{
 
       left_child=deps.left_child
       f1lc = left_child(f1)
-      if f1lc: f1lc=f1lc['tag']
+      if f1lc: f1lc=f1lc.tag
       f2lc = left_child(f2)
-      if f2lc: f2lc=f2lc['tag']
+      if f2lc: f2lc=f2lc.tag
       n1lc = left_child(n1) 
-      if n1lc: n1lc=n1lc['tag']
+      if n1lc: n1lc=n1lc.tag
       n2lc = left_child(n2) 
-      if n2lc: n2lc=n2lc['tag']
+      if n2lc: n2lc=n2lc.tag
       p1lc = left_child(p1) 
-      if p1lc: p1lc=p1lc['tag']
+      if p1lc: p1lc=p1lc.tag
       p2lc = left_child(p2) 
-      if p2lc: p2lc=p2lc['tag']
+      if p2lc: p2lc=p2lc.tag
 
       ## TO-VERB (to keep, to go,...)
       if f1_tag[0]=='V' and f1lc=='TO': f1_tag="%s_TO" % f1_tag
@@ -282,36 +283,36 @@ class BaselineFeatureExtractor: # {{{
       right_child=deps.right_child
       f1rc = right_child(f1) 
       if f1rc: 
-         f1rc_form=f1rc['form']
-         f1rc=f1rc['tag']
+         f1rc_form=f1rc.form
+         f1rc=f1rc.tag
 
       f2rc_form=None
       f2rc = right_child(f2) 
       if f2rc: 
-         f2rc_form=f2rc['form']
-         f2rc=f2rc['tag']
+         f2rc_form=f2rc.form
+         f2rc=f2rc.tag
 
       n1rc_form=None
       n1rc = right_child(n1) 
       if n1rc: 
-         n1rc_form=n1rc['form']
-         n1rc=n1rc['tag']
+         n1rc_form=n1rc.form
+         n1rc=n1rc.tag
 
       n2rc = right_child(n2) 
-      if n2rc: n2rc=n2rc['tag']
+      if n2rc: n2rc=n2rc.tag
       p1rc = right_child(p1) 
-      if p1rc: p1rc=p1rc['tag']
+      if p1rc: p1rc=p1rc.tag
       p2rc = right_child(p2) 
-      if p2rc: p2rc=p2rc['tag']
+      if p2rc: p2rc=p2rc.tag
 
       f1rc2 = deps.right_child2(f1)
-      if f1rc2: f1rc2 = f1rc2['tag']
+      if f1rc2: f1rc2 = f1rc2.tag
       f2rc2 = deps.right_child2(f2)
-      if f2rc2: f2rc2 = f2rc2['tag']
+      if f2rc2: f2rc2 = f2rc2.tag
       f1lc2 = deps.left_child2(f1)
-      if f1lc2: f1lc2 = f1lc2['tag']
+      if f1lc2: f1lc2 = f1lc2.tag
       f2lc2 = deps.left_child2(f2)
-      if f2lc2: f2lc2 = f2lc2['tag']
+      if f2lc2: f2lc2 = f2lc2.tag
       append("Af1tf2t_%s_%s_%s_%s" % (f1_tag,f2_tag,f1lc,f2lc))
       append("Ap1tf1t_%s_%s_%s_%s" % (p1_tag,f1_tag,p1lc,f1lc))
       append("Ap1tf2t_%s_%s_%s_%s" % (p1_tag,f2_tag,p1lc,f2lc))
@@ -393,26 +394,26 @@ class BaselineFeatureExtractor: # {{{
          if fst is PAD or snd is PAD: continue
          f=sent.index(fst)
          t=sent.index(snd)
-         fstt=fst['tag']
-         sndt=snd['tag']
+         fstt=fst.tag
+         sndt=snd.tag
          lo1 = sent[f-1] if f>0 else PAD
          ro1 = sent[f+1] if f+1<len(sent) else PAD
          lo2 = sent[t-1] if t>0 else PAD
          ro2 = sent[t+1] if t+1<len(sent) else PAD
-         append("%s_ngbrs1_%s_%s_%s" % (typ,lo1['tag'],fstt,sndt))
-         append("%s_ngbrs1_%s_%s_%s_%s" % (typ,lo1['tag'],fstt,sndt,ro2['tag']))
-         append("%s_ngbrs2_%s_%s_%s" % (typ,lo1['tag'],sndt,ro2['tag']))
-         append("%s_ngbrs3_%s_%s_%s" % (typ,lo1['tag'],fstt,ro2['tag']))
-         append("%s_ngbrs4_%s_%s_%s" % (typ,fstt,sndt,ro2['tag']))
-
-         append("%s_Angbrs1_%s_%s_%s" % (typ,ro1['tag'],fstt,lo2['tag']))
-         append("%s_Angbrs1_%s_%s_%s_%s" % (typ,ro1['tag'],fstt,lo2['tag'],sndt))
-         append("%s_Angbrs2_%s_%s_%s" % (typ,fstt,ro1['tag'],sndt))
-         append("%s_Angbrs3_%s_%s_%s" % (typ,fstt,lo2['tag'],sndt))
-         append("%s_Angbrs4_%s_%s_%s" % (typ,ro1['tag'],lo2['tag'],sndt))
-
-         append("%s_Bngbrs1_%s_%s_%s_%s" % (typ,lo1['tag'],fstt,lo2['tag'],sndt))
-         append("%s_Bngbrs2_%s_%s_%s_%s" % (typ,fstt,ro1['tag'],sndt,ro2['tag']))
+         append("%s_ngbrs1_%s_%s_%s" % (typ,lo1.tag,fstt,sndt))
+         append("%s_ngbrs1_%s_%s_%s_%s" % (typ,lo1.tag,fstt,sndt,ro2.tag))
+         append("%s_ngbrs2_%s_%s_%s" % (typ,lo1.tag,sndt,ro2.tag))
+         append("%s_ngbrs3_%s_%s_%s" % (typ,lo1.tag,fstt,ro2.tag))
+         append("%s_ngbrs4_%s_%s_%s" % (typ,fstt,sndt,ro2.tag))
+
+         append("%s_Angbrs1_%s_%s_%s" % (typ,ro1.tag,fstt,lo2.tag))
+         append("%s_Angbrs1_%s_%s_%s_%s" % (typ,ro1.tag,fstt,lo2.tag,sndt))
+         append("%s_Angbrs2_%s_%s_%s" % (typ,fstt,ro1.tag,sndt))
+         append("%s_Angbrs3_%s_%s_%s" % (typ,fstt,lo2.tag,sndt))
+         append("%s_Angbrs4_%s_%s_%s" % (typ,ro1.tag,lo2.tag,sndt))
+
+         append("%s_Bngbrs1_%s_%s_%s_%s" % (typ,lo1.tag,fstt,lo2.tag,sndt))
+         append("%s_Bngbrs2_%s_%s_%s_%s" % (typ,fstt,ro1.tag,sndt,ro2.tag))
 
 
       return features
@@ -19,7 +19,7 @@ def is_projective(sent):
    proj=True
    spans = set()
    for tok in sent:
-      s=tuple(sorted([int(tok['id']),int(tok['parent'])]))
+      s=tuple(sorted([int(tok.id),int(tok.parent)]))
       spans.add(s)
    for l,h in sorted(spans):
       for l1,h1 in sorted(spans):
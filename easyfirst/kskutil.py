@@ -18,48 +18,132 @@
 
 import os
 import sys
+import bisect
+from fractions import Fraction
+from common import Token
 
-def tokenTemplate(id_tmp, form_tmp, pos_tmp):
-    token_tmp = {
-            "parent": id_tmp + 1,
-            "prel"  : "DEP",
-            "form"  : form_tmp,
-            "lem"  : "",
-            "id"    : id_tmp,
-            "tag"   : pos_tmp,
-            "ctag"   : pos_tmp,
-            "morph" : 1,
-            "extra" : None,
-            }
+def tokenTemplate(id_tmp, form_tmp, pos_tmp, parent_tmp):
+    token_tmp = Token(
+            parent = parent_tmp,
+            prel   = "DEP",
+            form   = form_tmp,
+            lem    = "",
+            id     = id_tmp,
+            tag    = pos_tmp,
+            ctag   = pos_tmp,
+            morph  = 1,
+            extra  = None,
+            )
     return token_tmp
 
 
-def decrementToken(tmpDict, idx_bound):
-    # create new dict otherwise it won't be changed
-    newDict = tmpDict.copy()
-    if newDict['id'] > idx_bound:
-        newDict['id'] -= 1
-    if newDict['parent'] > idx_bound:
-        newDict['parent'] -= 1
-    if 'pparent' in newDict.keys():
-        if newDict['pparent'] > idx_bound:
-            newDict['pparent'] -= 1
-    return newDict
+class TokenOrder:
+    """
+    the left-to-right order of the tokens of a sentence, kept apart from
+    their ids.  token ids are stable handles: inserting or deleting a token
+    doesn't touch the other tokens, their ids or the dependencies built on
+    them.  positions (the CoNLL ids) are derived from the order when needed.
+
+    every token has an order key.  the initial tokens get their index,
+    an inserted token gets the midpoint of its neighbours' keys (a Fraction,
+    so there is always room for another one).
+    """
+    def __init__(self, sent):
+        self._key = {}  # id -> order key
+        self._keys = [] # sorted order keys
+        for k, tok in enumerate(sent):
+            self._key[tok.id] = k
+            self._keys.append(k)
+        self._next_id = max(self._key) + 1
+
+    def new_id(self):
+        # a handle no token of the sentence has ever used
+        tid = self._next_id
+        self._next_id += 1
+        return tid
+
+    def key(self, tid):
+        return self._key[tid]
+
+    def position(self, tid):
+        return bisect.bisect_left(self._keys, self._key[tid])
+
+    def insert_before(self, tid, next_tid):
+        # returns the position of the new token
+        j = self.position(next_tid)
+        hi = self._keys[j]
+        lo = self._keys[j-1] if j > 0 else hi - 1
+        key = Fraction(lo + hi, 2)
+        self._keys.insert(j, key)
+        self._key[tid] = key
+        return j
+
+    def remove(self, tid):
+        # returns the position the token had
+        j = bisect.bisect_left(self._keys, self._key.pop(tid))
+        del self._keys[j]
+        return j
+
+
+def _myers(seq, gold):
+    """
+    the DP of seq against gold, a word of seq at a time, as Myers'
+    bit-parallel algorithm (in Hyyro's formulation for the distance of
+    whole sequences) computes it: after seq[:i], bit k of pv (of mv) is
+    set when the distance of seq[:i] and gold[:k+1] is one more (one
+    less) than with gold[:k].  a bit per word of gold, in one python
+    long, so a word costs a few operations whatever the length of gold.
+    """
+    peq = {} # word: the bits of its positions in gold
+    for k, w in enumerate(gold):
+        peq[w] = peq.get(w, 0) | (1 << k)
+    mask = (1 << len(gold)) - 1
+    pv = mask
+    mv = 0
+    for w in seq:
+        eq = peq.get(w, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv & mask
+        yield pv, mv
 
-def incrementToken(tmpDict, idx_bound):
-    
-    newDict = dict(tmpDict)
-    if newDict['id'] >= idx_bound:
-        newDict['id'] += 1
-    if newDict['parent'] >= idx_bound:
-        newDict['parent'] += 1
-    if 'pparent' in newDict.keys():
-        if newDict['pparent'] >= idx_bound:
-            newDict['pparent'] += 1
-    return newDict
+
+def editDist(seq1, seq2):
+    # the edit distance of getEditDist, without the moves (see _myers)
+    if len(seq1) < len(seq2):
+        seq1, seq2 = seq2, seq1 # the distance is symmetric: fewer bits
+    pv, mv = (1 << len(seq2)) - 1, 0
+    for pv, mv in _myers(seq1, seq2):
+        pass
+    return len(seq1) + bin(pv).count("1") - bin(mv).count("1")
+
+
+def packAlignment(seq, gold):
+    """
+    all the rows of EditAlignment(seq, gold), packed in four longs: the
+    deltas of _myers for seq against gold, and for seq against gold both
+    reversed (the backward rows), len(gold) bits a word.  a few hundred
+    bytes for a sentence, and cheaper to unpack than to compute.
+    """
+    m = len(gold)
+    packed = []
+    for s, g in ((seq, gold), (seq[::-1], gold[::-1])):
+        p = q = 0
+        for i, (pv, mv) in enumerate(_myers(s, g)):
+            p |= pv << (i*m)
+            q |= mv << (i*m)
+        packed.extend((p, q))
+    return tuple(packed)
 
 
 def getEditDist(seq1, seq2):
+    # the distance and the moves of an optimal alignment (editDist is
+    # faster for the distance alone)
     #Constant Values
     ins_cost = 1 # insertion cost
     del_cost = 1 #deletion cost
@@ -130,5 +214,162 @@ def getEditDist(seq1, seq2):
     return dist_matrix[-1][-1], moves[::-1]
 
 
+class EditAlignment:
+    """
+    the edit distance (as getEditDist) between a sentence being edited and
+    its gold sentence, and the distance after one more edit of it.
+
+    fwd[i] is the last row of the DP of seq[:i] against gold (fwd[i][k] =
+    distance of seq[:i] and gold[:k]), bwd[t] the same for the suffix of t
+    words (bwd[t][k] = distance of seq[n-t:] and gold[k:]).  the distance
+    of a sequence is min_k fwd[i][k] + bwd[n-i][k], for any cut i, so an
+    edit at j needs the rows at j and j+1 only: O(len(gold)) per edit,
+    once they are there.  the rows are filled as far as needed, and an
+    edit that is made (substitute(), insert(), delete()) only drops the
+    rows that see it.  with packed (packAlignment(seq, gold)), the rows
+    are unpacked from it rather than computed, as long as no edit
+    changed them.
+    """
+    def __init__(self, seq, gold, packed=None):
+        self.seq = list(seq)
+        self.gold = list(gold)
+        m = len(self.gold)
+        self.fwd = [range(m+1)]
+        self.bwd = [range(m, -1, -1)]
+        self._dist = None
+        self.packed = packed
+        # the rows of fwd and bwd still in packed
+        self._npacked = [len(self.seq)+1, len(self.seq)+1] if packed else [0, 0]
+
+    def _unpack(self, p, q, i):
+        # row i (> 0) of the packed deltas p, q
+        m = len(self.gold)
+        mask = (1 << m) - 1
+        pv = (p >> ((i-1)*m)) & mask
+        mv = (q >> ((i-1)*m)) & mask
+        row = [i]
+        v = i
+        for k in xrange(m):
+            v += ((pv >> k) & 1) - ((mv >> k) & 1)
+            row.append(v)
+        return row
+
+    def _next(self, row, w):
+        # the forward row after one more word w
+        gold = self.gold
+        new = [row[0] + 1]
+        for k in xrange(1, len(row)):
+            new.append(min(row[k] + 1, new[k-1] + 1, row[k-1] + (w != gold[k-1])))
+        return new
+
+    def _prev(self, row, w):
+        # the backward row with one more word w in front
+        gold = self.gold
+        m = len(row) - 1
+        new = [0]*(m+1)
+        new[m] = row[m] + 1
+        for k in xrange(m-1, -1, -1):
+            new[k] = min(row[k] + 1, new[k+1] + 1, row[k+1] + (w != gold[k]))
+        return new
+
+    def _before(self, i):
+        # fwd[i]: the row after seq[:i]
+        fwd = self.fwd
+        while len(fwd) <= i:
+            if len(fwd) < self._npacked[0]:
+                fwd.append(self._unpack(self.packed[0], self.packed[1], len(fwd)))
+            else:
+                fwd.append(self._next(fwd[-1], self.seq[len(fwd)-1]))
+        return fwd[i]
+
+    def _after(self, i):
+        # bwd[n-i]: the row of seq[i:]
+        bwd = self.bwd
+        n = len(self.seq)
+        while len(bwd) <= n - i:
+            if len(bwd) < self._npacked[1]:
+                bwd.append(self._unpack(self.packed[2], self.packed[3], len(bwd))[::-1])
+            else:
+                bwd.append(self._prev(bwd[-1], self.seq[n-len(bwd)]))
+        return bwd[n-i]
+
+    def distance(self, j=0):
+        # the distance of seq and gold (from the rows at j)
+        if self._dist is None:
+            self._dist = min(a + b for a, b in zip(self._before(j), self._after(j)))
+        return self._dist
+
+    def substituted(self, j, w):
+        # the distance with w in place of seq[j]
+        return min(a + b for a, b in zip(self._next(self._before(j), w), self._after(j+1)))
+
+    def inserted(self, j, w):
+        # the distance with w inserted before seq[j]
+        return min(a + b for a, b in zip(self._next(self._before(j), w), self._after(j)))
+
+    def deleted(self, j):
+        # the distance without seq[j]
+        return min(a + b for a, b in zip(self._before(j), self._after(j+1)))
+
+    def substitute(self, j, w):
+        n = len(self.seq)
+        self.seq[j] = w
+        self._edited(j+1, n-j-1)
+
+    def insert(self, j, w):
+        n = len(self.seq)
+        self.seq.insert(j, w)
+        self._edited(j+1, n-j)
+
+    def delete(self, j):
+        n = len(self.seq)
+        del self.seq[j]
+        self._edited(j+1, n-j-1)
+
+    def _edited(self, nfwd, nbwd):
+        # keep fwd[:nfwd] (the prefixes before the edit) and bwd[:nbwd+1]
+        # (the suffixes after it)
+        del self.fwd[nfwd:]
+        del self.bwd[nbwd+1:]
+        self._npacked = [min(self._npacked[0], nfwd), min(self._npacked[1], nbwd+1)]
+        self._dist = None
+
+
 if __name__ == '__main__':
-    pass
+    # benchmark: python kskutil.py ../data/train.E20 ../data/train.E00
+    import time
+    from itertools import izip
+    from pio import io
+
+    if len(sys.argv) != 3:
+        sys.stderr.write("usage: %s edited_conll gold_conll\n" % sys.argv[0])
+        sys.exit(1)
+    pairs = [(["_ROOT_"] + [t.form for t in s1], ["_ROOT_"] + [t.form for t in s2])
+             for s1, s2 in izip(io.conll_to_sents(file(sys.argv[1])), io.conll_to_sents(file(sys.argv[2])))]
+    lens = sorted(len(p[0]) for p in pairs)
+    print "%d sentence pairs, lengths %d..%d (median %d)" % (len(pairs), lens[0], lens[-1], lens[len(lens)/2])
+
+    t0 = time.time()
+    slow = [getEditDist(a, b)[0] for a, b in pairs]
+    t1 = time.time()
+    fast = [editDist(a, b) for a, b in pairs]
+    t2 = time.time()
+    assert slow == fast
+    print "getEditDist  %8.1f us/pair" % ((t1-t0) / len(pairs) * 1e6)
+    print "editDist     %8.1f us/pair  (x%.1f)" % ((t2-t1) / len(pairs) * 1e6, (t1-t0) / max(t2-t1, 1e-9))
+
+    # what the oracle asks: the distance after an edit of each word
+    t0 = time.time()
+    n = 0
+    for a, b in pairs:
+        for j in xrange(1, len(a)):
+            getEditDist(a[:j] + a[j+1:], b)
+            n += 1
+    t1 = time.time()
+    for a, b in pairs:
+        align = EditAlignment(a, b)
+        for j in xrange(1, len(a)):
+            align.deleted(j)
+    t2 = time.time()
+    print "edited, getEditDist    %8.1f us/edit" % ((t1-t0) / max(n, 1) * 1e6)
+    print "edited, EditAlignment  %8.1f us/edit  (x%.1f)" % ((t2-t1) / max(n, 1) * 1e6, (t1-t0) / max(t2-t1, 1e-9))
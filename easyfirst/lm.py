@@ -0,0 +1,605 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+language model scoring of the edit candidates.
+
+the edits are ranked by the score of the whole sentence, <s> and </s>
+included, with the candidate word in it.  with an n-gram model only the
+n-grams that contain the candidate word depend on it: the words before
+it, and the words more than n-1 words after it, add the same to every
+candidate.  so the candidates are ranked on those n-grams only.
+
+these scores depend on a few words only, and training asks for the same
+ones every epoch: a ScoreCache keeps them, in memory and optionally on
+disk (shared by the runs that use the same LM).
+
+the LM itself is loaded on the first call to model(), from the file set
+with configure() (by default EASYFIRST_LM, or data/gigaword.kenlm of this
+repository), and shared by everything in the process.  load it before
+forking worker processes: with the lazy (mmap) load method the workers
+then share the pages of the file instead of each reading it.
+
+an LM is anything with the interface of kenlm.Model that the scoring uses:
+
+   order                            the n of the n-grams
+   State()                          a new (empty) state
+   BeginSentenceWrite(state)        state = <s>
+   NullContextWrite(state)          state = no context
+   BaseScore(state, word, out)      log10 p(word | state), out = the next state
+   score(sentence, bos, eos)        log10 p of a whole sentence
+
+the windowed and batched scores (Window) are built on it.  a kenlm model
+(KenLM) and the small n-gram models of ngram.py (trained from CoNLL files,
+e.g. for tests) are loaded by open_lm, which tells them apart by their
+first bytes.
+
+an LM can also be served by lm_server.py, to processes that then don't
+load it: its "file" is then unix:<socket> (see Remote).  a remote LM only
+gives window scores (window_scores()), a batch of candidates at a time.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+from collections import OrderedDict
+try:
+   import kenlm
+except ImportError:
+   kenlm = None # only the models of ngram.py can be used
+
+DEFAULT_LM = os.environ.get("EASYFIRST_LM",
+      os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "data", "gigaword.kenlm"))
+
+# --lm_load: how kenlm reads a binary model (ARPA files are always parsed,
+# the models of ngram.py always read), as names in kenlm.LoadMethod
+LOAD_METHODS = {
+   'lazy': 'LAZY',                          # mmap, pages read on demand
+   'populate_or_lazy': 'POPULATE_OR_LAZY',  # mmap, pages read up front
+   'populate_or_read': 'POPULATE_OR_READ',  # kenlm's default
+   'read': 'READ',                          # private copy in memory
+   'parallel_read': 'PARALLEL_READ',
+}
+
+_lm = {'path':DEFAULT_LM, 'load':None, 'model':None, 'deferred':None}
+
+def configure(path=None, load=None):
+   """
+   the LM file (None keeps the current one) and its load method (a key of
+   LOAD_METHODS, None for kenlm's default).  drops the loaded model if
+   either changed.
+   """
+   if load is not None and load not in LOAD_METHODS:
+      raise ValueError("unknown LM load method %s (%s)" % (load, ", ".join(sorted(LOAD_METHODS))))
+   if path is None: path = _lm['path']
+   if (path, load) != (_lm['path'], _lm['load']):
+      _lm.update(path=path, load=load, model=None)
+
+def defer(order):
+   """
+   until a score has to be computed, model() is a Deferred of this order:
+   when the scores all come from a ScoreCache file, the LM is never loaded
+   (and need not be there at all).  a score missing from the file then
+   loads it, or fails when it is not there.
+   """
+   _lm['deferred'] = Deferred(order)
+
+def path():
+   return _lm['path']
+
+def available(path):
+   # the LM of path can be loaded (or asked): the file or socket is there
+   if path.startswith("unix:"): path = path[len("unix:"):]
+   return os.path.exists(path)
+
+def absolute(path):
+   # path as recorded in a .model file
+   if path.startswith("unix:"): return path
+   return os.path.abspath(path)
+
+def model():
+   if _lm['model'] is None:
+      if _lm['deferred'] is not None:
+         return _lm['deferred']
+      _lm['model'] = open_lm(_lm['path'], _lm['load'])
+   return _lm['model']
+
+class Deferred: #{{{
+   # the order of the LM, known without loading it; the rest loads it
+   def __init__(self, order):
+      self.order = order
+
+   def __getattr__(self, name):
+      if name == 'window_scores' and not _lm['path'].startswith("unix:"):
+         # Context checks for it on every batch: a file LM has none, and
+         # that must not load it
+         raise AttributeError(name)
+      if _lm['model'] is None:
+         try:
+            _lm['model'] = open_lm(_lm['path'], _lm['load'])
+         except IOError, e:
+            raise IOError("a score is not in the LM cache, and the LM can't be loaded "
+                          "(a run with the LM and the same cache file adds the missing scores): %s" % e)
+      return getattr(_lm['model'], name)
+#}}}
+
+def open_lm(path, load=None):
+   # a model of ngram.py, or else a kenlm model (ARPA or binary)
+   if path.startswith("unix:"):
+      return Remote(path[len("unix:"):])
+   import ngram
+   fh = open(path, "rb")
+   magic = fh.read(len(ngram.MAGIC))
+   fh.close()
+   if magic == ngram.MAGIC:
+      return ngram.NgramLM.load(path)
+   return KenLM(path, load)
+
+class KenLM: #{{{
+   """
+   a kenlm model.  its methods are those of kenlm.Model itself, no
+   wrapper in between.
+   """
+   def __init__(self, path, load=None):
+      if kenlm is None:
+         raise ImportError("kenlm is needed for %s (not a model of ngram.py)" % path)
+      config = kenlm.Config()
+      if load is not None:
+         config.load_method = getattr(kenlm.LoadMethod, LOAD_METHODS[load])
+      m = kenlm.Model(path, config)
+      self.model = m
+      self.order = m.order
+      self.State = kenlm.State
+      self.BeginSentenceWrite = m.BeginSentenceWrite
+      self.NullContextWrite = m.NullContextWrite
+      self.BaseScore = m.BaseScore
+      self.score = m.score
+#}}}
+
+class Window: #{{{
+   """
+   the candidates for position j of words: in place of words[j], or
+   before it with insert.
+
+   the state of the n-1 words before j is computed once, when first
+   needed (or taken from source, the Context of words); score(word) then
+   costs at most n lookups, whatever the length of the sentence.  with a
+   cache, the scores are looked up there first.
+   scores() gives the scores of several words at once, argmax() also
+   the best of them.
+   """
+   def __init__(self, model, words, j, insert=False, source=None, cache=None):
+      self.model = model
+      n = model.order
+      lo = max(0, j-n+1)
+      self.j = j
+      self.source = source
+      self.before = words[lo:j]
+      self.bos = lo == 0
+      self.context = None
+      # the words whose n-grams reach back to position j
+      if insert:
+         self.rest = words[j:j+n-1]
+      else:
+         self.rest = words[j+1:j+n]
+      if len(self.rest) < n-1:
+         self.rest = self.rest + ["</s>"]
+      self.cache = cache
+      self._key = None
+
+   def key(self):
+      # the words the scores depend on, but the candidate: (before, after)
+      if self._key is None:
+         before = self.before
+         if self.bos: before = ["<s>"] + before
+         self._key = (" ".join(before), " ".join(self.rest))
+      return self._key
+
+   def score(self, word):
+      # log10 probability of the n-grams that contain word
+      cache = self.cache
+      if cache is not None:
+         key = "%s\t%s\t%s" % (self.key()[0], word, self.key()[1])
+         total = cache.get(key)
+         if total is None:
+            total = self._score(word)
+            cache.put(key, total)
+         return total
+      return self._score(word)
+
+   def scores(self, words):
+      remote = getattr(self.model, 'window_scores', None)
+      if remote is None:
+         return [self.score(word) for word in words]
+      # a remote LM: the words not in the cache in one request
+      cache = self.cache
+      if cache is None:
+         return remote(self.key(), words)
+      before, after = self.key()
+      keys = ["%s\t%s\t%s" % (before, word, after) for word in words]
+      scores = [cache.get(key) for key in keys]
+      missing = [k for k in xrange(len(words)) if scores[k] is None]
+      if missing:
+         for k, total in zip(missing, remote(self.key(), [words[k] for k in missing])):
+            scores[k] = total
+            cache.put(keys[k], total)
+      return scores
+
+   def argmax(self, words):
+      # the index of the best of words (the first one on a tie), and the scores
+      scores = self.scores(words)
+      best = 0
+      for k in xrange(1, len(scores)):
+         if scores[best] < scores[k]: best = k
+      return best, scores
+
+   def _score(self, word):
+      model = self.model
+      remote = getattr(model, 'window_scores', None)
+      if remote is not None:
+         return remote(self.key(), [word])[0]
+      state = self.context
+      if state is None:
+         if self.source is not None:
+            state = self.source.state(self.j)
+         else:
+            state = _state(model, self.before, self.bos)
+         self.context = state
+      return _score_in(model, state, word, self.rest)
+#}}}
+
+def _score_in(model, state, word, rest):
+   # log10 probability of word then rest, after state
+   out = model.State()
+   total = model.BaseScore(state, word, out)
+   state, out = out, model.State()
+   for w in rest:
+      total += model.BaseScore(state, w, out)
+      state, out = out, state
+   return total
+
+def window_scores(model, key, words):
+   """
+   the scores of words in the window of key (Window.key()), with a local
+   model: what a Remote asks lm_server.py for.
+   """
+   before = key[0].split()
+   bos = before[:1] == ["<s>"]
+   if bos: before = before[1:]
+   state = _state(model, before, bos)
+   rest = key[1].split()
+   return [_score_in(model, state, word, rest) for word in words]
+
+def _state(model, words, bos):
+   # the state after words (after <s> words with bos)
+   state = model.State()
+   if bos:
+      model.BeginSentenceWrite(state)
+   else:
+      model.NullContextWrite(state)
+   out = model.State()
+   for w in words:
+      model.BaseScore(state, w, out)
+      state, out = out, state
+   return state
+
+class Context: #{{{
+   """
+   the LM view of a sentence while it is parsed: its words, the states
+   left to right (states[k] follows <s> words[:k]) and the log10
+   probability of each word in its state (probs[k]).  both are filled as
+   far as needed (not at all when the scores all come from a cache), and
+   kept across the steps of the parse.
+
+   window() is a Window that starts from the cached state.  the edits
+   that are actually made must be mirrored with substitute(), insert() and
+   delete(): an edit at j changes the n-grams of the words j..j+n-1 only,
+   so only their states are recomputed, the ones after them are shifted.
+   """
+   def __init__(self, model, words, cache=None, decisions=None):
+      self.model = model
+      self.cache = cache
+      self.decisions = decisions
+      self.n = model.order
+      self.words = list(words)
+      self.states = []
+      self.probs = []
+
+   def _fill(self, k):
+      # states up to states[k]
+      model = self.model
+      states = self.states
+      words = self.words
+      if not states:
+         state = model.State()
+         model.BeginSentenceWrite(state)
+         states.append(state)
+      while len(states) <= k:
+         out = model.State()
+         self.probs.append(model.BaseScore(states[-1], words[len(states)-1], out))
+         states.append(out)
+
+   def state(self, k):
+      # the state after <s> words[:k]
+      self._fill(k)
+      return self.states[k]
+
+   def window(self, j, insert=False):
+      return Window(self.model, self.words, j, insert, self, self.cache)
+
+   def argmax(self, j, words, insert=False):
+      """
+      the best of the candidate words for position j (see Window), as
+      (index in words, scores of all of them).  the scores are None when
+      the choice came from the DecisionCache.
+      """
+      window = self.window(j, insert)
+      decisions = self.decisions
+      if decisions is None:
+         return window.argmax(words)
+      key = "%s\t%s\t%s" % (" ".join(words), window.key()[0], window.key()[1])
+      best = decisions.get(key)
+      if best is not None:
+         return best, None
+      best, scores = window.argmax(words)
+      decisions.put(key, best)
+      return best, scores
+
+   def score(self):
+      # of the whole sentence, as model.score(" ".join(words)) (bos and eos)
+      self._fill(len(self.words))
+      return sum(self.probs) + self.model.BaseScore(self.states[-1], "</s>", self.model.State())
+
+   def substitute(self, j, word):
+      self.words[j] = word
+      self._edited(j, 0)
+
+   def insert(self, j, word):
+      self.words.insert(j, word)
+      self._edited(j, 1)
+
+   def delete(self, j):
+      del self.words[j]
+      self._edited(j, -1)
+
+   def _edited(self, j, shift):
+      # the words from j+n on have the same n-grams as before the edit
+      # (they were at j+n-shift): recompute up to them, keep the rest
+      end = j + self.n
+      tail_states = self.states[end+1-shift:]
+      tail_probs = self.probs[end-shift:]
+      del self.states[j+1:]
+      del self.probs[j:]
+      if len(tail_probs) == 0:
+         return # filled again when needed
+      self._fill(end)
+      self.states.extend(tail_states)
+      self.probs.extend(tail_probs)
+#}}}
+
+class ScoreCache: #{{{
+   """
+   the scores of the windows, by the words they depend on: at most size
+   of them in memory, the least recently used ones dropped first.
+
+   with a path, the scores are also kept in an sqlite file, read when the
+   cache is opened and written by flush() (and close()).  the file is
+   meant for one LM: lm_id (anything naming it, e.g. lm_id(path)) is
+   stored in it, and the scores are dropped when it doesn't match (None
+   takes the file as it is, e.g. when the LM is not there).  the order
+   of the LM can be stored too (see defer()).
+
+   in a forked process, detach() first: the scores it computes are then
+   kept in new, for the parent to put(), and never written from there.
+   """
+   def __init__(self, size=500000, path=None, lm_id="", order=None):
+      self.size = size
+      self.path = path
+      self.mem = OrderedDict()
+      self.new = {} # not yet on disk
+      self.detached = False
+      self.hits = self.disk_hits = self.misses = 0
+      self.db = None
+      self.on_disk = 0
+      self.order = order
+      if path is not None:
+         self.db = sqlite3.connect(path, timeout=600)
+         self.db.execute("create table if not exists meta (k text primary key, v text)")
+         self.db.execute("create table if not exists scores (k text primary key, v real)")
+         row = self.db.execute("select v from meta where k='lm'").fetchone()
+         if lm_id is not None and (row is None or row[0] != lm_id):
+            self.db.execute("delete from scores")
+            self.db.execute("delete from meta")
+            self.db.execute("insert or replace into meta values ('lm', ?)", (lm_id,))
+         if order is not None:
+            self.db.execute("insert or replace into meta values ('order', ?)", (str(order),))
+         row = self.db.execute("select v from meta where k='order'").fetchone()
+         if row is not None: self.order = int(row[0])
+         self.db.commit()
+         self.on_disk = self.db.execute("select count(*) from scores").fetchone()[0]
+         for k, v in self.db.execute("select k, v from scores limit ?", (size,)):
+            self.mem[k] = v
+
+   def set_order(self, order):
+      # of the LM, stored in the file too
+      self.order = order
+      if self.db is not None:
+         self.db.execute("insert or replace into meta values ('order', ?)", (str(order),))
+         self.db.commit()
+
+   def get(self, key):
+      mem = self.mem
+      v = mem.pop(key, None)
+      if v is not None:
+         mem[key] = v # most recently used
+         self.hits += 1
+         return v
+      if self.on_disk > self.size: # not all of it fits in memory
+         row = self.db.execute("select v from scores where k=?", (key,)).fetchone()
+         if row is not None:
+            self.disk_hits += 1
+            self._keep(key, row[0])
+            return row[0]
+      self.misses += 1
+      return None
+
+   def put(self, key, v):
+      self._keep(key, v)
+      if self.detached:
+         self.new[key] = v
+      elif self.db is not None:
+         self.new[key] = v
+         if len(self.new) >= 100000: self.flush()
+
+   def detach(self):
+      # in a forked process: a connection of its own (the parent's is
+      # left alone), and no writes
+      if self.db is not None:
+         self._parent_db = self.db
+         self.db = sqlite3.connect(self.path, timeout=600)
+      self.new = {}
+      self.detached = True
+
+   def _keep(self, key, v):
+      mem = self.mem
+      mem[key] = v
+      if len(mem) > self.size:
+         mem.popitem(last=False)
+
+   def flush(self):
+      if self.db is None or self.detached or not self.new: return
+      self.db.executemany("insert or replace into scores values (?,?)", self.new.iteritems())
+      self.db.commit()
+      self.on_disk += len(self.new) # (an upper bound, other runs may have added the same)
+      self.new = {}
+
+   def close(self):
+      self.flush()
+      if self.db is not None:
+         self.db.close()
+         self.db = None
+
+   def stats(self):
+      asked = self.hits + self.disk_hits + self.misses
+      return {'hits':self.hits, 'disk_hits':self.disk_hits, 'misses':self.misses,
+              'hit_rate':(self.hits + self.disk_hits) / float(max(1, asked)),
+              'in_memory':len(self.mem)}
+
+   def report(self):
+      st = self.stats()
+      return "lm cache: %.1f%% hits (%d in memory, %d on disk), %d misses, %d entries in memory" % (
+            100*st['hit_rate'], st['hits'], st['disk_hits'], st['misses'], st['in_memory'])
+
+   def reset_stats(self):
+      self.hits = self.disk_hits = self.misses = 0
+#}}}
+
+class DecisionCache: #{{{
+   """
+   the choices of Context.argmax, by candidate list and window: the same
+   few words around an edit ("interested _ the") pick the same candidate
+   in any sentence.  at most size of them are kept, the least recently
+   used ones dropped first.
+   """
+   def __init__(self, size=100000):
+      self.size = size
+      self.mem = OrderedDict()
+      self.hits = self.misses = 0
+
+   def get(self, key):
+      best = self.mem.pop(key, None)
+      if best is None:
+         self.misses += 1
+         return None
+      self.mem[key] = best
+      self.hits += 1
+      return best
+
+   def put(self, key, best):
+      mem = self.mem
+      mem[key] = best
+      if len(mem) > self.size:
+         mem.popitem(last=False)
+
+   def report(self):
+      asked = self.hits + self.misses
+      return "lm decisions: %.1f%% hits, %d misses, %d in memory" % (
+            100.0 * self.hits / max(1, asked), self.misses, len(self.mem))
+#}}}
+
+class Remote: #{{{
+   """
+   the client of an LM served by lm_server.py on the unix socket path.
+   the connections are pooled: a thread takes an idle one, or opens one,
+   and gives it back after its request.  a forked process starts with an
+   empty pool (it doesn't share the sockets of its parent).
+
+   the protocol is a line per query (tab separated) and an empty line to
+   end a request, a line per query back:
+      O                          the order of the LM
+      I                          its lm_id
+      W  before  after  words    the scores of words in the window
+      T                          the counters of the server, as JSON
+   an answer starting with E is an error.
+   """
+   def __init__(self, path):
+      self.path = path
+      self.lock = threading.Lock()
+      self.pid = os.getpid()
+      self.idle = []
+      self.order = int(self.ask(["O"])[0])
+
+   def _connect(self):
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      try:
+         sock.connect(self.path)
+      except socket.error, e:
+         raise IOError("can't reach the LM server on %s (is lm_server.py running?): %s" % (self.path, e))
+      return sock, sock.makefile("rb")
+
+   def ask(self, queries):
+      with self.lock:
+         if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = []
+         conn = self.idle.pop() if self.idle else None
+      if conn is None: conn = self._connect()
+      sock, rfile = conn
+      sock.sendall("%s\n\n" % "\n".join(queries))
+      answers = [rfile.readline() for q in queries]
+      for a in answers:
+         if not a.endswith("\n"):
+            raise IOError("LM server %s: connection closed" % self.path)
+         if a.startswith("E"):
+            raise IOError("LM server %s: %s" % (self.path, a[2:-1]))
+      answers = [a[:-1] for a in answers]
+      with self.lock:
+         if self.pid == os.getpid(): self.idle.append(conn)
+      return answers
+
+   def window_scores(self, key, words):
+      return map(float, self.ask(["W\t%s\t%s\t%s" % (key[0], key[1], " ".join(words))])[0].split())
+
+   def lm_id(self):
+      return self.ask(["I"])[0]
+#}}}
+
+def lm_id(path):
+   # names an LM file for ScoreCache: its path, size and modification time
+   if path.startswith("unix:"):
+      return Remote(path[len("unix:"):]).lm_id()
+   st = os.stat(path)
+   return "%s %d %d" % (os.path.abspath(path), st.st_size, int(st.st_mtime))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+an LM daemon: the language model is loaded once, by this process only,
+and the window scores are served on a unix socket to the parse and
+training processes (lm.Remote, the protocol is described there).
+
+   python lm_server.py --socket /tmp/easyfirst-lm.sock --lm ../data/gigaword.kenlm
+   python parse.py -m ./models/E20.model --lm unix:/tmp/easyfirst-lm.sock ../data/dev.E20
+   python train.py ... --lm unix:/tmp/easyfirst-lm.sock
+
+the connections are served by threads, which hand their queries to one
+scoring thread: it takes all the queries waiting, scores each window
+once for all the clients that asked for it (each word once too), and
+keeps the scores in a ScoreCache of --cache_size.  a model of ngram.py
+(--lm ../data/train.ngram) is enough to run it without the gigaword
+model.
+"""
+
+import os
+import sys
+import time
+import json
+import signal
+import threading
+import Queue
+import SocketServer
+from optparse import OptionParser
+import lm
+
+usage="""usage: %prog --socket path [options]"""
+
+parser = OptionParser(usage)
+parser.add_option("--socket",dest="socket",default=None,help="unix socket to listen on")
+parser.add_option("--lm",dest="lm",default=None,help="kenlm model (default: %s)" % lm.DEFAULT_LM)
+parser.add_option("--lm_load",dest="lm_load",type="choice",choices=sorted(lm.LOAD_METHODS),default=None)
+parser.add_option("--cache_size",dest="cache_size",type="int",default=500000,help="window scores kept (0: none)")
+parser.add_option("--batch_wait",dest="batch_wait",type="float",default=0.0,help="seconds to wait for more queries to score together")
+
+class Query: #{{{
+   # the words of one window a client asks for, and their scores once done
+   def __init__(self, key, words):
+      self.key = key
+      self.words = words
+      self.scores = None
+      self.done = threading.Event()
+#}}}
+
+class Scorer(threading.Thread): #{{{
+   """
+   scores the queries of all the connections: the ones waiting are taken
+   together, grouped by window, and each word of a window is scored once.
+   """
+   def __init__(self, model, cache, batch_wait=0.0):
+      threading.Thread.__init__(self)
+      self.daemon = True
+      self.model = model
+      self.cache = cache
+      self.batch_wait = batch_wait
+      self.queue = Queue.Queue()
+      self.lock = threading.Lock()
+      self.started = time.time()
+      self.stats = {'connections':0, 'requests':0, 'queries':0, 'words':0, 'batches':0,
+                    'windows':0, 'scored':0, 'cache_hits':0}
+
+   def count(self, key, n=1):
+      with self.lock:
+         self.stats[key] += n
+
+   def snapshot(self):
+      with self.lock:
+         stats = dict(self.stats)
+      stats['uptime'] = time.time() - self.started
+      # the words asked for but not computed here (shared or cached)
+      stats['saved'] = stats['words'] - stats['scored']
+      return stats
+
+   def ask(self, queries):
+      for q in queries:
+         self.queue.put(q)
+      for q in queries:
+         q.done.wait()
+      return queries
+
+   def run(self):
+      while True:
+         batch = [self.queue.get()]
+         deadline = time.time() + self.batch_wait
+         while True:
+            try:
+               batch.append(self.queue.get(timeout=max(0, deadline - time.time())) if self.batch_wait > 0 else self.queue.get_nowait())
+            except Queue.Empty:
+               break
+         try:
+            self._score(batch)
+         except Exception, e:
+            error = "%s: %s" % (e.__class__.__name__, e)
+            for q in batch:
+               if q.scores is None: q.scores = error
+         for q in batch:
+            q.done.set()
+
+   def _score(self, batch):
+      windows = {} # key: {word: score}
+      for q in batch:
+         scores = windows.setdefault(q.key, {})
+         for w in q.words:
+            scores[w] = None
+      cache = self.cache
+      nscored = nhits = 0
+      for key, scores in windows.iteritems():
+         todo = []
+         for w in scores:
+            total = cache.get("%s\t%s\t%s" % (key[0], w, key[1])) if cache is not None else None
+            if total is None: todo.append(w)
+            else:
+               scores[w] = total
+               nhits += 1
+         if todo:
+            for w, total in zip(todo, lm.window_scores(self.model, key, todo)):
+               scores[w] = total
+               if cache is not None: cache.put("%s\t%s\t%s" % (key[0], w, key[1]), total)
+            nscored += len(todo)
+      for q in batch:
+         scores = windows[q.key]
+         q.scores = [scores[w] for w in q.words]
+      with self.lock:
+         self.stats['batches'] += 1
+         self.stats['windows'] += len(windows)
+         self.stats['scored'] += nscored
+         self.stats['cache_hits'] += nhits
+#}}}
+
+class Handler(SocketServer.StreamRequestHandler): #{{{
+   def handle(self):
+      scorer = self.server.scorer
+      scorer.count('connections')
+      while True:
+         lines = []
+         while True:
+            line = self.rfile.readline()
+            if not line: return # closed
+            line = line.rstrip("\n")
+            if not line: break
+            lines.append(line)
+         scorer.count('requests')
+         self.wfile.write("".join("%s\n" % a for a in self.answer(lines)))
+         self.wfile.flush()
+
+   def answer(self, lines):
+      scorer = self.server.scorer
+      answers = [None]*len(lines)
+      queries = [] # (index, Query)
+      for i, line in enumerate(lines):
+         f = line.split("\t")
+         if f[0] == "W" and len(f) == 4:
+            queries.append((i, Query((f[1], f[2]), f[3].split())))
+         elif f[0] == "O":
+            answers[i] = str(self.server.model.order)
+         elif f[0] == "I":
+            answers[i] = self.server.lm_id
+         elif f[0] == "T":
+            answers[i] = json.dumps(scorer.snapshot(), sort_keys=True)
+         else:
+            answers[i] = "E\tbad query: %r" % line[:100]
+      if queries:
+         scorer.count('queries', len(queries))
+         scorer.count('words', sum(len(q.words) for i, q in queries))
+         scorer.ask([q for i, q in queries])
+         for i, q in queries:
+            if isinstance(q.scores, str):
+               answers[i] = "E\t%s" % q.scores
+            else:
+               answers[i] = " ".join(repr(s) for s in q.scores)
+      return answers
+#}}}
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+   daemon_threads = True
+
+if __name__ == '__main__':
+   opts, args = parser.parse_args()
+   if not opts.socket:
+      parser.print_usage()
+      sys.exit(1)
+
+   lm.configure(opts.lm, opts.lm_load)
+   if lm.path().startswith("unix:"):
+      sys.stderr.write("--lm must be a model file, not another server\n")
+      sys.exit(1)
+   model = lm.model()
+   cache = lm.ScoreCache(opts.cache_size) if opts.cache_size > 0 else None
+   scorer = Scorer(model, cache, opts.batch_wait)
+   scorer.start()
+
+   if os.path.exists(opts.socket): os.unlink(opts.socket)
+   server = UnixServer(opts.socket, Handler)
+   server.scorer = scorer
+   server.model = model
+   server.lm_id = lm.lm_id(lm.path())
+   sys.stderr.write("serving %s (order %d) on %s\n" % (lm.path(), model.order, opts.socket))
+   def stop(signum, frame):
+      raise KeyboardInterrupt
+   signal.signal(signal.SIGTERM, stop)
+   signal.signal(signal.SIGINT, stop)
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   finally:
+      server.server_close()
+      if os.path.exists(opts.socket): os.unlink(opts.socket)
+      sys.stderr.write("stopped: %s\n" % json.dumps(scorer.snapshot(), sort_keys=True))
@@ -0,0 +1,42 @@
+# types for the compiled build of core.py (cython reads this file when it
+# compiles core.py; plain python ignores it)
+
+import cython
+from ml.ml cimport MulticlassModel, MultitronParameters
+
+cdef frozenset DETS, TARGET_PREP, PREV_PREP_TAGS, NOUN_TAGS, DET_INS_TAGS
+cdef long LEFT, NO_CHILD, DELETES # (EDITS stays a python name: precompute_lm.py imports it)
+
+@cython.locals(tag=object, form=object, edited=bint, mask=long)
+cpdef long edit_mask(object tok)
+
+cdef class EditMasks:
+   cdef public dict masks
+   @cython.locals(mask=long)
+   cpdef update(self, object tok, object deps)
+   cpdef long allowed(self, object tok1, object tok2)
+
+@cython.locals(cands=list, cls=int)
+cpdef list candidates(list scores, object tok1, object tok2, Py_ssize_t nparsed, long allowed)
+
+@cython.locals(k=Py_ssize_t)
+cpdef list as_list(object scores)
+
+cdef list get_scores(object scorer, MulticlassModel mm, MultitronParameters mp, object feats)
+
+@cython.locals(i=Py_ssize_t, nparsed=Py_ssize_t, allowed=long, scores=list, fresh=list, mm=MulticlassModel, mp=MultitronParameters)
+cpdef score_pairs(object todo, list parsed, object deps, list sent, object extract, object scorer, dict scache, object fcache, object agenda, EditMasks masks, bint can_edit, bint verify=*)
+
+@cython.locals(tok=object, cache=object)
+cpdef object evict(list parsed, Py_ssize_t x, Py_ssize_t w, tuple caches)
+
+cdef class ParseKey:
+   cdef object okey
+   cdef dict snaps
+   cpdef forget(self, object tid)
+   @cython.locals(snap=dict)
+   cpdef dict snapshot(self, object tok)
+
+@cython.locals(max_edits=Py_ssize_t, num_edits=Py_ssize_t, can_edit=bint, cls=long, i=Py_ssize_t,
+               masks=EditMasks, key=ParseKey, scache=dict, caches=tuple)
+cpdef easy_first(list parsed, object deps, list sent, object order, object extract, object scorer, Py_ssize_t w, object edit, bint verify=*)
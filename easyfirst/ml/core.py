@@ -0,0 +1,277 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the easy-first loop of the parser, and its per-step work: scoring the
+pairs of neighbouring tokens, the rules deciding which actions a pair
+allows, the sort key of the candidates, and the scores to forget after
+an action.
+
+this is plain python, and also the source of a compiled module (see
+core.pxd and setup.py): when ml/core.so is built it is imported instead.
+the feature extractor is whatever the parser was given.  the scorer is
+called directly (in C, when compiled) when it is one of the models of
+ml.pyx, else through its get_scores method.  the edits are made by the
+parser (they need the LM and pattern.en), through a python callback.
+"""
+
+from __future__ import absolute_import
+from agenda import Agenda, Reversed
+from ml.ml import MulticlassModel, MultitronParameters
+
+# membership tests only: easyfirst.py has the ordered lists
+DETS = frozenset(['a', 'an', 'the'])
+TARGET_PREP = frozenset(["on", "about", "from", "for", "of", "to", "at", "in", "with", "by"])
+PREV_PREP_TAGS = frozenset(["NN", "NNS", "DT", "CD", "JJ", "JJR", "JJS", "NNP", "NNPS"])
+NOUN_TAGS = frozenset(['NN', 'NNS'])
+DET_INS_TAGS = frozenset(['NN', 'NNS', 'JJ', 'JJR', 'JJS'])
+
+# the edit classes (2-9) a token allows as the right token of a pair, one
+# bit per class.  the bits above LEFT are the classes it rules out as the
+# left token of a pair.
+EDITS = 0x3fc # classes 2-9
+LEFT = 10
+NO_CHILD = (1<<3) | (1<<7) | (1<<9) # deleteDet, deletePrep, substituteDet
+DELETES = (1<<3) | (1<<7) # deleteDet, deletePrep
+
+def edit_mask(tok):
+   """
+   the mask of tok, from its tag, its form and its morph (edited) flag,
+   as if it had no children.
+   """
+   tag = tok.tag
+   form = tok.form
+   edited = tok.get('morph') == 1 # the root has no morph
+   mask = 0
+   if tag in NOUN_TAGS and not edited:
+      mask |= 1<<2 # substituteNN
+   if form in DETS and not edited:
+      mask |= 1<<3 # deleteDet
+      if tag == "DT":
+         mask |= 1<<9 # substituteDet
+   if tag in DET_INS_TAGS and not form[0].isupper():
+      mask |= 1<<4 # insertDet
+   if tag.startswith("VB") and not edited:
+      mask |= 1<<5 # substituteVform
+   if tag == "IN" and form in TARGET_PREP and not edited:
+      mask |= (1<<6) | (1<<7) # substitutePrep, deletePrep
+   if tag in PREV_PREP_TAGS:
+      mask |= 1<<8 # insertPrep
+   # no insertion between a DT (an IN) and the token on its right
+   if tag == "DT":
+      mask |= (1<<4) << LEFT
+   if tag == "IN":
+      mask |= (1<<8) << LEFT
+   return mask
+
+class EditMasks: #{{{
+   """
+   the masks of the tokens of a sentence, by token id.  update() must be
+   called for a token whenever its tag, form or morph flag change, or it
+   gets a child (and for a token that is inserted).
+   """
+   def __init__(self, sent, deps):
+      self.masks = {}
+      for tok in sent:
+         self.update(tok, deps)
+
+   def update(self, tok, deps):
+      mask = edit_mask(tok)
+      if deps._childs.get(tok.id):
+         mask &= ~NO_CHILD
+      self.masks[tok.id] = mask
+
+   def allowed(self, tok1, tok2):
+      # the edit classes allowed on the pair (tok1,tok2)
+      masks = self.masks
+      return masks[tok2.id] & EDITS & ~(masks[tok1.id] >> LEFT)
+#}}}
+
+def candidates(scores, tok1, tok2, nparsed, allowed):
+   """
+   the actions allowed on the pair (tok1,tok2), as tuples of
+   (score, class, child, parent, id of tok1).
+   nparsed is the length of parsed, allowed the mask of the edit classes
+   allowed on the pair (0 when no edit is possible).
+   """
+   tid = tok1.id
+   cands = []
+   # attach actions (when allowed)
+   if tok1.form == "_ROOT_":
+      if nparsed == 2:
+         cands.append((scores[1],1,tok2,tok1,tid)) # force the right attach to ROOT at the end
+      # else: prevent attaching to the root until the end
+   else:
+      cands.append((scores[0],0,tok1,tok2,tid)) # tok1 is child of tok2 = left attach
+      cands.append((scores[1],1,tok2,tok1,tid)) # tok2 is child of tok1 = right attach
+
+   # edit actions
+   cls = 2
+   while allowed >> cls:
+      if allowed & (1<<cls):
+         cands.append((scores[cls],cls,tok1,tok2,tid))
+      cls += 1
+   return cands
+
+def as_list(scores):
+   # MulticlassModel gives a list, MultitronParameters a dict by class
+   return [scores[k] for k in xrange(len(scores))]
+
+def get_scores(scorer, mm, mp, feats):
+   # the scores of feats by class, as a list.  mm (mp) is scorer when it
+   # is a MulticlassModel (MultitronParameters), else None.
+   if mm is not None:
+      return mm.get_scores(feats)
+   if mp is not None:
+      return mp.get_scores_list(feats)
+   return as_list(scorer.get_scores(feats))
+
+def score_pairs(todo, parsed, deps, sent, extract, scorer, scache, fcache, agenda, masks, can_edit, verify=False):
+   """
+   (re)score the pairs (parsed[i],parsed[i+1]) for i in todo, and push
+   their candidates to the agenda (masks: the EditMasks of the tokens).  the scores (and the features, unless
+   fcache is None) are cached by the id of the left token of the pair.
+   with verify, cached scores are checked against a fresh extraction.
+   """
+   nparsed = len(parsed)
+   allowed = 0
+   mm = scorer if isinstance(scorer, MulticlassModel) else None
+   mp = scorer if isinstance(scorer, MultitronParameters) else None
+   for i in todo:
+      tok1 = parsed[i]
+      tid = tok1.id
+      scores = scache.get(tid)
+      if scores is None:
+         feats = None
+         if fcache is not None:
+            feats = fcache.get(tid)
+         if feats is None:
+            feats = extract(parsed,deps,i,sent)
+            if fcache is not None: fcache[tid] = feats
+         scores = get_scores(scorer, mm, mp, feats)
+         scache[tid] = scores
+      elif verify:
+         fresh = get_scores(scorer, mm, mp, extract(parsed,deps,i,sent))
+         assert fresh == scores, "stale cached scores for pair %s: %s != %s" % (tid, scores, fresh)
+      tok2 = parsed[i+1]
+      if can_edit: allowed = masks.allowed(tok1, tok2)
+      agenda.push(tid, candidates(scores, tok1, tok2, nparsed, allowed))
+
+def evict(parsed, x, w, caches):
+   """
+   drop the cached entries of all the pairs that can see parsed[x], or
+   the gap right before it (after a removal), and return the positions
+   of these pairs (w is the window of the feature extractor).
+   the caches are keyed by the id of the left token of the pair.
+   """
+   for tok in parsed[max(0,x-w-1):x+w+1]:
+      for cache in caches:
+         cache.pop(tok.id,None)
+   return xrange(max(0,x-w-1), min(len(parsed)-1,x+w+1))
+
+def _attach(cand):
+   return cand[1] < 2
+
+def easy_first(parsed, deps, sent, order, extract, scorer, w, edit, verify=False):
+   """
+   the easy-first loop: apply the best action to parsed (the root and
+   the tokens of sent) until only the root is left.
+
+   the loop attaches, and keeps the pairs, their scores, the agenda and
+   the masks of the tokens up to date.  edit(cls, p) makes an edit of
+   class cls on p (the right token of the pair) in the sentence: it edits
+   the token, or sent, and returns the token inserted before p, if any.
+   deleting p from parsed is left to the loop.
+   there are at most as many edits as tokens, and none on the last one.
+   """
+   max_edits = len(parsed)
+   masks = EditMasks(sent, deps)
+   key = ParseKey(order)
+   agenda = Agenda(key)
+   scache = {}
+   caches = (scache,)
+   num_edits = 0
+   todo = None # positions of the pairs to (re)score, None for all of them
+   while len(parsed)>1:
+      can_edit = num_edits<=max_edits and len(parsed) > 2
+      if todo is None:
+         agenda.clear()
+         todo = xrange(len(parsed)-1)
+      # score the pairs that changed
+      score_pairs(todo, parsed, deps, sent, extract, scorer, scache, None, agenda, masks, can_edit, verify)
+
+      # find best action
+      best = agenda.best(None if can_edit else _attach)
+      assert best is not None
+      cls = best[1]
+      c = best[2]
+      p = best[3]
+
+      # forget only the scores of the pairs around the change
+      if cls <= 1: # attach
+         deps.add(p,c)
+         parsed.remove(c)
+         masks.update(p, deps) # p got a child
+         agenda.drop(c.id)
+         agenda.drop(parsed[-1].id) # the last token starts no pair
+         todo = evict(parsed, parsed.index(p), w, caches)
+      else:
+         i = parsed.index(p)
+         new = edit(cls, p)
+         num_edits += 1
+         if (1<<cls) & DELETES:
+            # the token has no children: nothing in deps refers to it
+            del parsed[i]
+            agenda.drop(p.id)
+            agenda.drop(parsed[-1].id)
+            scache.pop(p.id,None)
+         elif new is not None:
+            parsed.insert(i, new)
+            masks.update(new, deps)
+         else:
+            masks.update(p, deps) # p was edited
+         key.forget(p.id)
+         todo = evict(parsed, i, w, caches)
+      if len(parsed) == 2:
+         todo = None # the root pair becomes attachable
+
+class ParseKey: #{{{
+   """
+   the sort key of the candidates of the parser: best first, ties broken
+   as max() over (score, class, child, parent) would, with the tokens as
+   dicts and their order keys standing for their ids.
+
+   the tokens are copied (they are edited in place after being pushed).
+   the copies are shared by all the candidates of a token, until forget()
+   is called for it: after each edit of the token.
+   """
+   def __init__(self, order):
+      self.okey = order.key
+      self.snaps = {}
+
+   def forget(self, tid):
+      self.snaps.pop(tid, None)
+
+   def snapshot(self, tok):
+      snap = self.snaps.get(tok.id)
+      if snap is None:
+         snap = dict(tok.items())
+         snap['id'] = self.okey(tok.id)
+         self.snaps[tok.id] = snap
+      return snap
+
+   def __call__(self, cand):
+      return Reversed((cand[0], cand[1], self.snapshot(cand[2]), self.snapshot(cand[3])))
+#}}}
@@ -0,0 +1,66 @@
+## Copyright 2013 Yoav Goldberg
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with This code.  If not, see <http://www.gnu.org/licenses/>.
+
+# the models of ml.pyx, for the modules that call them at C level (core.py)
+
+cdef class DoublesArr:
+   cdef double* vals
+   cdef public int n
+
+cdef class MulticlassModel:
+   cdef dict W
+   cdef DoublesArr biases # specific type?
+   cdef int nclas
+   cdef double* scores
+   cdef int probs_output
+
+   cdef load(self,fname)
+   cpdef object predict(self,list features)
+   cpdef object predict_r(self,list features)
+   cpdef object get_scores(self,list features)
+   cpdef list get_scores_r(self,list features)
+
+cdef class MulticlassParamData:
+   cdef:
+      double *acc
+      double *w
+      int *lastUpd
+
+cdef class MultitronParameters:
+   cdef:
+      int nclasses
+      int now
+      dict W
+
+      double* scores # (re)used in calculating prediction
+
+   cpdef getW(self, clas)
+   cdef _tick(self)
+   cpdef scalar_multiply(self, double scalar)
+   cpdef add(self, list features, int clas, double amount)
+   cpdef add_r(self, list features, int clas, double amount)
+   cpdef set(self, list features, int clas, double amount)
+   cpdef add_params(self, MultitronParameters other, double factor)
+   cpdef flush(self)
+   cpdef mix(self, list others)
+   cpdef do_pa_update(self, list feats, int gold_cls, double C=*)
+   cpdef pa_update(self, object gu_feats, object go_feats, int gu_cls, int go_cls,double C=*)
+   cpdef get_scores(self, features)
+   cpdef list get_scores_list(self, list features)
+   cpdef get_scores_r(self, features)
+   cpdef predict_best_class_r(self, list features)
+   cdef int _predict_best_class(self, list features)
+   cdef _update(self, int goodClass, int badClass, list features)
+   cdef _update_r(self, int goodClass, int badClass, list features)
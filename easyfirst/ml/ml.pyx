@@ -20,8 +20,7 @@ from stdlib cimport *
 
 
 cdef class DoublesArr:
-   cdef double* vals
-   cdef public int n
+   # attributes in ml.pxd
    def __cinit__(self, list nums):
       cdef double n
       cdef int i
@@ -34,12 +33,7 @@ cdef class DoublesArr:
       free(self.vals)
 
 cdef class MulticlassModel: 
-
-   cdef dict W
-   cdef DoublesArr biases # specific type?
-   cdef int nclas
-   cdef double* scores
-   cdef int probs_output
+   # attributes in ml.pxd
 
    cdef load(self,fname):
       sys.stderr.write("loading model %s" % fname)
@@ -171,10 +165,7 @@ cdef class MulticlassModel:
 ### Model trainers {{{
 
 cdef class MulticlassParamData:
-   cdef:
-      double *acc
-      double *w
-      int *lastUpd
+   # attributes in ml.pxd
    def __cinit__(self, int nclasses):
       cdef int i
       self.lastUpd = <int *>malloc(nclasses*sizeof(int))
@@ -191,13 +182,8 @@ cdef class MulticlassParamData:
       free(self.w)
 
 cdef class MultitronParameters:
-   cdef:
-      int nclasses
-      int now
-      dict W
+   # attributes in ml.pxd
 
-      double* scores # (re)used in calculating prediction
-   
    def __cinit__(self, nclasses):
       self.scores = <double *>malloc(nclasses*sizeof(double))
 
@@ -304,6 +290,79 @@ cdef class MultitronParameters:
             p.w[clas]+=(op.w[clas]*factor)
             p.lastUpd[clas]=self.now
 
+   cpdef flush(self):
+      """
+      brings the sums of the averaging up to now, as if every weight had
+      just been updated (the average doesn't change)
+      """
+      cdef MulticlassParamData p
+      cdef int c
+      for p in self.W.itervalues():
+         for c in xrange(self.nclasses):
+            p.acc[c]+=(self.now-p.lastUpd[c])*p.w[c]
+            p.lastUpd[c]=self.now
+
+   cpdef mix(self, list others):
+      """
+      iterative parameter mixing: others were trained from copies of self
+      (flushed) on parts of the data.  self gets their mean weights, and
+      the steps of all of them in its averaging (see MultitronMixer, which
+      mixes them a part at a time).
+      """
+      cdef MultitronParameters o
+      mixer = MultitronMixer(self, len(others))
+      for o in others:
+         assert(self.nclasses==o.nclasses),"incompatible number of classes in mix"
+         mixer.add(*o.state())
+      mixer.done()
+
+   def state(self):
+      """
+      the parameters as python values, with the state of the averaging
+      (flushed): (now, {feature: (weights, sums)}), e.g. to send them to
+      another process, which set_state()s them.
+      """
+      cdef MulticlassParamData p
+      cdef int c
+      self.flush()
+      W = {}
+      for f,p in self.W.iteritems():
+         W[f] = ([p.w[c] for c in xrange(self.nclasses)], [p.acc[c] for c in xrange(self.nclasses)])
+      return self.now, W
+
+   def changes(self, int since):
+      """
+      like state(), but only the features updated after step since: what a
+      copy of the parameters flushed at since sends back to a
+      MultitronMixer.  the others are as they were at since.
+      """
+      cdef MulticlassParamData p
+      cdef int c
+      W = {}
+      for f,p in self.W.iteritems():
+         for c in xrange(self.nclasses):
+            if p.lastUpd[c] > since: break
+         else:
+            continue
+         for c in xrange(self.nclasses):
+            p.acc[c]+=(self.now-p.lastUpd[c])*p.w[c]
+            p.lastUpd[c]=self.now
+         W[f] = ([p.w[c] for c in xrange(self.nclasses)], [p.acc[c] for c in xrange(self.nclasses)])
+      return self.now, W
+
+   def set_state(self, int now, dict W):
+      cdef MulticlassParamData p
+      cdef int c
+      self.now = now
+      self.W = {}
+      for f,(w,acc) in W.iteritems():
+         p = MulticlassParamData(self.nclasses)
+         for c in xrange(self.nclasses):
+            p.w[c] = w[c]
+            p.acc[c] = acc[c]
+            p.lastUpd[c] = now
+         self.W[f] = p
+
    cpdef do_pa_update(self, list feats, int gold_cls, double C=1.0):
       cdef double go_scr
       cdef double gu_scr
@@ -360,6 +419,21 @@ cdef class MultitronParameters:
          res[i] = self.scores[i]
       return res
 
+   cpdef list get_scores_list(self, list features):
+      """
+      like get_scores, but as a list by class (as MulticlassModel.get_scores)
+      """
+      cdef MulticlassParamData p
+      cdef int c
+      for c in xrange(self.nclasses):
+         self.scores[c]=0
+      for f in features:
+         p = self.W.get(f)
+         if p is None: continue
+         for c in xrange(self.nclasses):
+            self.scores[c] += p.w[c]
+      return [self.scores[c] for c in xrange(self.nclasses)]
+
    cpdef get_scores_r(self, features):
       """
       like get_scores but with real values features
@@ -490,7 +564,87 @@ cdef class MultitronParameters:
             out.write(" %s " % ((p.acc[c]+((self.now-p.lastUpd[c])*p.w[c])) / self.now))
          out.write("\n")
 
+cdef class MultitronMixer:
+   """
+   iterative parameter mixing, a part at a time: params is flushed (at
+   step start), copies of it are trained on parts of the data, and each
+   sends back its changes(start), given to add() as they come.  done()
+   then gives params the mean weights of the parts, and the steps of all
+   of them in its averaging: the sums each of them added to its copy,
+   and their steps in now.
+
+   only the features some part changed are kept: for the others, each
+   part has the weights of params, and added them to its sums at each of
+   its steps.
+   """
+   cdef MultitronParameters params
+   cdef readonly int start
+   cdef int parts
+   cdef int added
+   cdef int steps
+   cdef dict sums # feature: (sums of the weights and of the sums added, [parts, steps])
+
+   def __init__(self, MultitronParameters params, int parts):
+      params.flush()
+      self.params = params
+      self.start = params.now
+      self.parts = parts
+      self.added = 0
+      self.steps = 0
+      self.sums = {}
+
+   def add(self, int now, dict W):
+      # the changes() of a part
+      cdef MulticlassParamData p
+      cdef MulticlassParamData sp
+      cdef int c
+      cdef int steps = now-self.start
+      cdef int nclasses = self.params.nclasses
+      self.added+=1
+      self.steps+=steps
+      for f,(w,acc) in W.iteritems():
+         try:
+            p, counts = self.sums[f]
+         except KeyError:
+            p = MulticlassParamData(nclasses)
+            counts = [0, 0]
+            self.sums[f] = (p, counts)
+         sp = self.params.W.get(f)
+         for c in xrange(nclasses):
+            p.w[c]+=w[c]
+            # what the part added to the sums of its copy of params
+            p.acc[c]+=acc[c]
+            if sp is not None: p.acc[c]-=sp.acc[c]
+         counts[0]+=1
+         counts[1]+=steps
+
+   def done(self):
+      cdef MulticlassParamData p
+      cdef MulticlassParamData sp
+      cdef int c
+      cdef int unchanged
+      cdef int now = self.start+self.steps
+      cdef double k = self.parts
+      cdef MultitronParameters params = self.params
+      assert self.added==self.parts,"mix: %d parts of %d" % (self.added, self.parts)
+      for f,(p,counts) in self.sums.iteritems():
+         sp = params.W.get(f)
+         unchanged = self.parts-counts[0]
+         for c in xrange(params.nclasses):
+            if sp is not None:
+               p.w[c] = (p.w[c]+unchanged*sp.w[c])/k
+               p.acc[c]+=sp.acc[c]+(self.steps-counts[1])*sp.w[c]
+            else:
+               p.w[c]/=k
+            p.lastUpd[c]=now
+         params.W[f] = p
+      # the features no part changed are brought up to now by the
+      # averaging (from their lastUpd, start)
+      params.now = now
+      self.sums = {}
+
 ##################
+
 cdef class ParamData:
    cdef:
       double acc
@@ -1,12 +1,12 @@
 from distutils.core import setup
 from distutils.extension import Extension
-from Cython.Distutils import build_ext
+from Cython.Build import cythonize
 
 setup(
-      cmdclass = {'build_ext': build_ext},
-      ext_modules = [
+      ext_modules = cythonize([
          Extension("ml", ["ml.pyx"]),
          Extension("sml", ["sml.pyx"]),
-         ]
+         Extension("core", ["core.py"]), # typed by core.pxd
+         ], include_path=[".", ".."]) # core.pxd cimports ml.ml
       )
 
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+a small n-gram language model, trained from the forms of CoNLL files: a
+stand-in for the kenlm model in tests and benchmarks, or where the
+gigaword model doesn't fit.  it has the interface of the LMs of lm.py.
+
+   python ngram.py -n 3 -o ../data/train.ngram ../data/train.E00
+   python parse.py -m ./models/E20.model --lm ../data/train.ngram ../data/dev.E20
+
+the sentences are learnt as the parser scores them, _ROOT_ first.  the
+probabilities are interpolated Witten-Bell estimates over add-one
+smoothed unigrams (all the unknown words are one <unk>).
+
+the vocabulary is hashed: a dict from each word to its number.  the file
+keeps the words in the order of their numbers, and the dict is built
+again when it is read, the only work of loading that is not reading
+arrays.  an n-gram is a key packing the numbers of its words, and the
+counts are kept in arrays sorted by key and searched by bisection.  the
+file is these arrays as they are, with the size of the keys in its
+header: a file written where the keys are 8 bytes is read back where
+they are 4, if its keys fit in them.
+"""
+
+import sys
+import math
+import struct
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+MAGIC = "easyfirst-ngram\n"
+
+UNK, BOS, EOS = 0, 1, 2
+
+# the typecode of the keys: 'q' where the array module has it, else 'l'
+# (64 bits on most unix builds, 32 on windows)
+try:
+   KEY = 'q'
+   array(KEY)
+except ValueError:
+   KEY = 'l'
+KEY_BITS = array(KEY).itemsize*8 - 1
+
+class State(object):
+   # the ids of the last order-1 words
+   __slots__ = ('h',)
+   def __init__(self):
+      self.h = ()
+
+def _key(ids, bits):
+   key = 0
+   for i in ids:
+      key = (key << bits) | i
+   return key
+
+def _find(keys, key):
+   i = bisect_left(keys, key)
+   if i < len(keys) and keys[i] == key: return i
+   return -1
+
+class NgramLM: #{{{
+   """
+   vocab: the words, by id.  unigrams: the count of each word, by id.
+   grams[k-1]: (keys, counts) of the (k+1)-grams, and ctxs[k-1]: (keys,
+   totals, types) of their contexts of k words (total count of the
+   n-grams that follow them, and number of distinct words that do), for
+   k = 1..order-1.
+   """
+   def __init__(self, order, bits, vocab, unigrams, grams, ctxs):
+      self.order = order
+      self.bits = bits
+      self.vocab = vocab
+      self.ids = dict((w,i) for i,w in enumerate(vocab))
+      self.unigrams = unigrams
+      self.norm = float(sum(unigrams) + len(vocab))
+      self.grams = grams
+      self.ctxs = ctxs
+
+   State = State
+
+   def BeginSentenceWrite(self, state):
+      state.h = (BOS,)
+
+   def NullContextWrite(self, state):
+      state.h = ()
+
+   def BaseScore(self, state, word, out):
+      wid = self.ids.get(word, UNK)
+      h = state.h
+      bits = self.bits
+      p = (self.unigrams[wid] + 1) / self.norm
+      # from the shortest context to the longest: a context never seen
+      # has no longer one seen either
+      for k in xrange(1, min(len(h), self.order-1)+1):
+         ckey = _key(h[-k:], bits)
+         keys, totals, types = self.ctxs[k-1]
+         i = _find(keys, ckey)
+         if i < 0: break
+         gkeys, counts = self.grams[k-1]
+         g = _find(gkeys, (ckey << bits) | wid)
+         c = counts[g] if g >= 0 else 0
+         p = (c + types[i]*p) / (totals[i] + types[i])
+      if self.order > 1:
+         out.h = (h + (wid,))[-(self.order-1):]
+      return math.log10(p)
+
+   def score(self, sentence, bos=True, eos=True):
+      state = State()
+      if bos: self.BeginSentenceWrite(state)
+      out = State()
+      words = sentence.split()
+      if eos: words.append("</s>")
+      total = 0.0
+      for w in words:
+         total += self.BaseScore(state, w, out)
+         state, out = out, state
+      return total
+
+   @classmethod
+   def train(cls, sents, order=3, min_count=1):
+      # sents: lists of words
+      freq = defaultdict(int)
+      for sent in sents:
+         for w in sent:
+            freq[w] += 1
+      vocab = ["<unk>", "<s>", "</s>"] + sorted(w for w,c in freq.iteritems() if c >= min_count and w not in ("<unk>","<s>","</s>"))
+      bits = max(1, len(bin(len(vocab)-1)) - 2)
+      if bits*order > KEY_BITS:
+         raise ValueError("%d words are too many for %d-grams of %d bit keys" % (len(vocab), order, KEY_BITS))
+      ids = dict((w,i) for i,w in enumerate(vocab))
+      counts = [defaultdict(int) for k in xrange(order)]
+      for sent in sents:
+         seq = [BOS] + [ids.get(w, UNK) for w in sent] + [EOS]
+         for i in xrange(1, len(seq)):
+            for k in xrange(min(order, i+1)):
+               counts[k][tuple(seq[i-k:i+1])] += 1
+      unigrams = array('i', [0]*len(vocab))
+      for (w,), c in counts[0].iteritems():
+         unigrams[w] = c
+      grams = []
+      ctxs = []
+      for k in xrange(1, order):
+         keyed = sorted((_key(g, bits), c) for g, c in counts[k].iteritems())
+         grams.append((array(KEY, [key for key,c in keyed]), array('i', [c for key,c in keyed])))
+         totals = defaultdict(int)
+         types = defaultdict(int)
+         for key, c in keyed:
+            totals[key >> bits] += c
+            types[key >> bits] += 1
+         ckeys = sorted(totals)
+         ctxs.append((array(KEY, ckeys), array('i', [totals[key] for key in ckeys]), array('i', [types[key] for key in ckeys])))
+      return cls(order, bits, vocab, unigrams, grams, ctxs)
+
+   def _arrays(self):
+      arrays = [self.unigrams]
+      for gram, ctx in zip(self.grams, self.ctxs):
+         arrays.extend(gram)
+         arrays.extend(ctx)
+      return arrays
+
+   def save(self, filename):
+      words = "\n".join(self.vocab)
+      arrays = self._arrays()
+      fh = open(filename, "wb")
+      fh.write(MAGIC)
+      fh.write("%d %d %d %d %d\n" % (self.order, self.bits, len(self.vocab), len(words), array(KEY).itemsize))
+      fh.write("%s\n" % " ".join(str(len(a)) for a in arrays))
+      fh.write(words)
+      for a in arrays:
+         a.tofile(fh)
+      fh.close()
+
+   @classmethod
+   def load(cls, filename):
+      fh = open(filename, "rb")
+      assert fh.read(len(MAGIC)) == MAGIC, "%s is not an n-gram model of ngram.py" % filename
+      order, bits, nvocab, nbytes, keysize = map(int, fh.readline().split())
+      if bits*order > KEY_BITS:
+         raise ValueError("%s needs keys of %d bits, they are %d here" % (filename, bits*order, KEY_BITS))
+      sizes = map(int, fh.readline().split())
+      vocab = fh.read(nbytes).split("\n")
+      assert len(vocab) == nvocab
+      arrays = []
+      for n, code in zip(sizes, "i" + "kikii"*(order-1)):
+         if code == 'k' and keysize != array(KEY).itemsize:
+            fmt = "=%d%s" % (n, {4: 'i', 8: 'q'}[keysize])
+            a = array(KEY, struct.unpack(fmt, fh.read(n*keysize)))
+         else:
+            a = array(KEY if code == 'k' else code)
+            a.fromfile(fh, n)
+         arrays.append(a)
+      fh.close()
+      rest = arrays[1:]
+      grams = [tuple(rest[5*k:5*k+2]) for k in xrange(order-1)]
+      ctxs = [tuple(rest[5*k+2:5*k+5]) for k in xrange(order-1)]
+      return cls(order, bits, vocab, arrays[0], grams, ctxs)
+#}}}
+
+if __name__ == '__main__':
+   from optparse import OptionParser
+   from pio import io
+
+   usage="""usage: %prog -o model [options] conll_file..."""
+   parser = OptionParser(usage)
+   parser.add_option("-o","--output",dest="output")
+   parser.add_option("-n","--order",dest="order",type="int",default=3)
+   parser.add_option("--min_count",dest="min_count",type="int",default=1,help="rarer words are <unk>")
+   opts, args = parser.parse_args()
+   if not opts.output or not args:
+      parser.print_usage()
+      sys.exit(1)
+
+   sents = []
+   for fname in args:
+      for sent in io.conll_to_sents(file(fname)):
+         sents.append(["_ROOT_"] + [tok.form for tok in sent])
+   lm = NgramLM.train(sents, opts.order, opts.min_count)
+   lm.save(opts.output)
+   print "%d sentences, %d words, %s n-grams" % (len(sents), len(lm.vocab), " ".join(str(len(g[0])) for g in [(lm.unigrams,)] + lm.grams))
@@ -18,12 +18,14 @@
 
 
 import sys
-from pio import io
+from pio import io, stream
 from easyfirst import test,parse,Model
+import lm
+from common import Token
 
 from optparse import OptionParser
 
-usage="""usage: %prog -m model [options] input_file """ 
+usage="""usage: %prog -m model [options] input_file   (- for stdin)""" 
 
 parser = OptionParser(usage)
 parser.add_option("-m","--model",dest="model_file")
@@ -31,13 +33,20 @@ parser.add_option("--iter",dest="iter",default="FINAL")
 parser.add_option("-e","--eval",action="store_true",dest="eval",default=False)
 parser.add_option("--nopunct",action="store_true",dest="ignore_punc",default=False)
 parser.add_option("-t",dest="tagged",action="store_true",default=False)
+parser.add_option("--verify_cache",dest="verify_cache",action="store_true",default=False,help="check the cached scores against a full recompute")
+parser.add_option("--workers",dest="workers",type="int",default=1,help="number of parsing processes (forked after the models are loaded)")
+parser.add_option("--chunksize",dest="chunksize",type="int",default=20,help="sentences handed to a worker at a time")
+parser.add_option("-o","--output",dest="output",default="-",help="where to write the parses (default: - for stdout)")
+parser.add_option("--lm",dest="lm",default=None,help="kenlm model (default: the one in the .model file, else %s)" % lm.DEFAULT_LM)
+parser.add_option("--lm_decisions",dest="lm_decisions",type="int",default=100000,help="LM choices kept for the next sentences (0: none)")
+parser.add_option("--lm_load",dest="lm_load",type="choice",choices=sorted(lm.LOAD_METHODS),default=None,help="kenlm load method (default: kenlm's): %s" % ", ".join(sorted(lm.LOAD_METHODS)))
 
 opts, args = parser.parse_args()
 
 def read_tagged(fh):
    for line in fh:
       res = (x.rsplit("_",1) for x in line.strip().split())
-      res = [{'form':f,'id':id,'tag':t} for id,(f,t) in enumerate(res,1)]
+      res = [Token(form=f,id=id,tag=t) for id,(f,t) in enumerate(res,1)]
       yield res
       
 
@@ -54,8 +63,10 @@ else:
    reader=io.conll_to_sents
 
 model = Model.load("%s" % opts.model_file, opts.iter)
+lm.configure(opts.lm or model.lmFile, opts.lm_load)
 
-test_sents = [s for s in reader(file(TEST_FILE))]
+# sentences are read lazily, as the parser goes
+test_sents = reader(stream.lines(stream.open_in(TEST_FILE)))
 
 
 attachonly = False
@@ -63,8 +74,8 @@ if "E00" in opts.model_file:
     attachonly = True
 
 if opts.eval:
-   test(test_sents, model, opts.iter, quiet=False, ignore_punc=opts.ignore_punc, labeled=False)
+   test(list(test_sents), model, opts.iter, quiet=False, ignore_punc=opts.ignore_punc, labeled=False)
 else:
-   parse(attachonly, test_sents, model, opts.iter)
+   parse(attachonly, test_sents, model, opts.iter, verify_cache=opts.verify_cache, workers=opts.workers, chunksize=opts.chunksize, out=stream.open_out(opts.output), lm_decisions=opts.lm_decisions)
 
 
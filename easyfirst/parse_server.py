@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with This code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+a parse daemon: the model, the weights and the LM are loaded once, and
+parse requests are served over HTTP, on localhost or on a unix socket.
+
+   POST /parse    CoNLL sentences in, parsed CoNLL sentences out
+   GET  /health   "ok", or a 503 while the batches get no results
+   GET  /stats    counters, as JSON
+
+the requests are served by threads; their sentences are batched and
+parsed by a pool of processes forked after the models are loaded.
+when too many requests are waiting, new ones get a 503.  a batch whose
+worker died, or that runs for more than --batch_timeout seconds, fails
+its request at once.  a request that times out (504) is dropped: its
+sentences not in a batch yet are not parsed.  on ^C or SIGTERM the
+batches being parsed get --batch_timeout seconds to finish.
+
+   python parse_server.py -m ./models/T.model --port 8765
+   curl --data-binary @../data/dev.E20 http://localhost:8765/parse
+
+   python parse_server.py -m ./models/T.model --socket /tmp/easyfirst.sock
+   curl --unix-socket /tmp/easyfirst.sock --data-binary @../data/dev.E20 http://localhost/parse
+
+--lm sets the language model (a small ARPA file is enough for testing);
+it is loaded before the workers are forked, --lm_load lazy lets them share
+the pages of a binary model.
+"""
+
+import os
+import sys
+import time
+import errno
+import json
+import signal
+import threading
+import Queue
+import SocketServer
+import BaseHTTPServer
+from optparse import OptionParser
+
+usage="""usage: %prog -m model [options]"""
+
+parser = OptionParser(usage)
+parser.add_option("-m","--model",dest="model_file")
+parser.add_option("--iter",dest="iter",default="FINAL")
+parser.add_option("--lm",dest="lm",default=None,help="language model to load instead of the one in the .model file")
+parser.add_option("--lm_load",dest="lm_load",default=None,help="kenlm load method (lazy, read, ...)")
+parser.add_option("--lm_decisions",dest="lm_decisions",type="int",default=100000,help="LM choices kept by each worker (0: none)")
+parser.add_option("--host",dest="host",default="127.0.0.1")
+parser.add_option("--port",dest="port",type="int",default=8765)
+parser.add_option("--socket",dest="socket",default=None,help="listen on this unix socket instead of --host/--port")
+parser.add_option("--workers",dest="workers",type="int",default=2,help="number of parsing processes")
+parser.add_option("--batch",dest="batch",type="int",default=32,help="max sentences per batch")
+parser.add_option("--batch_wait",dest="batch_wait",type="float",default=0.005,help="seconds to wait for more requests to fill a batch")
+parser.add_option("--max_queue",dest="max_queue",type="int",default=64,help="requests that can wait before new ones are refused")
+parser.add_option("--timeout",dest="timeout",type="float",default=300.0,help="seconds before a request gives up")
+parser.add_option("--batch_timeout",dest="batch_timeout",type="float",default=60.0,help="seconds a batch can run before its request is failed")
+parser.add_option("--quiet",dest="quiet",action="store_true",default=False,help="don't log the requests")
+
+class Job: #{{{
+   """
+   the sentences of one request, and their parses as they come back.
+   """
+   def __init__(self, sents):
+      self.sents = sents
+      self.results = [None]*len(sents)
+      self.remaining = len(sents)
+      self.taken = 0 # sentences already put in a batch
+      self.error = None
+      self.done = threading.Event()
+      self.start = time.time()
+#}}}
+
+# the workers tell the server their pid when they start, as (None, pid),
+# and which batch they start, as (batch number, pid): set before the pool
+# is forked
+_starts = None
+
+def _init_worker():
+   # ^C (or a SIGTERM to the whole group) reaches the workers too: leave it
+   # to the server, which lets them finish their batches and stops them
+   signal.signal(signal.SIGINT, signal.SIG_IGN)
+   signal.signal(signal.SIGTERM, signal.SIG_IGN)
+   _starts.put((None, os.getpid()))
+
+def _alive(pid):
+   # the pool reaps a dead worker within a tenth of a second: its pid is
+   # then gone
+   try:
+      os.kill(pid, 0)
+   except OSError, e:
+      return e.errno != errno.ESRCH
+   return True
+
+def _parse_batch(n, sents):
+   # runs in a worker: a failed sentence doesn't take the batch down
+   _starts.put((n, os.getpid()))
+   out = []
+   for sent in sents:
+      try:
+         out.append((True, parse_sent(_shared['parser'], sent)))
+      except Exception, e:
+         out.append((False, "%s: %s" % (e.__class__.__name__, e)))
+   return out
+
+class Dispatcher(threading.Thread): #{{{
+   """
+   takes the jobs off the queue, packs their sentences into batches of up
+   to batch sentences, and hands the batches to the pool.  at most
+   2*workers batches are in the pool at a time.
+
+   the pool doesn't call back for a batch whose worker died, or whose
+   result couldn't be sent back: reap() fails those batches (and the rest
+   of their jobs), and frees their slots.  a batch that runs for more
+   than batch_timeout seconds (from the time its worker reports to
+   watch() that it started it) fails its jobs too, but keeps its slot
+   until it is done.
+   """
+   def __init__(self, pool, workers, batch, batch_wait, max_queue, batch_timeout=60.0):
+      threading.Thread.__init__(self)
+      self.daemon = True
+      self.pool = pool
+      self.batch = batch
+      self.batch_wait = batch_wait
+      self.batch_timeout = batch_timeout
+      self.inflight = {} # batch number: (AsyncResult, items)
+      self.running = {} # batch number: (pid of its worker, start time)
+      self.workers = set() # the pids the workers reported, alive at the last reap()
+      self.late = set() # batches failed by reap() that still hold their slots
+      self.finishing = threading.Lock() # the result thread and the reaper share the jobs
+      self.queue = Queue.Queue(max_queue)
+      self.slots = threading.Semaphore(2*workers)
+      self.lock = threading.Lock()
+      self.closed = False
+      self.healthy = True # False from a lost batch to the next result
+      self.lost = 0 # batches of dead workers
+      self.started = time.time()
+      self.stats = {'requests':0, 'completed':0, 'rejected':0, 'sentences':0, 'failed_sentences':0,
+                    'batches':0, 'batches_in_flight':0, 'failed_batches':0, 'late_batches':0, 'timed_out':0, 'latency_total':0.0}
+
+   def count(self, key, n=1):
+      with self.lock:
+         self.stats[key] += n
+
+   def submit(self, job):
+      # False when the queue is full (the caller refuses the request)
+      try:
+         self.queue.put_nowait(job)
+      except Queue.Full:
+         self.count('rejected')
+         return False
+      self.count('requests')
+      return True
+
+   def snapshot(self):
+      with self.lock:
+         stats = dict(self.stats)
+      stats['queued_requests'] = self.queue.qsize()
+      stats['uptime'] = time.time() - self.started
+      stats['mean_latency'] = stats.pop('latency_total') / max(1, stats['completed'])
+      return stats
+
+   def close(self):
+      # no more batches: the pool finishes the ones it has, for at most
+      # batch_timeout seconds, then stops.  a pool with the batch of a dead
+      # worker would wait for it forever, and a late batch may never end:
+      # then it is terminated, and the batches left fail their jobs
+      with self.lock:
+         self.closed = True
+         self.pool.close()
+      deadline = time.time() + self.batch_timeout
+      while time.time() < deadline:
+         with self.lock:
+            if not [n for n in self.inflight if n not in self.late]: break
+         time.sleep(0.1)
+      with self.lock:
+         left = self.inflight.items()
+         self.inflight.clear()
+         self.running.clear()
+         late = set(self.late)
+      if left or self.lost:
+         self.pool.terminate()
+      for n, (res, items) in left:
+         if n not in late: self._fail(items, "the server stopped")
+      self.pool.join()
+
+   def run(self):
+      pending = None # a job that didn't fit in the previous batch
+      while True:
+         items = [] # (job, index in the job)
+         job = pending or self.queue.get()
+         pending = None
+         deadline = time.time() + self.batch_wait
+         while True:
+            # a job that is done already timed out, or was failed by
+            # reap(): the rest of it is dropped
+            if not job.done.is_set():
+               take = min(self.batch - len(items), len(job.sents) - job.taken)
+               items.extend((job, k) for k in xrange(job.taken, job.taken+take))
+               job.taken += take
+               if job.taken < len(job.sents):
+                  pending = job # the rest goes into the next batch
+                  break
+            if len(items) >= self.batch: break
+            try:
+               job = self.queue.get(timeout=max(0, deadline - time.time()))
+            except Queue.Empty:
+               break
+         if not items: continue
+         self.slots.acquire()
+         sents = [owner.sents[k] for owner, k in items]
+         with self.lock:
+            if self.closed: return
+            self.stats['batches'] += 1
+            self.stats['batches_in_flight'] += 1
+            n = self.stats['batches']
+            # the callback waits for the lock: n is in inflight before it runs
+            res = self.pool.apply_async(_parse_batch, (n, sents), callback=self._callback(n))
+            self.inflight[n] = (res, items)
+
+   def watch(self, starts):
+      # runs in its own thread: the workers report themselves, and the
+      # batches they start
+      while True:
+         n, pid = starts.get()
+         with self.lock:
+            if n is None: self.workers.add(pid)
+            elif n in self.inflight: self.running[n] = (pid, time.time())
+
+   def reap(self):
+      # fails the batches the pool won't call back for, and the late ones
+      now = time.time()
+      lost = []
+      late = []
+      with self.lock:
+         # a worker reports itself before any of its batches: the pid of a
+         # running batch is one of them
+         self.workers = set(pid for pid in self.workers if _alive(pid))
+         alive = self.workers
+         for n, (res, items) in self.inflight.items():
+            pid, start = self.running.get(n, (None, None))
+            if res.ready():
+               if not res.successful(): lost.append((n, res, items)) # the worker is done with it
+            elif pid is not None and pid not in alive:
+               lost.append((n, res, items))
+            elif start is not None and now - start > self.batch_timeout and n not in self.late:
+               late.append(items)
+               self.late.add(n)
+         for n, res, items in lost:
+            del self.inflight[n]
+            self.running.pop(n, None)
+         failed = [n for n, res, items in lost if n in self.late]
+         self.late.difference_update(failed)
+      for n, res, items in lost:
+         if res.ready():
+            try:
+               res.get(0)
+            except Exception, e:
+               error = "%s: %s" % (e.__class__.__name__, e)
+         else:
+            error = "its worker died"
+            self.healthy = False
+            self.lost += 1
+         self._release()
+         self.count('failed_batches')
+         if n not in failed: self._fail(items, error)
+      for items in late:
+         self.count('late_batches')
+         self._fail(items, "no result after %gs" % self.batch_timeout)
+
+   def reaper(self):
+      # runs in its own thread
+      while True:
+         time.sleep(min(1.0, self.batch_timeout))
+         self.reap()
+
+   def _callback(self, n):
+      def done(results):
+         # runs in the result thread of the pool
+         with self.lock:
+            batch = self.inflight.pop(n, None)
+            self.running.pop(n, None)
+            late = n in self.late
+            self.late.discard(n)
+         if batch is not None: # else reap() failed it already (and freed its slot)
+            self.healthy = True
+            self._release()
+            if not late: self._finish(batch[1], results)
+      return done
+
+   def _release(self):
+      self.slots.release()
+      self.count('batches_in_flight', -1)
+
+   def _fail(self, items, error):
+      self._finish(items, [(False, error)]*len(items))
+      for job, k in items:
+         job.done.set() # without the other batches of the job
+
+   def _finish(self, items, results):
+      with self.finishing:
+         for (job, k), (ok, text) in zip(items, results):
+            job.results[k] = text
+            if not ok:
+               job.error = "sentence %d: %s" % (k+1, text)
+               self.count('failed_sentences')
+            job.remaining -= 1
+            if job.remaining == 0:
+               self.count('completed')
+               self.count('sentences', len(job.sents))
+               self.count('latency_total', time.time() - job.start)
+               job.done.set()
+#}}}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler): #{{{
+   protocol_version = "HTTP/1.1"
+
+   def address_string(self):
+      # client_address is empty on a unix socket
+      return self.client_address[0] if self.client_address else "unix"
+
+   def reply(self, code, body, ctype="text/plain", headers=()):
+      self.send_response(code)
+      self.send_header("Content-Type", ctype)
+      self.send_header("Content-Length", str(len(body)))
+      for k, v in headers:
+         self.send_header(k, v)
+      self.end_headers()
+      self.wfile.write(body)
+
+   def do_GET(self):
+      if self.path == "/health":
+         if self.server.dispatcher.healthy:
+            self.reply(200, "ok\n")
+         else:
+            self.reply(503, "batches are getting no results\n")
+      elif self.path == "/stats":
+         self.reply(200, json.dumps(self.server.dispatcher.snapshot(), sort_keys=True) + "\n", "application/json")
+      else:
+         self.reply(404, "not found\n")
+
+   def do_POST(self):
+      if self.path != "/parse":
+         return self.reply(404, "not found\n")
+      body = self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+      try:
+         sents = list(io.conll_to_sents(body.splitlines()))
+      except Exception, e:
+         return self.reply(400, "bad CoNLL input: %s\n" % e)
+      if not sents:
+         return self.reply(200, "")
+      job = Job(sents)
+      if not self.server.dispatcher.submit(job):
+         return self.reply(503, "busy, try again\n", headers=[("Retry-After","1")])
+      if not job.done.wait(self.server.request_timeout):
+         job.done.set() # its sentences not in a batch yet are dropped
+         self.server.dispatcher.count('timed_out')
+         return self.reply(504, "timed out\n")
+      if job.error:
+         return self.reply(500, "%s\n" % job.error)
+      self.reply(200, "".join(job.results))
+
+   def log_message(self, format, *args):
+      if not self.server.quiet:
+         sys.stderr.write("%s - [%s] %s\n" % (self.address_string(), self.log_date_time_string(), format % args))
+#}}}
+
+class TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+   daemon_threads = True
+   allow_reuse_address = True
+
+class UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+   daemon_threads = True
+
+if __name__ == '__main__':
+   opts, args = parser.parse_args()
+   if not opts.model_file:
+      parser.print_usage()
+      sys.exit(1)
+
+   from pio import io
+   from easyfirst import Model, Parser, Oracle, MulticlassModel, parse_sent, _shared
+   import lm
+   import multiprocessing
+   import multiprocessing.queues
+
+   model = Model.load("%s" % opts.model_file, opts.iter)
+   lm.configure(opts.lm or model.lmFile, opts.lm_load)
+   lm.model() # loaded once, before the fork
+   attachonly = "E00" in opts.model_file
+   _shared['parser'] = Parser(attachonly, MulticlassModel(model.weightsFile(opts.iter)), model.featureExtractor(), Oracle())
+   if opts.lm_decisions > 0: _shared['parser'].lmdecisions = lm.DecisionCache(opts.lm_decisions)
+   _starts = multiprocessing.queues.SimpleQueue()
+   # fork before any thread is started
+   pool = multiprocessing.Pool(max(1, opts.workers), _init_worker)
+
+   dispatcher = Dispatcher(pool, max(1, opts.workers), opts.batch, opts.batch_wait, opts.max_queue, opts.batch_timeout)
+   dispatcher.start()
+   watcher = threading.Thread(target=dispatcher.watch, args=(_starts,))
+   reaper = threading.Thread(target=dispatcher.reaper)
+   for thread in (watcher, reaper):
+      thread.daemon = True
+      thread.start()
+
+   if opts.socket:
+      if os.path.exists(opts.socket): os.unlink(opts.socket)
+      server = UnixServer(opts.socket, Handler)
+      where = opts.socket
+   else:
+      server = TCPServer((opts.host, opts.port), Handler)
+      where = "http://%s:%d" % (opts.host, opts.port)
+   server.dispatcher = dispatcher
+   server.request_timeout = opts.timeout
+   server.quiet = opts.quiet
+   sys.stderr.write("serving on %s\n" % where)
+   def stop(signum, frame):
+      raise KeyboardInterrupt
+   signal.signal(signal.SIGTERM, stop)
+   signal.signal(signal.SIGINT, stop)
+   try:
+      server.serve_forever()
+   except KeyboardInterrupt:
+      pass
+   finally:
+      server.server_close()
+      dispatcher.close()
+      if opts.socket and os.path.exists(opts.socket): os.unlink(opts.socket)
+      sys.stderr.write("stopped\n")
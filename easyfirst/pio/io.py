@@ -20,32 +20,33 @@ from collections import defaultdict
 
 sys.path.append("..")
 import common
+from common import Token
 
 def to_tok(line):
    if line[4]=="_": line[4]=line[3]
-   return {"parent": int(line[-4]),
-           "prel"  : line[-3],
-           "form"  : line[1], 
-           "lem"  : line[2], 
-           "id"    : int(line[0]), 
-           "tag"   : line[4],
-           "ctag"   : line[3],
-           "morph" : line[-5],
-           "extra" :  line[-1],
-           }
+   return Token(parent= int(line[-4]),
+                prel  = line[-3],
+                form  = line[1],
+                lem   = line[2],
+                id    = int(line[0]),
+                tag   = line[4],
+                ctag  = line[3],
+                morph = line[-5],
+                extra = line[-1],
+                )
 
 def to_tok_str(line):
    if line[4]=="_": line[4]=line[3]
-   return {"parent": line[-4],
-           "prel"  : line[-3],
-           "form"  : line[1], 
-           "lem"  : line[2], 
-           "id"    : line[0], 
-           "tag"   : line[4],
-           "ctag"   : line[3],
-           "morph" : line[-5],
-           "extra" :  line[-1],
-           }
+   return Token(parent= line[-4],
+                prel  = line[-3],
+                form  = line[1],
+                lem   = line[2],
+                id    = line[0],
+                tag   = line[4],
+                ctag  = line[3],
+                morph = line[-5],
+                extra = line[-1],
+                )
 
 def conll_to_sents(fh,ignore_errs=True):
    for sent in yutils.tokenize_blanks(fh):
@@ -81,10 +82,10 @@ def conll_to_sents2(fh,ignore_errs=True):
       if ignore_errs and sent[0][0][0]=="@": continue
       sent = [to_tok(l) for l in sent]
       for tok in sent:
-         par = tok['parent']
-         if par==0: tok['partok']=ROOT
-         elif par==-1: tok['partok']=None
-         else: tok['partok']=sent[par-1]
+         par = tok.parent
+         if par==0: tok.partok=ROOT
+         elif par==-1: tok.partok=None
+         else: tok.partok=sent[par-1]
       yield sent
 
 def read_dep_trees(fh,ignore_errs=True):
@@ -103,27 +104,27 @@ def kbest_conll_to_sents(fh,ignore_errs=True):
 class DepTree:
    def __init__(self, sent):
       self.toks=sent[:]
-      self._tok_by_id=dict([(t['id'],t) for t in sent])
+      self._tok_by_id=dict([(t.id,t) for t in sent])
       self._tok_by_id[0]=common.ROOT
       self._childs=defaultdict(list)
       self._parents={}
       for tok in sent:
-         self._childs[tok['parent']].append(tok)
-         self._parents[tok['id']] = self._tok_by_id[tok['parent']]
+         self._childs[tok.parent].append(tok)
+         self._parents[tok.id] = self._tok_by_id[tok.parent]
 
    def itertokens(self):
       for t in self.toks: yield t
 
    def parent(self, tok):
-      return self._parents[tok['id']]
+      return self._parents[tok.id]
 
    def childs(self, tok):
-      return self._childs[tok['id']]
+      return self._childs[tok.id]
 
 def out_conll(sent,out=sys.stdout,parent='parent',form='form',prel='prel'):
    for tok in sent:
       try:
-         out.write("%s\n" % "\t".join(map(str, [tok['id'], tok[form], tok['lem'],tok['tag'],tok['tag'],"_",tok[parent],tok[prel],"_",tok.get('extra','_')])))
+         out.write("%s\n" % "\t".join(map(str, [tok.id, tok[form], tok.lem,tok.tag,tok.tag,"_",tok[parent],tok[prel],"_",tok.get('extra','_')])))
       except KeyError,e:
          print e
          print tok
@@ -140,8 +141,8 @@ def add_parents_annotation(sents, parents_file):
          id = int(parents[0])
          pars = [int(x.split(":")[0]) for x in parents[1:]]
          scrs = [x.split(":")[1] for x in parents[1:]]
-         assert(id==tok['id'])
-         tok['cand_parents'] = pars
+         assert(id==tok.id)
+         tok.cand_parents = pars
    return sents
 
 
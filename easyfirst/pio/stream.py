@@ -0,0 +1,112 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+streaming helpers for the parser: reading and writing run in background
+threads, through bounded queues, so that memory stays flat whatever the
+size of the input.
+"""
+
+import sys
+import threading
+import Queue
+
+_END = object()
+
+def open_in(filename):
+   if filename == "-": return sys.stdin
+   return file(filename)
+
+def open_out(filename):
+   if filename == "-": return sys.stdout
+   return file(filename, "w")
+
+def lines(fh):
+   # line by line, without the read-ahead of "for line in fh" (which would
+   # hold back the first sentences of a pipe until its buffer is full)
+   return iter(fh.readline, "")
+
+class _Failure:
+   def __init__(self, exc_info):
+      self.exc_info = exc_info
+
+def prefetch(items, size=256):
+   """
+   iterate over items, produced ahead (at most size of them) by a
+   background thread.  an exception of the producer is raised here.
+   """
+   q = Queue.Queue(size)
+   def produce():
+      try:
+         for item in items:
+            q.put(item)
+      except:
+         q.put(_Failure(sys.exc_info()))
+      q.put(_END)
+   t = threading.Thread(target=produce)
+   t.daemon = True
+   t.start()
+   while True:
+      item = q.get()
+      if item is _END: break
+      if isinstance(item, _Failure):
+         raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+      yield item
+
+class BatchWriter: #{{{
+   """
+   writes strings to out from a background thread.  whatever is queued
+   when the thread wakes up (up to batch strings) goes out in one write.
+   write() blocks when size strings are waiting.
+   """
+   def __init__(self, out, size=256, batch=64):
+      self.out = out
+      self.batch = batch
+      self.queue = Queue.Queue(size)
+      self.error = None
+      self.thread = threading.Thread(target=self._run)
+      self.thread.daemon = True
+      self.thread.start()
+
+   def write(self, text):
+      if self.error: raise self.error[0], self.error[1], self.error[2]
+      self.queue.put(text)
+
+   def close(self):
+      # flush everything and wait for the thread
+      self.queue.put(_END)
+      self.thread.join()
+      if self.error: raise self.error[0], self.error[1], self.error[2]
+
+   def _run(self):
+      q = self.queue
+      done = False
+      while not done:
+         texts = [q.get()]
+         while len(texts) < self.batch:
+            try:
+               texts.append(q.get_nowait())
+            except Queue.Empty:
+               break
+         if texts[-1] is _END:
+            texts.pop()
+            done = True
+         if self.error: continue # keep draining so that writers don't block
+         try:
+            self.out.write("".join(texts))
+            self.out.flush()
+         except:
+            self.error = sys.exc_info()
+#}}}
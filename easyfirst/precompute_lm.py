@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the LM scores of the edit candidates of a training corpus, computed once
+and stored in a ScoreCache file (see lm.py) that train.py reads with
+--lm_cache.  training then doesn't ask the LM for them, and loads it
+only at the first score that is missing (see below):
+
+   python precompute_lm.py -o ../data/train.E20.lm ../data/train.E20
+   python train.py -o ./models/E20 ... --lm_cache ../data/train.E20.lm
+
+a run of train.py with the LM adds the scores it computed to the file.
+a file filled that way has all the scores of the runs with the same
+corpus and options (--seed, --costoracle, --workers, --iters at most the
+same): those runs don't need the LM on the machine at all.  without it,
+a missing score fails the run.
+
+the edits are those Parser.train may make (the eligibility rules of
+ml/core.py, regardless of the tree): on the sentences as they are read,
+and on each sentence after one edit, near the edit.  the windows of a
+sentence with two edits close to each other are not in the file (all the
+combinations of the edits of a window are a few hundred times more
+scores).
+"""
+
+import sys
+from optparse import OptionParser
+from pio import io
+from common import ROOT, Token
+from easyfirst import DETS, TARGET_PREP, TARGET_VFORM, TENSE_ASPECTS
+from ml.core import edit_mask, EDITS
+from pattern.en import lemma, conjugate, pluralize, singularize
+import lm
+
+usage="""usage: %prog -o output [options] train_file..."""
+
+parser = OptionParser(usage)
+parser.add_option("-o","--output",dest="output")
+parser.add_option("--lm",dest="lm",default=None,help="kenlm model (default: %s)" % lm.DEFAULT_LM)
+parser.add_option("--lm_load",dest="lm_load",type="choice",choices=sorted(lm.LOAD_METHODS),default=None)
+parser.add_option("--depth",dest="depth",type="int",default=1,help="0: the sentences as read only, 1: also after one edit")
+parser.add_option("--memory",dest="memory",type="int",default=1000000,help="scores kept in memory while writing")
+
+def lm_edits(tok):
+   """
+   the edits of tok ranked by the LM, as in Parser.train: (candidates,
+   insertion before tok or not, tag of the edited token (by candidate
+   for substituteVform)).
+   """
+   mask = edit_mask(tok) & EDITS
+   if mask & (1<<4): yield DETS, True, 'DT'                   # insertDet
+   if mask & (1<<8): yield TARGET_PREP, True, 'IN'            # insertPrep
+   if mask & (1<<9): yield ['a', 'the', 'an'], False, 'DT'    # substituteDet
+   if mask & (1<<6): yield TARGET_PREP, False, 'IN'           # substitutePrep
+   if mask & (1<<5):                                          # substituteVform
+      lem = lemma(tok.form)
+      yield [str(conjugate(lem, ta)) for ta in TENSE_ASPECTS], False, TARGET_VFORM
+
+def _token(form, tag, edited=False):
+   return Token(form=form, tag=tag, morph=1 if edited else "_")
+
+def score_edits(model, cache, toks, lo=1, hi=None):
+   """
+   score the edits of toks[lo:hi] (into cache), and return the sentences
+   they make (toks with the best candidate of each).
+   """
+   if hi is None: hi = len(toks)
+   ctx = lm.Context(model, [tok.form for tok in toks], cache)
+   edited = []
+   for j in xrange(max(1, lo), min(hi, len(toks))):
+      for cands, insert, tags in lm_edits(toks[j]):
+         k = ctx.argmax(j, cands, insert)[0]
+         tag = tags[k] if isinstance(tags, list) else tags
+         new = _token(cands[k], tag, True)
+         edited.append((j, toks[:j] + [new] + toks[j+(not insert):]))
+   return edited
+
+def other_edits(toks):
+   # the sentences made by the edits the LM doesn't rank
+   for j in xrange(1, len(toks)):
+      tok = toks[j]
+      mask = edit_mask(tok) & EDITS
+      if mask & ((1<<3)|(1<<7)): # deleteDet, deletePrep
+         yield j, toks[:j] + toks[j+1:]
+      if mask & (1<<2): # substituteNN
+         if tok.tag == "NN": new = _token(pluralize(tok.form), "NNS", True)
+         else: new = _token(singularize(tok.form), "NN", True)
+         yield j, toks[:j] + [new] + toks[j+1:]
+
+if __name__ == '__main__':
+   opts, args = parser.parse_args()
+   if not opts.output or not args:
+      parser.print_usage()
+      sys.exit(1)
+
+   lm.configure(opts.lm, opts.lm_load)
+   model = lm.model()
+   n = model.order
+   cache = lm.ScoreCache(opts.memory, opts.output, lm.lm_id(lm.path()), n)
+   nsents = 0
+   for fname in args:
+      for sent in io.conll_to_sents(file(fname)):
+         toks = [ROOT] + [_token(tok.form, tok.tag) for tok in sent]
+         edited = score_edits(model, cache, toks)
+         if opts.depth == 0: edited = []
+         else: edited.extend(other_edits(toks))
+         for j, toks2 in edited:
+            # the edits whose windows see position j
+            score_edits(model, cache, toks2, j-n+1, j+n+1)
+         nsents += 1
+         if nsents % 1000 == 0:
+            cache.flush()
+            sys.stderr.write("%d sentences, %d scores computed\n" % (nsents, cache.stats()['misses']))
+   cache.close()
+   sys.stderr.write("%d sentences, %d scores computed\n" % (nsents, cache.stats()['misses']))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the alignments of the training sentences with their gold sentences, which
+the oracle of train.py starts from at every epoch, computed once and
+stored in an OracleCache file (see easyfirst.py) that train.py reads with
+--oracle_cache.  the pairs are split among --workers processes.
+
+   python precompute_oracle.py -o ../data/train.E20.oracle --workers 4 ../data/train.E20 ../data/train.E00
+   python train.py -o ./models/E20 ... --oracle_cache ../data/train.E20.oracle
+
+the pairs already in the output file are kept (and not computed again).
+"""
+
+import sys
+import multiprocessing
+from itertools import izip
+from optparse import OptionParser
+from pio import io
+from easyfirst import OracleCache
+import kskutil
+
+usage="""usage: %prog -o output [options] train_file gold_file"""
+
+parser = OptionParser(usage)
+parser.add_option("-o","--output",dest="output")
+parser.add_option("--workers",dest="workers",type="int",default=1,help="number of processes")
+parser.add_option("--chunksize",dest="chunksize",type="int",default=100,help="pairs handed to a process at a time")
+
+def pack(forms):
+   orig_tokens, gold_tokens = forms
+   return OracleCache.key(orig_tokens, gold_tokens), kskutil.packAlignment(orig_tokens, gold_tokens)
+
+if __name__ == '__main__':
+   opts, args = parser.parse_args()
+   if not opts.output or len(args) != 2:
+      parser.print_usage()
+      sys.exit(1)
+
+   cache = OracleCache(opts.output)
+   pairs = (OracleCache.forms(sent, gold_sent) for sent, gold_sent in izip(io.conll_to_sents(file(args[0])), io.conll_to_sents(file(args[1]))))
+   todo = [forms for forms in pairs if OracleCache.key(*forms) not in cache.pairs]
+   if opts.workers > 1:
+      pool = multiprocessing.Pool(opts.workers)
+      packed = pool.imap(pack, todo, opts.chunksize)
+   else:
+      pool = None
+      packed = (pack(forms) for forms in todo)
+   for key, p in packed:
+      cache.put(key, p)
+   if pool is not None:
+      pool.close()
+      pool.join()
+   cache.save()
+   sys.stderr.write("%d pairs, %d computed\n" % (len(cache.pairs), len(todo)))
@@ -0,0 +1,125 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the parser as a library: a Session loads a model once, then parses
+sentences and returns the results, without printing anything.
+
+   from session import Session
+   with Session("./models/E20.model") as s:
+      res = s.parse_one([("He","PRP"), ("have","VBP"), ("apple","NN")])
+      print res.forms, res.heads, res.edits
+      for res in s.parse_iter(io.conll_to_sents(file("../data/dev.E20"))):
+         sys.stdout.write(res.conll())
+
+a sentence is a list of Tokens (as read by pio.io), or of (form, tag)
+pairs.  the sentences given are not modified.
+"""
+
+from easyfirst import Model, Parser, Oracle, MulticlassModel, format_parse, _shared, _parse_ordered
+from common import Token
+import lm
+
+class ParseResult: #{{{
+   """
+   the parse of a sentence.
+
+      tokens  the final sentence, edits applied, as Tokens with their CoNLL
+              id and their predicted parent (pparent)
+      forms   the words of the final sentence
+      heads   the predicted parent of each token (0 is the root)
+      edits   the edits, in the order they were made, as
+              (action type, position, old form, new form).  position is
+              the CoNLL id of the token at the time of the edit; old is
+              None for an insertion, new is None for a deletion.
+   """
+   def __init__(self, tokens, edits):
+      self.tokens = tokens
+      self.forms = [tok.form for tok in tokens]
+      self.heads = [tok.pparent for tok in tokens]
+      self.edits = edits
+
+   def conll(self):
+      return format_parse(self.tokens)
+#}}}
+
+def _token(tok, id):
+   # the parser edits its tokens: give it copies
+   if isinstance(tok, Token): return tok.copy()
+   # the fields of a CoNLL line with only the form and the tag (see pio.io)
+   form, tag = tok
+   return Token(id=id, form=form, lem="_", tag=tag, ctag=tag, morph="_", parent=-1, prel="_", extra="_")
+
+def parse_result(parser, sent):
+   edits = []
+   deps, sent_new = parser.parse([_token(tok, id) for id, tok in enumerate(sent, 1)], edits)
+   return ParseResult(deps.annotate(sent_new), edits)
+
+class Session: #{{{
+   """
+   a loaded model, ready to parse.
+
+   model_file is a .model file (e.g. ./models/E20.model).  attachonly
+   defaults to what parse.py does (the E00 models only attach).  lm_file
+   and lm_load are --lm and --lm_load of parse.py; the LM is shared by
+   the whole process, so the last session opened sets it.  lm_decisions
+   is the size of the lm.DecisionCache of the session (0 for none).  with
+   workers > 1, parse_iter and parse_many spread chunks of chunksize
+   sentences over a pool of processes, forked here; there can be only
+   one such session in a process at a time.
+   """
+   def __init__(self, model_file, iter="FINAL", attachonly=None, workers=1, chunksize=20, lm_file=None, lm_load=None, lm_decisions=100000):
+      if attachonly is None: attachonly = "E00" in model_file
+      model = Model.load(model_file, iter)
+      lm.configure(lm_file or model.lmFile, lm_load)
+      self.parser = Parser(attachonly, MulticlassModel(model.weightsFile(iter)), model.featureExtractor(), Oracle())
+      if lm_decisions > 0: self.parser.lmdecisions = lm.DecisionCache(lm_decisions)
+      self.workers = workers
+      self.chunksize = chunksize
+      self.pool = None
+      if workers > 1:
+         import multiprocessing
+         _shared['parser'] = self.parser
+         lm.model() # loaded once, before the fork
+         self.pool = multiprocessing.Pool(workers)
+
+   def parse_one(self, sent):
+      # always in this process: no round trip to the pool
+      return parse_result(self.parser, sent)
+
+   def parse_iter(self, sents):
+      """
+      the results of sents (any iterable, read as needed), in order.
+      """
+      for results in _parse_ordered(self.parser, sents, parse_result, self.pool, self.workers, self.chunksize):
+         for result in results:
+            yield result
+
+   def parse_many(self, sents):
+      return list(self.parse_iter(sents))
+
+   def close(self):
+      if self.pool is not None:
+         self.pool.close()
+         self.pool.join()
+         self.pool = None
+         _shared.clear()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc):
+      self.close()
+#}}}
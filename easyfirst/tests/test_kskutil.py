@@ -0,0 +1,97 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the edit distances of kskutil against the DP of getEditDist, on random
+sentences of a few words (so that they share many of them).
+"""
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from kskutil import _myers, editDist, packAlignment, getEditDist, EditAlignment
+
+WORDS = ["a", "the", "cat", "cats", "sat", "on", "in", "mat"]
+
+def _seq(rnd, lo=0, hi=9):
+   return [rnd.choice(WORDS) for k in xrange(rnd.randint(lo, hi))]
+
+def _rows(seq, gold):
+   # the last rows of the DP: rows[i][k] = distance of seq[:i] and gold[:k]
+   rows = [range(len(gold)+1)]
+   for i, w in enumerate(seq, 1):
+      row = [i]
+      for k in xrange(1, len(gold)+1):
+         row.append(min(rows[-1][k] + 1, row[k-1] + 1, rows[-1][k-1] + (w != gold[k-1])))
+      rows.append(row)
+   return rows
+
+def _dist(seq, gold):
+   return getEditDist(list(seq), list(gold))[0]
+
+class MyersTest(unittest.TestCase):
+   def test_rows(self):
+      rnd = random.Random(1)
+      for n in xrange(200):
+         seq, gold = _seq(rnd), _seq(rnd, 1)
+         rows = _rows(seq, gold)
+         for i, (pv, mv) in enumerate(_myers(seq, gold), 1):
+            for k in xrange(len(gold)):
+               delta = rows[i][k+1] - rows[i][k]
+               self.assertEqual((pv >> k) & 1, delta == 1)
+               self.assertEqual((mv >> k) & 1, delta == -1)
+
+   def test_edit_dist(self):
+      rnd = random.Random(2)
+      for n in xrange(300):
+         seq, gold = _seq(rnd), _seq(rnd)
+         self.assertEqual(editDist(seq, gold), _dist(seq, gold))
+
+class EditAlignmentTest(unittest.TestCase):
+   def check(self, align, gold):
+      seq = align.seq
+      self.assertEqual(align.distance(), _dist(seq, gold))
+      for j in xrange(len(seq)):
+         self.assertEqual(align.substituted(j, "cat"), _dist(seq[:j] + ["cat"] + seq[j+1:], gold))
+         self.assertEqual(align.deleted(j), _dist(seq[:j] + seq[j+1:], gold))
+      for j in xrange(len(seq)+1):
+         self.assertEqual(align.inserted(j, "the"), _dist(seq[:j] + ["the"] + seq[j:], gold))
+
+   def test_edits(self):
+      # the distances after each of a few edits made, with the rows
+      # computed and unpacked
+      rnd = random.Random(3)
+      for n in xrange(100):
+         seq, gold = _seq(rnd, 1), _seq(rnd, 1)
+         for packed in (None, packAlignment(seq, gold)):
+            align = EditAlignment(seq, gold, packed)
+            self.check(align, gold)
+            for e in xrange(4):
+               j = rnd.randrange(len(align.seq))
+               edit = rnd.choice(["substitute", "insert", "delete"])
+               if edit == "substitute":
+                  align.substitute(j, rnd.choice(WORDS))
+               elif edit == "insert":
+                  align.insert(j, rnd.choice(WORDS))
+               elif len(align.seq) > 1:
+                  align.delete(j)
+               self.check(align, gold)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,93 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the LM Context, with a small model of ngram.py: after edits, its states
+and probabilities (the ones kept, shifted and recomputed) must be those
+of a Context of the edited words, and its windows must rank the
+candidates as the scores of whole sentences do.
+"""
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import lm
+import ngram
+
+SENTS = [
+   "the cat sat on the mat",
+   "a cat sat in the house",
+   "the dogs run on the grass",
+   "he reads the books in the house",
+   "she has a pen and the books",
+]
+WORDS = sorted(set(" ".join(SENTS).split())) + ["unseen"]
+
+class ContextTest(unittest.TestCase):
+   def setUp(self):
+      self.model = ngram.NgramLM.train([s.split() for s in SENTS], order=3)
+
+   def same(self, ctx, words):
+      fresh = lm.Context(self.model, words)
+      self.assertEqual(ctx.words, words)
+      self.assertAlmostEqual(ctx.score(), self.model.score(" ".join(words), bos=True, eos=True), 9)
+      fresh.score()
+      self.assertEqual([s.h for s in ctx.states], [s.h for s in fresh.states])
+      self.assertEqual(ctx.probs, fresh.probs)
+
+   def test_edits(self):
+      rnd = random.Random(1)
+      for n in xrange(200):
+         words = rnd.choice(SENTS).split()
+         ctx = lm.Context(self.model, words)
+         for e in xrange(4):
+            # filled to some point (the edit may be past it)
+            ctx.window(rnd.randint(0, len(words)))
+            j = rnd.randrange(len(words))
+            edit = rnd.choice(["substitute", "insert", "delete"])
+            w = rnd.choice(WORDS)
+            if edit == "substitute":
+               ctx.substitute(j, w)
+               words[j] = w
+            elif edit == "insert":
+               ctx.insert(j, w)
+               words.insert(j, w)
+            elif len(words) > 1:
+               ctx.delete(j)
+               del words[j]
+            self.same(ctx, list(words))
+
+   def test_windows(self):
+      # the differences between the candidates are those of the sentences
+      rnd = random.Random(2)
+      for n in xrange(100):
+         words = rnd.choice(SENTS).split()
+         ctx = lm.Context(self.model, words)
+         j = rnd.randrange(len(words))
+         cands = rnd.sample(WORDS, 3)
+         for insert in (False, True):
+            window = ctx.window(j, insert)
+            scores = [window.score(w) for w in cands]
+            sents = [words[:j] + [w] + words[j+(not insert):] for w in cands]
+            full = [self.model.score(" ".join(s), bos=True, eos=True) for s in sents]
+            for k in xrange(1, len(cands)):
+               self.assertAlmostEqual(scores[k] - scores[0], full[k] - full[0], 9)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,115 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+lm_server.py on a unix socket, serving a model of ngram.py: the window
+scores of an lm.Remote must be those of the model itself, and sentences
+parsed with the LM on the server (by one process or by three) must be
+those parsed with the LM loaded.
+
+the parses need the compiled ml module and pattern.en (skipped without
+them).
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import tempfile
+import subprocess
+import unittest
+from StringIO import StringIO
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, HERE)
+
+import lm
+import ngram
+import test_lm
+import test_session
+try:
+   from easyfirst import Model, train
+   from session import Session
+   import pattern.en
+except ImportError, e:
+   missing = str(e)
+else:
+   missing = None
+
+class LMServerTest(unittest.TestCase):
+   @classmethod
+   def setUpClass(cls):
+      cls.dir = tempfile.mkdtemp()
+      cls.sents, cls.golds = test_session._pairs()
+      cls.lm_file = os.path.join(cls.dir, "lm.ngram")
+      ngram.NgramLM.train([s.split() for s in test_lm.SENTS] + [[tok.form for tok in sent] for sent in cls.golds]).save(cls.lm_file)
+      cls.socket = os.path.join(cls.dir, "lm.sock")
+      cls.server = subprocess.Popen([sys.executable, "-B", "lm_server.py", "--socket", cls.socket, "--lm", cls.lm_file],
+                                    cwd=HERE, stderr=subprocess.PIPE)
+      line = cls.server.stderr.readline()
+      if not line.startswith("serving"):
+         cls.server.wait()
+         raise AssertionError("the LM server didn't start: %s%s" % (line, cls.server.stderr.read()))
+
+   @classmethod
+   def tearDownClass(cls):
+      cls.server.terminate()
+      cls.server.stderr.read()
+      cls.server.wait()
+      shutil.rmtree(cls.dir)
+
+   def test_windows(self):
+      local = lm.open_lm(self.lm_file)
+      remote = lm.open_lm("unix:" + self.socket)
+      self.assertEqual(remote.order, local.order)
+      rnd = random.Random(3)
+      words = test_lm.WORDS + ["books", "apple"]
+      for n in xrange(100):
+         sent = rnd.choice(test_lm.SENTS).split()
+         j = rnd.randrange(len(sent))
+         cands = rnd.sample(words, 4)
+         for insert in (False, True):
+            expected = lm.Window(local, sent, j, insert).scores(cands)
+            self.assertEqual(lm.Window(remote, sent, j, insert).scores(cands), expected)
+            self.assertEqual([lm.Window(remote, sent, j, insert).score(w) for w in cands], expected)
+
+   @unittest.skipIf(missing, "the parser can't be imported: %s" % missing)
+   def test_parses(self):
+      lm.configure(self.lm_file)
+      model = Model(os.path.abspath(test_session.FEATURES), os.path.join(self.dir, "m.weights"), lmFile=lm.path())
+      model_file = os.path.join(self.dir, "m.model")
+      model.save(model_file)
+      random.seed(1)
+      stdout = sys.stdout
+      sys.stdout = StringIO() # the progress of the epochs
+      try:
+         train(False, self.sents, self.golds, model, ITERS=2, save_every=None)
+      finally:
+         sys.stdout = stdout
+      def parse(**kw):
+         with Session(model_file, **kw) as s:
+            return [(res.conll(), res.edits) for res in s.parse_many(self.sents)]
+      expected = parse()
+      self.assertTrue(any(edits for conll, edits in expected))
+      for workers in (1, 3):
+         self.assertEqual(parse(lm_file="unix:" + self.socket, workers=workers, chunksize=2), expected)
+      # the scores came from the server
+      stats = json.loads(lm.open_lm("unix:" + self.socket).ask(["T"])[0])
+      self.assertGreater(stats['words'], 0)
+      lm.configure(self.lm_file)
+
+if __name__ == '__main__':
+   unittest.main()
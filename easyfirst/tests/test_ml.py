@@ -0,0 +1,116 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the weight mixing of train.py --workers: copies of a MultitronParameters
+are trained on their own, and mixed back into it.
+
+needs the compiled ml module, built from ml.pyx (see ml/INSTALL).
+"""
+
+import os
+import sys
+import random
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+   from ml.ml import MultitronParameters, MultitronMixer
+except ImportError, e:
+   missing = str(e)
+else:
+   missing = None
+
+NCLASSES = 3
+
+def _train(params, feats, rnd, steps):
+   for i in xrange(steps):
+      params.tick()
+      params.add(rnd.sample(feats, 2), rnd.randrange(NCLASSES), rnd.choice([1, -1]))
+
+def _averaged(params):
+   # the weights dump_fin writes
+   out = StringIO()
+   params.dump_fin(out)
+   return dict((line.split()[0], map(float, line.split()[1:])) for line in out.getvalue().splitlines())
+
+@unittest.skipIf(missing, "ml can't be imported: %s" % missing)
+class MixTest(unittest.TestCase):
+   # the features each copy is trained on: "a" and "b" are shared, "x",
+   # "y" and "z" are new
+   SHARDS = [["a", "b", "x"], ["c", "y"], ["a", "z", "b"]]
+
+   def setUp(self):
+      self.base = MultitronParameters(NCLASSES)
+      _train(self.base, ["a", "b", "c", "d"], random.Random(1), 20)
+      self.base.flush()
+
+   def copies(self):
+      copies = []
+      for k, feats in enumerate(self.SHARDS):
+         params = MultitronParameters(NCLASSES)
+         params.set_state(*self.base.state())
+         _train(params, feats, random.Random(k), 5+k)
+         copies.append(params)
+      return copies
+
+   def test_mix(self):
+      start, base = self.base.state()
+      copies = self.copies()
+      states = [params.state() for params in copies]
+      self.base.mix(copies)
+      # the mean weights
+      feats = set(base).union(*[W for now, W in states])
+      for c in xrange(NCLASSES):
+         W = self.base.getW(c)
+         self.assertEqual(set(W), feats)
+         for f in feats:
+            # (a copy has all the features of the base, and its own)
+            mean = sum(W1[f][0][c] for now, W1 in states if f in W1) / len(states)
+            self.assertAlmostEqual(W[f], mean, 9)
+      # the averaging: the sums of the base, and what each copy added to
+      # them, over the steps of all of them
+      now = start + sum(now - start for now, W in states)
+      averaged = _averaged(self.base)
+      for f in feats:
+         before = base[f][1] if f in base else [0.0]*NCLASSES
+         for c in xrange(NCLASSES):
+            acc = before[c] + sum(W[f][1][c] - before[c] for n, W in states if f in W)
+            self.assertAlmostEqual(averaged[f][c], acc / now, 9)
+
+   def test_mixer(self):
+      # the changes of each copy, mixed one at a time, mix as the copies do
+      mixed = MultitronParameters(NCLASSES)
+      mixed.set_state(*self.base.state())
+      mixed.mix(self.copies())
+      mixer = MultitronMixer(self.base, len(self.SHARDS))
+      for feats, params in zip(self.SHARDS, self.copies()):
+         now, W = params.changes(mixer.start)
+         self.assertEqual(set(W), set(feats))
+         mixer.add(now, W)
+      mixer.done()
+      for c in xrange(NCLASSES):
+         W = self.base.getW(c)
+         for f, w in mixed.getW(c).iteritems():
+            self.assertAlmostEqual(W[f], w, 9)
+      averaged = _averaged(self.base)
+      for f, ws in _averaged(mixed).iteritems():
+         for c in xrange(NCLASSES):
+            self.assertAlmostEqual(averaged[f][c], ws[c], 9)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,105 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the n-gram models of ngram.py: the probabilities of the words after any
+context sum to one, a sentence scores the sum of its words, and a saved
+model, read back (by lm.open_lm too), is the same model.
+"""
+
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import lm
+import ngram
+
+SENTS = [
+   "the cat sat on the mat",
+   "a cat sat in the house",
+   "the dogs run on the grass",
+   "he reads the books in the house",
+   "she has a pen and the books",
+]
+
+class NgramTest(unittest.TestCase):
+   def setUp(self):
+      self.model = ngram.NgramLM.train([s.split() for s in SENTS], order=3)
+      self.dir = tempfile.mkdtemp()
+
+   def tearDown(self):
+      shutil.rmtree(self.dir)
+
+   def test_sums(self):
+      model = self.model
+      # <s> too: it is never seen after a word, but it is not left out
+      words = model.vocab
+      for h in [(), (ngram.BOS,), (ngram.BOS, model.ids["the"]), (model.ids["the"], model.ids["cat"]), (ngram.UNK, ngram.UNK)]:
+         state = ngram.State()
+         state.h = h
+         total = sum(10 ** model.BaseScore(state, w, ngram.State()) for w in words)
+         self.assertAlmostEqual(total, 1.0, 9)
+
+   def test_score(self):
+      model = self.model
+      for s in SENTS + ["the cat has unseen books"]:
+         state, out = ngram.State(), ngram.State()
+         model.BeginSentenceWrite(state)
+         total = 0.0
+         for w in s.split() + ["</s>"]:
+            total += model.BaseScore(state, w, out)
+            state, out = out, state
+         self.assertAlmostEqual(model.score(s), total, 9)
+
+   def test_save(self):
+      path = os.path.join(self.dir, "train.ngram")
+      self.model.save(path)
+      for loaded in (ngram.NgramLM.load(path), lm.open_lm(path)):
+         self.assertEqual(loaded.vocab, self.model.vocab)
+         self.assertEqual(loaded._arrays(), self.model._arrays())
+         for s in SENTS + ["the cat has unseen books"]:
+            self.assertEqual(loaded.score(s), self.model.score(s))
+
+   def test_keysize(self):
+      # a file written where the keys are of the other size (4 bytes if
+      # they are 8 here, 8 if they are 4) is read as the same model
+      model = self.model
+      other = 12 - array(ngram.KEY).itemsize
+      words = "\n".join(model.vocab)
+      arrays = model._arrays()
+      path = os.path.join(self.dir, "train.ngram")
+      fh = open(path, "wb")
+      fh.write(ngram.MAGIC)
+      fh.write("%d %d %d %d %d\n" % (model.order, model.bits, len(model.vocab), len(words), other))
+      fh.write("%s\n" % " ".join(str(len(a)) for a in arrays))
+      fh.write(words)
+      for a in arrays:
+         if a.typecode == ngram.KEY:
+            fh.write(struct.pack("=%d%s" % (len(a), {4: 'i', 8: 'q'}[other]), *a))
+         else:
+            a.tofile(fh)
+      fh.close()
+      loaded = ngram.NgramLM.load(path)
+      self.assertEqual(loaded._arrays(), model._arrays())
+      self.assertEqual(loaded.score(SENTS[0]), model.score(SENTS[0]))
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,163 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+parse_server.py on a unix socket, with a model trained on the sentences
+of test_session (the LM is a model of ngram.py): it must parse them as a
+Session does, and refuse a request when its queue is full.
+
+needs the compiled ml module and pattern.en (skipped without them).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import httplib
+import tempfile
+import threading
+import subprocess
+import unittest
+from StringIO import StringIO
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, HERE)
+
+import lm
+import test_session
+try:
+   from easyfirst import Model, train
+   from session import Session
+   import pattern.en
+except ImportError, e:
+   missing = str(e)
+else:
+   missing = None
+
+def _conll(sents):
+   lines = []
+   for sent in sents:
+      for tok in sent:
+         lines.append("\t".join(str(v) for v in [tok.id, tok.form, tok.lem, tok.ctag, tok.tag, tok.morph, tok.parent, tok.prel, "_", tok.extra]))
+      lines.append("")
+   return "".join(line + "\n" for line in lines)
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+   def __init__(self, socket_path, timeout=120):
+      httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+      self.socket_path = socket_path
+
+   def connect(self):
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.sock.settimeout(self.timeout)
+      self.sock.connect(self.socket_path)
+
+@unittest.skipIf(missing, "the parser can't be imported: %s" % missing)
+class ParseServerTest(unittest.TestCase):
+   @classmethod
+   def setUpClass(cls):
+      cls.dir = tempfile.mkdtemp()
+      cls.sents, golds = test_session._pairs()
+      test_session._lm(cls.dir, golds)
+      model = Model(os.path.abspath(test_session.FEATURES), os.path.join(cls.dir, "m.weights"), lmFile=lm.path())
+      cls.model_file = os.path.join(cls.dir, "m.model")
+      model.save(cls.model_file)
+      random.seed(1)
+      stdout = sys.stdout
+      sys.stdout = StringIO() # the progress of the epochs
+      try:
+         train(False, cls.sents, golds, model, ITERS=2, save_every=None)
+      finally:
+         sys.stdout = stdout
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.dir)
+
+   def start(self, *args):
+      # the server, and the path of its socket once it serves
+      path = os.path.join(self.dir, "parse.sock")
+      proc = subprocess.Popen([sys.executable, "-B", "parse_server.py", "-m", self.model_file, "--socket", path, "--quiet"] + list(args),
+                              cwd=HERE, stderr=subprocess.PIPE)
+      log = ""
+      while not log.endswith("\n") or not log.splitlines()[-1].startswith("serving on"):
+         line = proc.stderr.readline()
+         if not line:
+            proc.wait()
+            self.fail("the server didn't start: %s" % log)
+         log += line
+      self.addCleanup(self.stop, proc)
+      return path
+
+   def stop(self, proc):
+      proc.terminate()
+      proc.stderr.read()
+      proc.wait()
+
+   def request(self, path, method, url, body=None):
+      conn = UnixHTTPConnection(path)
+      try:
+         conn.request(method, url, body)
+         res = conn.getresponse()
+         return res.status, res.read()
+      finally:
+         conn.close()
+
+   def test_parse(self):
+      with Session(self.model_file) as s:
+         expected = "".join(res.conll() for res in s.parse_many(self.sents))
+      path = self.start("--workers", "2", "--batch", "5")
+      status, body = self.request(path, "POST", "/parse", _conll(self.sents))
+      self.assertEqual(status, 200, body)
+      self.assertEqual(body, expected)
+      stats = json.loads(self.request(path, "GET", "/stats")[1])
+      self.assertEqual(stats['completed'], 1)
+      self.assertEqual(stats['sentences'], len(self.sents))
+      self.assertEqual(stats['failed_batches'], 0)
+
+   def test_queue_full(self):
+      # one worker, one sentence a batch: the dispatcher is batching a big
+      # request, the next one waits in the queue, and the one after that
+      # finds the queue full
+      path = self.start("--workers", "1", "--batch", "1", "--max_queue", "1")
+      big = _conll(self.sents * 100)
+      small = _conll(self.sents[:1])
+      replies = {}
+      def post(name, body):
+         replies[name] = self.request(path, "POST", "/parse", body)
+      threads = [threading.Thread(target=post, args=("big", big))]
+      threads[0].start()
+      def stats():
+         return json.loads(self.request(path, "GET", "/stats")[1])
+      while stats()['batches'] < 3:
+         time.sleep(0.01)
+      threads.append(threading.Thread(target=post, args=("queued", small)))
+      threads[1].start()
+      while stats()['queued_requests'] < 1:
+         time.sleep(0.01)
+      status, body = self.request(path, "POST", "/parse", small)
+      self.assertEqual(status, 503)
+      for thread in threads:
+         thread.join()
+      self.assertEqual(replies["big"][0], 200)
+      self.assertEqual(replies["queued"][0], 200)
+      self.assertEqual(replies["big"][1].count("\n\n"), len(self.sents) * 100)
+      self.assertEqual(stats()['rejected'], 1)
+
+if __name__ == '__main__':
+   unittest.main()
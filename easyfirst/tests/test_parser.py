@@ -0,0 +1,97 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+the edits of Parser.parse: the tokens of parsed and sent are the same
+objects, so a parser made to substitute every noun first must give each
+noun its other number once (with the n-gram model of ngram.py for the
+LM).
+
+needs the compiled ml module and pattern.en (skipped without them).
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+   from easyfirst import Parser, Oracle
+   from moduleloader import load_module
+   from pattern.en import pluralize, singularize
+except ImportError, e:
+   missing = str(e)
+else:
+   missing = None
+from common import Token
+import lm
+import ngram
+
+# forms and tags of sentences to correct
+SENTS = [
+   "He/PRP eats/VBZ an/DT apples/NNS ./.",
+   "She/PRP reads/VBZ the/DT book/NN ./.",
+   "We/PRP walk/VBP to/TO the/DT parks/NNS ./.",
+   "The/DT cat/NN sat/VBD in/IN the/DT mat/NN ./.",
+   "The/DT student/NN read/VBP books/NNS ./.",
+   "He/PRP writes/VBZ letter/NN ./.",
+]
+
+FEATURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "features", "znp.py")
+
+def _sent(line):
+   sent = []
+   for id, field in enumerate(line.split(), 1):
+      form, tag = field.split("/")[:2]
+      sent.append(Token(id=id, form=form, lem="_", tag=tag, ctag=tag, morph="_", parent=-1, prel="_", extra="_"))
+   return sent
+
+class NounsFirst:
+   # scores substituteNN above the attachments, and the other edits below
+   def get_scores(self, feats):
+      scores = dict((k, -1.0) for k in xrange(10))
+      scores.update({0:0.0, 1:0.5, 2:1.0})
+      return scores
+
+@unittest.skipIf(missing, "the parser can't be imported: %s" % missing)
+class NounEditTest(unittest.TestCase):
+   @classmethod
+   def setUpClass(cls):
+      cls.dir = tempfile.mkdtemp()
+      lm_file = os.path.join(cls.dir, "lm.ngram")
+      ngram.NgramLM.train([[field.split("/")[0] for field in line.split()] for line in SENTS]).save(lm_file)
+      lm.configure(lm_file)
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.dir)
+
+   def test_each_noun_once(self):
+      parser = Parser(False, NounsFirst(), load_module(FEATURES).FeaturesExtractor(), Oracle())
+      for line in SENTS:
+         sent = _sent(line)
+         expected = []
+         for tok in sent:
+            if tok.tag == "NN": expected.append(pluralize(tok.form))
+            elif tok.tag == "NNS": expected.append(singularize(tok.form))
+            else: expected.append(tok.form)
+         deps, edited = parser.parse(sent)
+         self.assertEqual([tok.form for tok in edited], expected)
+
+if __name__ == '__main__':
+   unittest.main()
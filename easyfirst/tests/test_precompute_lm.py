@@ -0,0 +1,125 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+train.py from a file of precompute_lm.py, or one filled by a run with
+the LM, with no LM on the machine: it must give the weights of a run
+with the LM, and refuse to start without the file.  the LM is a model of
+ngram.py.
+
+needs the compiled ml module and pattern.en (skipped without them).
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, HERE)
+
+try:
+   import easyfirst
+   import pattern.en
+except ImportError, e:
+   missing = str(e)
+else:
+   missing = None
+import ngram
+
+# (form, tag, head) of the gold sentences, and the forms and tags of the
+# sentences to correct (same trees)
+PAIRS = [
+   ("He/PRP/2 eats/VBZ/0 an/DT/4 apple/NN/2 ./././2", "He/PRP eats/VBZ an/DT apples/NNS ./."),
+   ("She/PRP/2 reads/VBZ/0 the/DT/4 books/NNS/2 ./././2", "She/PRP reads/VBZ the/DT book/NN ./."),
+   ("They/PRP/2 like/VBP/0 a/DT/4 dog/NN/2 ./././2", "They/PRP like/VBP the/DT dog/NN ./."),
+   ("We/PRP/2 walk/VBP/0 to/TO/2 the/DT/5 park/NN/3 ./././2", "We/PRP walk/VBP to/TO the/DT parks/NNS ./."),
+   ("The/DT/2 cat/NN/3 sat/VBD/0 on/IN/3 the/DT/6 mat/NN/4 ./././3", "The/DT cat/NN sat/VBD in/IN the/DT mat/NN ./."),
+   ("He/PRP/2 bought/VBD/0 a/DT/4 car/NN/2 ./././2", "He/PRP bought/VBD a/DT cars/NNS ./."),
+]
+
+def _conll(filename, sents):
+   out = open(filename, "w")
+   for sent in sents:
+      for id, (form, tag, head) in enumerate(sent, 1):
+         out.write("\t".join([str(id), form, "_", tag, tag, "_", str(head), "DEP", "_", "_"]) + "\n")
+      out.write("\n")
+   out.close()
+
+@unittest.skipIf(missing, "the parser can't be imported: %s" % missing)
+class PrecomputedTest(unittest.TestCase):
+   @classmethod
+   def setUpClass(cls):
+      cls.dir = tempfile.mkdtemp()
+      golds, sents = [], []
+      for gold, noisy in PAIRS:
+         fields = [f.rsplit("/", 1) for f in gold.split()]
+         heads = [int(head) for f, head in fields]
+         golds.append([tuple(f.split("/")[:2]) + (head,) for (f, h), head in zip(fields, heads)])
+         sents.append([tuple(f.split("/")[:2]) + (head,) for f, head in zip(noisy.split(), heads)])
+      cls.gold_file = cls.path("train.gold")
+      cls.train_file = cls.path("train.noisy")
+      _conll(cls.gold_file, golds)
+      _conll(cls.train_file, sents)
+      cls.lm_file = cls.path("lm.ngram")
+      ngram.NgramLM.train([["_ROOT_"] + [form for form, tag, head in sent] for sent in golds]).save(cls.lm_file)
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.dir)
+
+   @classmethod
+   def path(cls, name):
+      return os.path.join(cls.dir, name)
+
+   def run_script(self, *args):
+      proc = subprocess.Popen([sys.executable, "-B"] + list(args), cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+      out = proc.communicate()[0]
+      return proc.returncode, out
+
+   def train(self, name, *args):
+      return self.run_script("train.py", "-o", self.path(name), "-f", "features/znp.py", "--iters", "2",
+                             "--train_file", self.train_file, "--gold_file", self.gold_file, *args)
+
+   def weights(self, name):
+      return open(self.path("%s.weights.FINAL" % name)).read()
+
+   def test_without_lm(self):
+      cache = self.path("train.lm")
+      code, out = self.run_script("precompute_lm.py", "-o", cache, "--lm", self.lm_file, self.train_file)
+      self.assertEqual(code, 0, out)
+      code, out = self.train("with_lm", "--lm", self.lm_file)
+      self.assertEqual(code, 0, out)
+      # no LM there: every score comes from the file
+      code, out = self.train("from_file", "--lm", self.path("absent.ngram"), "--lm_cache", cache)
+      self.assertEqual(code, 0, out)
+      self.assertEqual(self.weights("from_file"), self.weights("with_lm"))
+      code, out = self.train("no_file", "--lm", self.path("absent.ngram"))
+      self.assertNotEqual(code, 0)
+      self.assertIn("training needs the LM", out)
+
+   def test_filled_by_training(self):
+      # a file filled by a run with the LM does for the same run without it
+      cache = self.path("filled.lm")
+      code, out = self.train("filling", "--lm", self.lm_file, "--lm_cache", cache)
+      self.assertEqual(code, 0, out)
+      code, out = self.train("filled", "--lm", self.path("absent.ngram"), "--lm_cache", cache)
+      self.assertEqual(code, 0, out)
+      self.assertEqual(self.weights("filled"), self.weights("filling"))
+
+if __name__ == '__main__':
+   unittest.main()
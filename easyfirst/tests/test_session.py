@@ -0,0 +1,160 @@
+## Copyright 2017 Keisuke Sakaguchi
+##
+##    This code is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This code is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+##    along with this code.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+a few sentences trained on, and parsed through a Session, with the
+n-gram model of ngram.py for the LM: the edits the
+parser makes must be single edits of the candidates of their action, the
+same data must give the same model, and a Session must give the same
+results however the sentences are given to it.
+
+needs the compiled ml module and pattern.en (skipped without them).
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+   from easyfirst import Model, train, DETS, TARGET_PREP
+   from session import Session
+   from pattern.en import pluralize, singularize
+except ImportError, e:
+   missing = str(e)
+else:
+   missing = None
+from common import Token
+import lm
+import ngram
+
+# (form, tag, head) of the gold sentences, and the forms and tags of the
+# sentences to correct (same trees)
+PAIRS = [
+   ("He/PRP/2 eats/VBZ/0 an/DT/4 apple/NN/2 ./././2", "He/PRP eats/VBZ an/DT apples/NNS ./."),
+   ("She/PRP/2 reads/VBZ/0 the/DT/4 books/NNS/2 ./././2", "She/PRP reads/VBZ the/DT book/NN ./."),
+   ("They/PRP/2 like/VBP/0 a/DT/4 dog/NN/2 ./././2", "They/PRP like/VBP the/DT dog/NN ./."),
+   ("We/PRP/2 walk/VBP/0 to/TO/2 the/DT/5 park/NN/3 ./././2", "We/PRP walk/VBP to/TO the/DT parks/NNS ./."),
+   ("The/DT/2 cat/NN/3 sat/VBD/0 on/IN/3 the/DT/6 mat/NN/4 ./././3", "The/DT cat/NN sat/VBD in/IN the/DT mat/NN ./."),
+   ("I/PRP/2 have/VBP/0 two/CD/4 cats/NNS/2 ./././2", "I/PRP have/VBP two/CD cat/NN ./."),
+   ("He/PRP/2 bought/VBD/0 a/DT/4 car/NN/2 ./././2", "He/PRP bought/VBD a/DT cars/NNS ./."),
+   ("The/DT/2 students/NNS/3 read/VBP/0 books/NNS/3 ./././3", "The/DT student/NN read/VBP books/NNS ./."),
+   ("The/DT/2 man/NN/3 sees/VBZ/0 the/DT/5 birds/NNS/3 ./././3", "The/DT man/NN sees/VBZ the/DT bird/NN ./."),
+   ("She/PRP/2 has/VBZ/0 a/DT/4 pen/NN/2 ./././2", "She/PRP has/VBZ an/DT pen/NN ./."),
+   ("The/DT/2 dogs/NNS/3 run/VBP/0 fast/RB/3 ./././3", "The/DT dog/NN run/VBP fast/RB ./."),
+   ("He/PRP/2 writes/VBZ/0 letters/NNS/2 ./././2", "He/PRP writes/VBZ letter/NN ./."),
+]
+
+FEATURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "features", "znp.py")
+
+def _sent(fields, heads):
+   sent = []
+   for id, (f, head) in enumerate(zip(fields, heads), 1):
+      form, tag = f.split("/")[:2]
+      sent.append(Token(id=id, form=form, lem="_", tag=tag, ctag=tag, morph="_", parent=head, prel="DEP", extra="_"))
+   return sent
+
+def _pairs():
+   golds, sents = [], []
+   for gold, noisy in PAIRS:
+      fields = gold.split()
+      heads = [int(f.rsplit("/", 1)[1]) for f in fields]
+      golds.append(_sent([f.rsplit("/", 1)[0] for f in fields], heads))
+      sents.append(_sent(noisy.split(), heads))
+   return sents, golds
+
+def _lm(dir, golds):
+   # the LM of the gold sentences
+   lm_file = os.path.join(dir, "lm.ngram")
+   ngram.NgramLM.train([[tok.form for tok in sent] for sent in golds]).save(lm_file)
+   lm.configure(lm_file)
+
+def _same(res1, res2):
+   return (res1.forms, res1.heads, res1.edits) == (res2.forms, res2.heads, res2.edits)
+
+@unittest.skipIf(missing, "the parser can't be imported: %s" % missing)
+class SessionTest(unittest.TestCase):
+   @classmethod
+   def setUpClass(cls):
+      cls.dir = tempfile.mkdtemp()
+      cls.sents, cls.golds = _pairs()
+      _lm(cls.dir, cls.golds)
+      cls.model_file = cls._train("m")
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.dir)
+
+   @classmethod
+   def _train(cls, name):
+      model = Model(os.path.abspath(FEATURES), os.path.join(cls.dir, "%s.weights" % name), lmFile=lm.path())
+      model.save(os.path.join(cls.dir, "%s.model" % name))
+      random.seed(1)
+      stdout = sys.stdout
+      sys.stdout = StringIO() # the progress of the epochs
+      try:
+         train(False, cls.sents, cls.golds, model, ITERS=3, save_every=None)
+      finally:
+         sys.stdout = stdout
+      return os.path.join(cls.dir, "%s.model" % name)
+
+   def parse(self, **kw):
+      with Session(self.model_file, **kw) as s:
+         return s.parse_many(self.sents)
+
+   def test_edits(self):
+      results = self.parse()
+      self.assertEqual(len(results), len(self.sents))
+      for res in results:
+         for action, pos, old, new in res.edits:
+            if action == "substituteNN":
+               self.assertIn(new, (pluralize(old), singularize(old)))
+            elif action == "substituteDet":
+               self.assertIn(new, DETS)
+            elif action == "substitutePrep":
+               self.assertIn(new, TARGET_PREP)
+
+   def test_trees(self):
+      for sent, res in zip(self.sents, self.parse()):
+         n = len(res.heads)
+         self.assertTrue(all(0 <= h <= n for h in res.heads))
+         self.assertIn(0, res.heads)
+         self.assertEqual(res.conll().count("\n"), n+1)
+
+   def test_inputs(self):
+      # Tokens or (form, tag) pairs, one at a time or in a pool: the same
+      # results, and the sentences given are left as they were
+      forms = [[tok.form for tok in sent] for sent in self.sents]
+      results = self.parse()
+      with Session(self.model_file) as s:
+         for sent, res in zip(self.sents, results):
+            self.assertTrue(_same(s.parse_one(sent), res))
+            self.assertTrue(_same(s.parse_one([(tok.form, tok.tag) for tok in sent]), res))
+      for res1, res2 in zip(self.parse(workers=2, chunksize=5), results):
+         self.assertTrue(_same(res1, res2))
+      self.assertEqual([[tok.form for tok in sent] for sent in self.sents], forms)
+
+   def test_same_model(self):
+      again = self._train("again")
+      weights = lambda model: open(Model.load(model, "FINAL").weightsFile("FINAL")).read()
+      self.assertEqual(weights(self.model_file), weights(again))
+
+if __name__ == '__main__':
+   unittest.main()
@@ -24,7 +24,8 @@ import isprojective
 from explore_policies import ExplorePolicy
 
 from optparse import OptionParser
-from easyfirst import train,Model
+from easyfirst import train,Model,OracleCache
+import lm
 
 usage="""usage: %prog -o model -f features [options] train_file gold_file [dev_file] """ 
 
@@ -39,6 +40,12 @@ parser.add_option("--every",dest="save_every",action="store",type="int",default=
 parser.add_option("--costoracle",dest="follow_incorrect",action="store_true",default=False)
 parser.add_option("--labeled",dest="labeled",action="store_true",default=False)
 parser.add_option("--seed",dest="random_seed",action="store",type="int",default=1)
+parser.add_option("--lm_cache_size",dest="lm_cache_size",action="store",type="int",default=500000,help="LM scores kept in memory (0: no cache)")
+parser.add_option("--lm",dest="lm",default=None,help="kenlm model (default: %s), recorded in the .model file" % lm.DEFAULT_LM)
+parser.add_option("--lm_load",dest="lm_load",type="choice",choices=sorted(lm.LOAD_METHODS),default=None,help="kenlm load method (default: kenlm's): %s" % ", ".join(sorted(lm.LOAD_METHODS)))
+parser.add_option("--lm_cache",dest="lm_cache",default=None,help="sqlite file keeping the LM scores across runs (or made by precompute_lm.py)")
+parser.add_option("--workers",dest="workers",type="int",default=1,help="train each epoch in this many processes, mixing their weights (iterative parameter mixing)")
+parser.add_option("--oracle_cache",dest="oracle_cache",default=None,help="file keeping the oracle's alignments of the training pairs across runs (or made by precompute_oracle.py)")
 
 opts, args = parser.parse_args()
 
@@ -57,7 +64,12 @@ if TRAIN_FILE[-3:] == "E00":
     print TRAIN_FILE[-3:]
     attachonly = True
 
-model = Model(FEATURES, "%s.weights" % MODEL)
+lm.configure(opts.lm, opts.lm_load)
+have_lm = lm.available(lm.path())
+if not have_lm and not (opts.lm_cache and opts.lm_cache_size > 0):
+   sys.stderr.write("training needs the LM, or an --lm_cache file with its scores, and %s is not there (see --lm)\n" % lm.path())
+   sys.exit(1)
+model = Model(FEATURES, "%s.weights" % MODEL, lmFile=lm.absolute(opts.lm) if opts.lm else None)
 model.save("%s.model" % MODEL)
 
 dev = [s for s in io.conll_to_sents(file(DEV_FILE))] if DEV_FILE else []
@@ -76,9 +88,25 @@ random.seed(opts.random_seed)
 if opts.follow_incorrect:
    explore=ExplorePolicy(2,0.9) # almost always
 else: explore=None
+lm_cache = None
+if opts.lm_cache_size > 0:
+   # the file is taken as it is when the LM is not there
+   lm_cache = lm.ScoreCache(opts.lm_cache_size, opts.lm_cache, lm.lm_id(lm.path()) if have_lm else None)
+   # with a cache file made for the LM (by precompute_lm.py, or a previous
+   # run with the LM), the LM is only loaded for the first score missing
+   # from it, and without the LM that score fails the run
+   if lm_cache.order:
+      lm.defer(lm_cache.order)
+   elif not have_lm:
+      sys.stderr.write("%s has no scores of an LM (see precompute_lm.py), and %s is not there (see --lm)\n" % (opts.lm_cache, lm.path()))
+      sys.exit(1)
+   elif opts.lm_cache:
+      # the scores of this run will be in the file: the next runs can
+      # defer the LM
+      lm_cache.set_order(lm.model().order)
 if (opts.labeled):
    from easyfirst import train_labeled
    train_labeled(train_sents, gold_sents, model, dev, opts.iters,save_every=opts.save_every,explore_policy=explore,shuffle_sents=True)
 else:
-   train(attachonly, train_sents, gold_sents, model, dev, opts.iters,save_every=opts.save_every,explore_policy=explore,shuffle_sents=True)
+   train(attachonly, train_sents, gold_sents, model, dev, opts.iters,save_every=opts.save_every,explore_policy=explore,shuffle_sents=True,lm_cache=lm_cache,oracle_cache=OracleCache(opts.oracle_cache),workers=opts.workers)
 